@@ -2,13 +2,15 @@
 
 亦可直接使用backends子模块下的缓存类
 未手动设置缓存类时,装饰器默认使用字典缓存类DictCache
+长期运行的进程建议使用有界缓存类BoundedCache(支持LRU/LFU淘汰与过期键主动回收)
+需在worker重启后保留、或在同一主机的多个worker间共享时可使用磁盘缓存类DiskCache
 参考:
     https://github.com/lonetwin/supycache
 """
 
 
 from .backends import DictCache
-from .cdf import CacheDecoratorFactory
+from .cdf import CacheDecoratorFactory, invalidate_tags as _invalidate_tags
 
 
 default_cache_backend = None
@@ -16,7 +18,7 @@ default_cache_backend = None
 
 def get_default_backend():
     global default_cache_backend
-    if not default_cache_backend:
+    if default_cache_backend is None:
         default_cache_backend = DictCache()
     return default_cache_backend
 
@@ -27,16 +29,35 @@ def set_default_backend(backend):
 
 
 def easycache(**options):
-    valid_options = {
-        'backend',
-        'cache_key',
-        'expire_key',
-        'ignore_errors',
-    }
-
-    if valid_options.isdisjoint(options):
-        raise KeyError(f"Expecting optional arguments: {','.join(valid_options)}")
-
+    """ 缓存装饰器
+
+    未传入cache_key与expire_key时根据函数参数自动生成缓存键,用法类似functools.lru_cache(但支持过期时间与各类后端):
+        @easycache(dexp=60, ignore_args=['db'])
+        def query_user(db, user_id, fields=None):
+            ...
+    可选参数见CacheDecoratorFactory(backend/cache_key/expire_key/ignore_errors/single_flight/lease_pool/...),
+    其余参数(如dexp)将更新至缓存后端配置
+    metrics=True时统计该函数的命中率、加载耗时与热点键,通过commutils.cache.metrics.render_prometheus()导出
+    按标签批量失效: 读函数以tags声明依赖的标签,写函数以expire_tags声明执行成功后需失效的标签
+        @easycache(dexp=600, tags=['users', 'user:{0}'])
+        def get_user(user_id):
+            ...
+
+        @easycache(expire_tags=['user:{0}'])
+        def update_user(user_id, **fields):
+            ...
+    """
     backend = options.pop('backend', get_default_backend())
 
     return lambda function: CacheDecoratorFactory(backend, **options)(function)
+
+
+def invalidate_tags(*tags, backend=None, tag_ttl=2592000):
+    """ 使依赖指定标签的缓存全部失效,未传入backend时使用默认缓存后端
+
+    :param tags: 标签
+    :param backend: 缓存后端,需与被装饰函数使用的后端一致
+    :param tag_ttl: 标签令牌的过期时间(秒)
+    :return:
+    """
+    _invalidate_tags(backend if backend is not None else get_default_backend(), tags, tag_ttl)
@@ -1,8 +1,14 @@
 import warnings
 from .dict_cache import BaseCache, DictCache
+from .bounded_cache import BoundedCache, EvictionPolicy, LRUPolicy, LFUPolicy
+from .striped_cache import StripedCache
+from .disk_cache import DiskCache
+from .shm_cache import SharedMemoryCache
+from .instrumented_cache import InstrumentedCache
 
 try:
     from .redis_cache import RedisCache
+    from .tiered_cache import TieredCache
 except ImportError:
     warnings.warn('Missing optional caching backends dependency, '
                   'Some backends will not be available')
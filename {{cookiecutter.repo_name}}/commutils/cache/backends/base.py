@@ -32,5 +32,37 @@ class BaseCache(object):
     def flush_all(self) -> bool:
         raise NotImplementedError()
 
+    @property
+    def default_expire(self) -> Optional[Union[int, float]]:
+        """ 默认过期时间(秒),None表示永不过期
+        """
+        return self._config.get("dexp")
+
     def update_cfg(self, **cfg_kwags):
         self._config.update(cfg_kwags)
+
+    def instrumented(self, name=None, **kwargs):
+        """ 返回带指标统计的包装对象,指标可通过commutils.cache.metrics.render_prometheus()导出
+
+        :param name: 指标名称,默认为后端类名
+        :param kwargs: 透传给InstrumentedCache的参数,如sizeof/top_k/hot_key_sample
+        :return:
+        """
+        from .instrumented_cache import InstrumentedCache
+        return InstrumentedCache(self, name, **kwargs)
+
+    """以下为异步接口,默认直接调用同步方法(适用于进程内缓存);涉及网络I/O的后端应覆盖实现"""
+    async def aset(self, key, value, expire: Union[int, float] = None) -> Optional[bool]:
+        return self.set(key, value, expire)
+
+    async def aset_many(self, values: Dict[Key, Any], expire: Union[int, float] = None, keep_type=True) -> List[Key]:
+        return self.set_many(values, expire, keep_type)
+
+    async def aget(self, key) -> Any:
+        return self.get(key)
+
+    async def aget_many(self, keys: Iterable[Key]) -> Dict[Key, Any]:
+        return self.get_many(keys)
+
+    async def adelete(self, *keys) -> bool:
+        return self.delete(*keys)
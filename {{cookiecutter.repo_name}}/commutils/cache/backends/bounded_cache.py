@@ -0,0 +1,302 @@
+""" 有界进程内缓存类
+
+在DictCache的基础上增加:
+    1) 容量上限: 最大条目数(max_entries)和/或最大字节数(max_bytes)
+    2) 可插拔的淘汰策略: LRU/LFU, 读写均为O(1)
+    3) 基于最小堆的过期索引: 每次读写顺带回收少量已过期的键, 无需遍历整个字典
+"""
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from .base import BaseCache
+
+
+class EvictionPolicy:
+    """ 淘汰策略基类
+
+    只负责维护键的淘汰顺序,不保存缓存值;子类的所有方法均应为O(1)
+    """
+
+    def add(self, key):
+        raise NotImplementedError()
+
+    def touch(self, key):
+        raise NotImplementedError()
+
+    def remove(self, key):
+        raise NotImplementedError()
+
+    def victim(self):
+        """ 返回下一个应被淘汰的键
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+
+class LRUPolicy(EvictionPolicy):
+    """ 最近最少使用(Least Recently Used)淘汰策略
+    """
+
+    def __init__(self):
+        self._order = OrderedDict()
+
+    def add(self, key):
+        self._order[key] = None
+
+    def touch(self, key):
+        self._order.move_to_end(key)
+
+    def remove(self, key):
+        self._order.pop(key, None)
+
+    def victim(self):
+        return next(iter(self._order))
+
+    def clear(self):
+        self._order.clear()
+
+
+class LFUPolicy(EvictionPolicy):
+    """ 最不经常使用(Least Frequently Used)淘汰策略
+
+    按访问频次分桶,同一频次内按LRU顺序淘汰
+    """
+
+    def __init__(self):
+        self._freq = {}
+        self._buckets = {}
+        self._min_freq = 0
+
+    def add(self, key):
+        self._freq[key] = 1
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._min_freq = 1
+
+    def touch(self, key):
+        freq = self._freq[key]
+        self._unlink(key, freq)
+        if self._min_freq == freq and freq not in self._buckets:
+            self._min_freq = freq + 1
+
+        self._freq[key] = freq + 1
+        self._buckets.setdefault(freq + 1, OrderedDict())[key] = None
+
+    def remove(self, key):
+        freq = self._freq.pop(key, None)
+        if freq is not None:
+            self._unlink(key, freq)
+
+    def victim(self):
+        if self._min_freq not in self._buckets:
+            # 仅在最小频次桶被主动删除/过期清空后触发,代价为当前不同频次的数量
+            self._min_freq = min(self._buckets)
+        return next(iter(self._buckets[self._min_freq]))
+
+    def clear(self):
+        self._freq.clear()
+        self._buckets.clear()
+        self._min_freq = 0
+
+    def _unlink(self, key, freq):
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+
+
+EVICTION_POLICIES = {
+    'lru': LRUPolicy,
+    'lfu': LFUPolicy,
+}
+
+
+class BoundedCache(BaseCache):
+    """ 有界字典缓存类
+
+    注意:
+        1) max_bytes依赖sizeof估算值的大小,默认的sys.getsizeof为浅层计算,容器类型的值建议传入自定义的sizeof
+        2) 过期索引采用惰性删除的最小堆,重复写入同一个键会残留旧的堆节点,堆过大时会整体重建
+    """
+
+    def __init__(self, dexp=3153600000, max_entries=10000, max_bytes=None, policy='lru',
+                 sizeof=sys.getsizeof, reap_batch=16):
+        """
+        :param dexp: 默认过期时间(秒)
+        :param max_entries: 最大条目数,None表示不限制
+        :param max_bytes: 最大字节数,None表示不限制
+        :param policy: 淘汰策略,可选'lru'/'lfu'或EvictionPolicy实例
+        :param sizeof: 估算值大小的函数
+        :param reap_batch: 每次读写时最多顺带回收的过期键数量
+        """
+        super(BoundedCache, self).__init__(dexp)
+        assert max_entries is None or max_entries > 0, "max_entries必须为正整数"
+        assert max_bytes is None or max_bytes > 0, "max_bytes必须为正整数"
+
+        self._cache = {}  # key -> (value, expire_ts, size)
+        self._policy = EVICTION_POLICIES[policy]() if isinstance(policy, str) else policy
+        self._expiry_heap = []  # (expire_ts, seq, key), seq用于避免比较不同类型的键
+        self._seq = itertools.count()
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._reap_batch = reap_batch
+        self._cur_bytes = 0
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def cache(self):
+        now = time.time()
+        with self._lock:
+            return {key: val for key, (val, expire_ts, _) in self._cache.items()
+                    if expire_ts is None or expire_ts >= now}
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._cache),
+                'bytes': self._cur_bytes,
+            }
+
+    def __len__(self):
+        return len(self._cache)
+
+    def set(self, key, value, expire=None):
+        expire_sec = expire if expire is not None else self._config["dexp"]
+        expire_ts = None if expire_sec is None else time.time() + expire_sec
+        size = self._sizeof(value) if self._max_bytes is not None else 0
+
+        with self._lock:
+            self._reap_expired(self._reap_batch)
+            if self._max_bytes is not None and size > self._max_bytes:
+                # 单个值已超过容量上限,不写入并移除旧值
+                self._discard(key)
+                return False
+
+            if key in self._cache:
+                self._cur_bytes -= self._cache[key][2]
+                self._policy.touch(key)
+            else:
+                self._policy.add(key)
+            self._cache[key] = (value, expire_ts, size)
+            self._cur_bytes += size
+
+            if expire_ts is not None:
+                heapq.heappush(self._expiry_heap, (expire_ts, next(self._seq), key))
+                if len(self._expiry_heap) > 2 * len(self._cache) + 64:
+                    self._rebuild_heap()
+
+            self._evict_overflow()
+        return True
+
+    def set_many(self, values, expire=None, keep_type=True):
+        assert keep_type == True, "不支持keep_type=False"
+        return [key for key, value in values.items() if not self.set(key, value, expire)]
+
+    def get(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                self.misses += 1
+                self._reap_expired(self._reap_batch)
+                return None
+
+            if item[1] is not None and time.time() > item[1]:
+                self._discard(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._policy.touch(key)
+            self.hits += 1
+            return item[0]
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        else:
+            return {key: self.get(key) for key in keys}
+
+    def replace(self, key, value, expire=None) -> bool:
+        with self._lock:
+            if key in self._cache:
+                self.set(key, value, expire)
+            else:
+                raise KeyError
+
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._discard(key)
+
+        return True
+
+    def flush_all(self):
+        with self._lock:
+            self._cache.clear()
+            self._policy.clear()
+            self._expiry_heap.clear()
+            self._cur_bytes = 0
+
+        return True
+
+    def purge_expired(self):
+        """ 回收所有已过期的键,返回回收数量
+        """
+        with self._lock:
+            return self._reap_expired(None)
+
+    def _discard(self, key):
+        item = self._cache.pop(key, None)
+        if item is not None:
+            self._cur_bytes -= item[2]
+            self._policy.remove(key)
+
+    def _evict_overflow(self):
+        while self._cache and (
+                (self._max_entries is not None and len(self._cache) > self._max_entries) or
+                (self._max_bytes is not None and self._cur_bytes > self._max_bytes)):
+            self._discard(self._policy.victim())
+            self.evictions += 1
+
+    def _reap_expired(self, limit):
+        """ 从堆顶回收已过期的键
+
+        :param limit: 最多回收的数量,None表示回收全部
+        :return: 实际回收数量
+        """
+        now = time.time()
+        heap = self._expiry_heap
+        reaped = 0
+        while heap and heap[0][0] <= now and (limit is None or reaped < limit):
+            expire_ts, _, key = heapq.heappop(heap)
+            item = self._cache.get(key)
+            # 堆节点与当前值的过期时间不一致说明该键已被覆盖写入,属于残留节点
+            if item is not None and item[1] == expire_ts:
+                self._discard(key)
+                self.expirations += 1
+                reaped += 1
+        return reaped
+
+    def _rebuild_heap(self):
+        self._expiry_heap = [(expire_ts, next(self._seq), key) for key, (_, expire_ts, _) in self._cache.items()
+                             if expire_ts is not None]
+        heapq.heapify(self._expiry_heap)
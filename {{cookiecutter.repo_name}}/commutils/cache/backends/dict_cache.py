@@ -10,6 +10,7 @@ class DictCache(BaseCache):
     """ 字典缓存类
 
     内存清理存在滞后性：缓存到期不会主动从缓存中移除键值，会在下一次调用get方法时移除
+    单次读写依赖GIL保证不抛异常,但不提供复合操作的原子性;多线程高并发场景建议使用StripedCache
     """
 
     def __init__(self, dexp=3153600000):
@@ -36,12 +37,13 @@ class DictCache(BaseCache):
         :param key:
         :return: 过期
         """
-        if key not in self._cache.keys():
-            # 键不存在时直接返回,防止索引操作将不存在的键写入缓存造成空间浪费
+        # 使用dict.get而非"先判断后索引",既防止索引操作将不存在的键写入缓存,也避免多线程下判断与读取之间键被删除
+        item = self._cache.get(key)
+        if item is None:
             return None
 
-        (val, expire_ts) = self._cache[key]
-        if expire_ts is not None and time.time() > expire_ts and key in self._cache.keys():
+        (val, expire_ts) = item
+        if expire_ts is not None and time.time() > expire_ts:
             self.delete(key)
             return None
         else:
@@ -63,7 +65,8 @@ class DictCache(BaseCache):
 
     def delete(self, *keys):
         for key in keys:
-            del (self._cache[key])
+            # 键可能已被其它线程删除,pop为单次原子操作
+            self._cache.pop(key, None)
 
         return True
 
@@ -0,0 +1,278 @@
+""" 基于SQLite的本地磁盘缓存类
+
+适用场景: 单机多个worker进程(gunicorn/uWSGI)共享、且需在worker重启后保留的缓存
+实现要点:
+    1) WAL模式: 读写互不阻塞,多进程并发读;写操作在进程间串行化(busy_timeout内等待)
+    2) 连接按"进程+线程"惰性创建,fork后的子进程不会复用父进程的连接
+    3) 条目数与总字节数由触发器维护在meta表中,容量检查为O(1);超限时按访问时间淘汰(近似LRU)
+    4) 过期键在读取时删除,并每隔sweep_interval次写入批量清理一次;compact()回收磁盘空间
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from functools import partial
+from typing import Union
+
+from .base import BaseCache
+from ..codec import Codec, get_codec
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key PRIMARY KEY,
+    value BLOB NOT NULL,
+    expire_ts REAL,
+    access_ts REAL NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_expire_ts ON cache (expire_ts) WHERE expire_ts IS NOT NULL;
+CREATE INDEX IF NOT EXISTS cache_access_ts ON cache (access_ts);
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    count INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+    UPDATE meta SET count = count + 1, size = size + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache BEGIN
+    UPDATE meta SET size = size + NEW.size - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+    UPDATE meta SET count = count - 1, size = size - OLD.size WHERE id = 0;
+END;
+"""
+
+_UPSERT = """
+INSERT INTO cache (key, value, expire_ts, access_ts, size) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    value = excluded.value, expire_ts = excluded.expire_ts, access_ts = excluded.access_ts, size = excluded.size
+"""
+
+# SQLite单条语句的参数个数上限(旧版本为999)
+_MAX_VARIABLES = 900
+
+
+class DiskCache(BaseCache):
+    """ 磁盘缓存类
+
+    注意: 值通过codec序列化后存储,默认使用pickle,仅适用于可信数据
+    """
+
+    def __init__(self, path, dexp=3153600000, max_entries=None, max_bytes=None,
+                 codec: Union[str, Codec] = 'pickle', timeout=5, touch_interval=60, sweep_interval=1000,
+                 cull_batch=100, **codec_kwargs):
+        """
+        :param path: 数据库文件路径,同一主机上的多个进程使用相同路径即可共享缓存
+        :param dexp: 默认过期时间(秒)
+        :param max_entries: 最大条目数,None表示不限制
+        :param max_bytes: 值的最大总字节数,None表示不限制
+        :param codec: 编解码器,可选'pickle'/'json'/'msgpack'或Codec实例
+        :param timeout: 等待其它进程释放写锁的最长时间(秒)
+        :param touch_interval: 命中时距上次更新访问时间超过该秒数才更新,以减少读操作引起的写入
+        :param sweep_interval: 每隔多少次写入批量清理一次过期键
+        :param cull_batch: 超出容量时每批淘汰的键数量
+        :param codec_kwargs: 透传给Codec的compression/threshold参数
+        """
+        super(DiskCache, self).__init__(dexp)
+
+        self.path = os.path.abspath(path)
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._codec = get_codec(codec, **codec_kwargs)
+        self._timeout = timeout
+        self._touch_interval = touch_interval
+        self._sweep_interval = sweep_interval
+        self._cull_batch = cull_batch
+        self._local = threading.local()
+        self._writes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn.executescript(_SCHEMA)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self._timeout, isolation_level=None, check_same_thread=False)
+            # auto_vacuum需在建表前设置才会生效
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @property
+    def cache(self):
+        rows = self._conn.execute("SELECT key, value FROM cache WHERE expire_ts IS NULL OR expire_ts >= ?",
+                                  (time.time(),))
+        return {key: self._codec.decode(value) for key, value in rows}
+
+    @property
+    def stats(self):
+        count, size = self._conn.execute("SELECT count, size FROM meta WHERE id = 0").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': count, 'bytes': size}
+
+    def set(self, key, value, expire=None):
+        self.set_many({key: value}, expire)
+        return True
+
+    def set_many(self, values, expire=None, keep_type=True):
+        assert keep_type == True, "不支持keep_type=False"
+        now = time.time()
+        expire_sec = expire if expire is not None else self._config["dexp"]
+        expire_ts = None if expire_sec is None else now + expire_sec
+
+        rows = []
+        for key, value in values.items():
+            blob = self._codec.encode(value)
+            rows.append((key, blob, expire_ts, now, len(blob)))
+
+        conn = self._conn
+        with self._transaction(conn):
+            conn.executemany(_UPSERT, rows)
+            self._writes += 1
+            if self._writes % self._sweep_interval == 0:
+                self._sweep(conn, now)
+            self._cull(conn)
+        return []
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+
+        keys = list(keys)
+        now = time.time()
+        conn = self._conn
+        found, expired, touched = {}, [], []
+        for i in range(0, len(keys), _MAX_VARIABLES):
+            chunk = keys[i:i + _MAX_VARIABLES]
+            rows = conn.execute(f"SELECT key, value, expire_ts, access_ts FROM cache "
+                                f"WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            for key, value, expire_ts, access_ts in rows:
+                if expire_ts is not None and expire_ts < now:
+                    expired.append((key, now))
+                    continue
+                found[key] = self._codec.decode(value)
+                if now - access_ts > self._touch_interval:
+                    touched.append((now, key))
+
+        if expired or touched:
+            with self._transaction(conn):
+                conn.executemany("DELETE FROM cache WHERE key = ? AND expire_ts < ?", expired)
+                conn.executemany("UPDATE cache SET access_ts = ? WHERE key = ?", touched)
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return {key: found.get(key) for key in keys}
+
+    def replace(self, key, value, expire=None):
+        now = time.time()
+        expire_sec = expire if expire is not None else self._config["dexp"]
+        blob = self._codec.encode(value)
+
+        conn = self._conn
+        with self._transaction(conn):
+            cursor = conn.execute("UPDATE cache SET value = ?, expire_ts = ?, access_ts = ?, size = ? "
+                                  "WHERE key = ? AND (expire_ts IS NULL OR expire_ts >= ?)",
+                                  (blob, None if expire_sec is None else now + expire_sec, now, len(blob), key, now))
+            if cursor.rowcount == 0:
+                raise KeyError(key)
+            self._cull(conn)
+        return True
+
+    def delete(self, *keys):
+        conn = self._conn
+        with self._transaction(conn):
+            conn.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+        return True
+
+    def flush_all(self):
+        conn = self._conn
+        with self._transaction(conn):
+            conn.execute("DELETE FROM cache")
+        return True
+
+    def purge_expired(self):
+        """ 删除所有已过期的键,返回删除数量
+        """
+        conn = self._conn
+        with self._transaction(conn):
+            return self._sweep(conn, time.time(), limit=None)
+
+    def compact(self):
+        """ 清理过期键并回收空闲页、截断WAL文件,建议在低峰期调用
+        """
+        self.purge_expired()
+        conn = self._conn
+        conn.execute("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def aset(self, key, value, expire=None):
+        return await self._run_in_executor(self.set, key, value, expire)
+
+    async def aset_many(self, values, expire=None, keep_type=True):
+        return await self._run_in_executor(self.set_many, values, expire, keep_type)
+
+    async def aget(self, key):
+        return await self._run_in_executor(self.get, key)
+
+    async def aget_many(self, keys):
+        return await self._run_in_executor(self.get_many, keys)
+
+    async def adelete(self, *keys):
+        return await self._run_in_executor(self.delete, *keys)
+
+    def _transaction(self, conn):
+        return _Transaction(conn)
+
+    def _sweep(self, conn, now, limit=1000):
+        sql = "DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE expire_ts < ?"
+        sql += ")" if limit is None else f" LIMIT {int(limit)})"
+        return conn.execute(sql, (now,)).rowcount
+
+    def _cull(self, conn):
+        if self._max_entries is None and self._max_bytes is None:
+            return
+
+        while True:
+            count, size = conn.execute("SELECT count, size FROM meta WHERE id = 0").fetchone()
+            if (self._max_entries is None or count <= self._max_entries) and \
+                    (self._max_bytes is None or size <= self._max_bytes):
+                return
+
+            # 优先清理过期键,再按访问时间淘汰
+            if self._sweep(conn, time.time(), self._cull_batch):
+                continue
+            excess = max(count - self._max_entries if self._max_entries is not None else 1, 1)
+            conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY access_ts LIMIT ?)",
+                         (min(excess, self._cull_batch),))
+
+    @staticmethod
+    async def _run_in_executor(func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, partial(func, *args))
+
+
+class _Transaction:
+    """ BEGIN IMMEDIATE事务: 开始时即获取写锁,避免多进程并发写时的死锁重试
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
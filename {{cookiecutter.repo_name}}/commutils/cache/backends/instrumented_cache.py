@@ -0,0 +1,161 @@
+""" 带指标统计的缓存包装类
+
+包装任意缓存后端,记录命中/未命中/写入/删除/异常次数、各操作延迟、写入值大小与热点键,
+后端自身的统计(如BoundedCache的evictions/entries)在导出时一并读取。
+通常通过BaseCache.instrumented(name)创建,指标注册在commutils.cache.metrics中
+"""
+
+import sys
+import time
+
+from .base import BaseCache
+from ..metrics import CacheMetrics, get_metrics
+
+
+class InstrumentedCache(BaseCache):
+    """ 指标统计包装类
+    """
+
+    def __init__(self, backend: BaseCache, name=None, sizeof=sys.getsizeof, **metrics_kwargs):
+        """
+        :param backend: 被包装的缓存后端
+        :param name: 指标名称,默认为后端类名
+        :param sizeof: 计算写入值大小的函数,None表示不统计
+        :param metrics_kwargs: 透传给CacheMetrics的参数,如top_k/hot_key_sample
+        """
+        super(InstrumentedCache, self).__init__(backend._config["dexp"])
+        # 与被包装的后端共享配置,装饰器读取的dexp与后端一致
+        self._config = backend._config
+
+        self._backend = backend
+        self._sizeof = sizeof
+        stats = (lambda: backend.stats) if hasattr(backend, 'stats') else None
+        self.metrics: CacheMetrics = get_metrics(name or type(backend).__name__, 'backend', stats=stats,
+                                                 **metrics_kwargs)
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def cache(self):
+        return self._backend.cache
+
+    @property
+    def stats(self):
+        return self.metrics.snapshot()
+
+    def __getattr__(self, name):
+        # 其它后端特有的方法(如purge_expired/compact)直接转发
+        if name == '_backend':
+            raise AttributeError(name)
+        return getattr(self._backend, name)
+
+    def set(self, key, value, expire=None):
+        start_time = time.perf_counter()
+        result = self._call(self._backend.set, key, value, expire)
+        self.metrics.record('set', time.perf_counter() - start_time, 'sets', keys=(key,))
+        self._observe_sizes((value,))
+        return result
+
+    def set_many(self, values, expire=None, keep_type=True):
+        start_time = time.perf_counter()
+        failed = self._call(self._backend.set_many, values, expire, keep_type)
+        self.metrics.record('set_many', time.perf_counter() - start_time, 'sets', len(values) - len(failed or ()),
+                            keys=values)
+        self._observe_sizes(values.values())
+        return failed
+
+    def get(self, key):
+        start_time = time.perf_counter()
+        value = self._call(self._backend.get, key)
+        self.metrics.record('get', time.perf_counter() - start_time, 'hits' if value is not None else 'misses',
+                            keys=(key,))
+        return value
+
+    def get_many(self, keys):
+        start_time = time.perf_counter()
+        result = self._call(self._backend.get_many, keys)
+        self._record_many(time.perf_counter() - start_time, result)
+        return result
+
+    def replace(self, key, value, expire=None):
+        start_time = time.perf_counter()
+        result = self._call(self._backend.replace, key, value, expire)
+        self.metrics.record('replace', time.perf_counter() - start_time, 'sets', keys=(key,))
+        self._observe_sizes((value,))
+        return result
+
+    def delete(self, *keys):
+        start_time = time.perf_counter()
+        result = self._call(self._backend.delete, *keys)
+        self.metrics.record('delete', time.perf_counter() - start_time, 'deletes', len(keys))
+        return result
+
+    def flush_all(self):
+        start_time = time.perf_counter()
+        result = self._call(self._backend.flush_all)
+        self.metrics.record('flush_all', time.perf_counter() - start_time)
+        return result
+
+    def update_cfg(self, **cfg_kwags):
+        self._backend.update_cfg(**cfg_kwags)
+
+    async def aset(self, key, value, expire=None):
+        start_time = time.perf_counter()
+        result = await self._acall(self._backend.aset, key, value, expire)
+        self.metrics.record('set', time.perf_counter() - start_time, 'sets', keys=(key,))
+        self._observe_sizes((value,))
+        return result
+
+    async def aset_many(self, values, expire=None, keep_type=True):
+        start_time = time.perf_counter()
+        failed = await self._acall(self._backend.aset_many, values, expire, keep_type)
+        self.metrics.record('set_many', time.perf_counter() - start_time, 'sets', len(values) - len(failed or ()),
+                            keys=values)
+        self._observe_sizes(values.values())
+        return failed
+
+    async def aget(self, key):
+        start_time = time.perf_counter()
+        value = await self._acall(self._backend.aget, key)
+        self.metrics.record('get', time.perf_counter() - start_time, 'hits' if value is not None else 'misses',
+                            keys=(key,))
+        return value
+
+    async def aget_many(self, keys):
+        start_time = time.perf_counter()
+        result = await self._acall(self._backend.aget_many, keys)
+        self._record_many(time.perf_counter() - start_time, result)
+        return result
+
+    async def adelete(self, *keys):
+        start_time = time.perf_counter()
+        result = await self._acall(self._backend.adelete, *keys)
+        self.metrics.record('delete', time.perf_counter() - start_time, 'deletes', len(keys))
+        return result
+
+    def _call(self, method, *args):
+        try:
+            return method(*args)
+        except Exception:
+            self.metrics.incr('errors')
+            raise
+
+    async def _acall(self, method, *args):
+        try:
+            return await method(*args)
+        except Exception:
+            self.metrics.incr('errors')
+            raise
+
+    def _record_many(self, seconds, result):
+        hits = sum(1 for value in result.values() if value is not None)
+        self.metrics.record('get_many', seconds, 'hits', hits, keys=result)
+        self.metrics.incr('misses', len(result) - hits)
+
+    def _observe_sizes(self, values):
+        if self._sizeof is None:
+            return
+        for value in values:
+            self.metrics.observe_size(self._sizeof(value))
@@ -1,80 +1,226 @@
 """ 借助redis实现的缓存类
+
+所有键写入时会加上命名空间前缀"{namespace}:",不在本地维护键列表:
+    1) 读写均为O(1),与键的数量无关
+    2) flush_all通过SCAN按前缀分批遍历并UNLINK(异步释放内存),不会长时间阻塞Redis
+批量操作(set_many/get_many/delete)按chunk_size分块,通过非事务pipeline在一次往返中发送;
+集群模式下按slot分组,MGET/MSET/DEL逐组直接发送(集群pipeline不支持多键命令)
 """
 
-import threading
+import asyncio
+import re
+from functools import partial
 from typing import Union
 
 from .base import BaseCache
-from commutils.db.redis_conn import RedisPool
+from ..codec import Codec, get_codec
+from commutils.db.redis_conn import RedisPool, AsyncRedisPool
 
 
 class RedisCache(BaseCache):
+    """ Redis缓存类
+
+    异步接口(aget/aset等)优先使用async_pool;未传入async_pool时在默认线程池中执行同步方法
+    未设置codec时按原样读写(值需为str/bytes/数字);设置codec后可缓存任意Python对象,此时连接池不能开启decode_responses
+    注意: 多个RedisCache实例使用相同的namespace时共享键空间,flush_all会清除该命名空间下的所有键
+    """
 
-    def __init__(self, pool: RedisPool, dexp=None):
+    def __init__(self, pool: RedisPool, dexp=None, async_pool: AsyncRedisPool = None,
+                 codec: Union[str, Codec] = None, namespace='easycache', scan_count=1000, chunk_size=1000,
+                 **codec_kwargs):
+        """
+        :param pool: Redis连接池
+        :param dexp: 默认过期时间(秒),None表示永不过期
+        :param async_pool: 异步Redis连接池
+        :param codec: 编解码器,可选None/'pickle'/'json'/'msgpack'或Codec实例
+        :param namespace: 键的命名空间前缀,不能为空
+        :param scan_count: flush_all时每批SCAN/UNLINK的键数量
+        :param chunk_size: 批量操作时每个pipeline包含的命令数/每条MGET、DEL命令包含的键数量
+        :param codec_kwargs: 透传给Codec的compression/threshold参数,如compression='zstd'
+        """
         super(RedisCache, self).__init__(dexp)
+        assert namespace, "namespace不能为空,否则flush_all将清空整个数据库"
 
         self._cache = pool
-        self._local_keys = []
-        self._lock = threading.Lock()
+        self._async_cache = async_pool
+        self._codec = get_codec(codec, **codec_kwargs)
+        self._prefix = f"{namespace}:"
+        self._scan_count = scan_count
+        self._chunk_size = chunk_size
 
     @property
     def cache(self):
-        return self.get_many(self._local_keys)
+        return self.get_many(list(self.iter_keys()))
+
+    @property
+    def pool(self) -> RedisPool:
+        return self._cache
+
+    @property
+    def namespace(self):
+        return self._prefix[:-1]
+
+    def iter_keys(self):
+        """ 遍历命名空间下的所有键(不含前缀),基于SCAN,不阻塞Redis
+        """
+        prefix_len = len(self._prefix)
+        for name in self._cache.scan_iter(match=self._match_pattern(), count=self._scan_count):
+            yield name[prefix_len:] if isinstance(name, str) else name[prefix_len:].decode()
 
     def set(self, key, value, expire=None):
-        self._cache.set(key, value, expire if expire is not None else self._config["dexp"])
-        self._push_key(key) if key not in self._local_keys else None
+        self._cache.set(self._key(key), self._encode(value), expire if expire is not None else self._config["dexp"])
 
     def set_many(self, values, expire=None, keep_type=True):
-        """
-        原子性操作以确保_local_keys变量维护的键是正确的
+        """ 批量写入
+
+        每chunk_size个键为一个非事务pipeline,每个键一条SET ... EX命令(过期时间与写入原子生效);
+        不需要过期时间且keep_type为False时改用MSET(集群模式下按slot分组)
         :param values:
         :param expire:
         :param keep_type:
-        :return:
+        :return: 写入失败的键
         """
-        with self._cache.pipeline() as pipe:
-            if expire is None and self._config["dexp"] is None:
-                if keep_type:
-                    [pipe.set(key, value) for key, value in values.items()]
-                else:
-                    pipe.mset(values)
-            else:
-                expire_sec = expire if expire is not None else self._config["dexp"]
-                for key, value in values.items():
-                    pipe.set(key, value)
-                    pipe.expire(key, expire_sec)
-
-            pipe.execute()
-
-        self._push_key([key for key in values.keys() if key not in self._local_keys])
+        expire_sec = expire if expire is not None else self._config["dexp"]
+        items = [(self._key(key), self._encode(value)) for key, value in values.items()]
+
+        if expire_sec is None and not keep_type:
+            encoded = dict(items)
+            self._cache.execute_batches(encoded.keys(), lambda target, batch: target.mset(
+                {name: encoded[name] for name in batch}), self._chunk_size)
+            return []
+
+        failed = []
+        for i in range(0, len(items), self._chunk_size):
+            chunk = items[i:i + self._chunk_size]
+            with self._cache.pipeline(transaction=False) as pipe:
+                for name, value in chunk:
+                    pipe.set(name, value, ex=expire_sec)
+                results = pipe.execute()
+            failed.extend(name for (name, _), ok in zip(chunk, results) if not ok)
+
+        prefix_len = len(self._prefix)
+        return [name[prefix_len:] for name in failed]
 
     def get(self, key):
-        return self._cache.get(key)
+        return self._decode(self._cache.get(self._key(key)))
 
     def get_many(self, keys):
-        values = self._cache.mget(keys)
-        return {key: values[i] for i, key in enumerate(keys)}
-
-    def replace(self, key, value, expire):
-        if key in self._local_keys:
-            self._cache.set(key, value, expire)
-        else:
-            raise KeyError
+        """ 批量读取: 按chunk_size(集群模式下再按slot)拆分为多条MGET,单机模式下在同一个pipeline中发送
+        """
+        if not keys:
+            return {}
+
+        names = {self._key(key): key for key in keys}
+        values = {}
+        for batch, batch_values in self._cache.execute_batches(
+                names.keys(), lambda target, batch: target.mget(batch), self._chunk_size):
+            values.update(zip(batch, batch_values))
+        return {key: self._decode(values[name]) for name, key in names.items()}
+
+    def replace(self, key, value, expire=None):
+        # SET ... XX: 仅当键存在时写入,判断与写入为一次原子操作
+        expire_sec = expire if expire is not None else self._config["dexp"]
+        if not self._cache.set(self._key(key), self._encode(value), expire_sec, xx=True):
+            raise KeyError(key)
 
         return True
 
     def delete(self, *keys):
-        self._cache.delete(*keys)
+        if not keys:
+            return True
 
-        for key in keys:
-            self._local_keys.remove(key) if key in self._local_keys else None
+        self._cache.execute_batches([self._key(key) for key in keys],
+                                    lambda target, batch: target.delete(*batch), self._chunk_size)
 
         return True
 
     def flush_all(self):
-        self.delete(*self._local_keys)
+        """ 分批SCAN命名空间下的键并UNLINK
+
+        :return: 删除的键数量
+        """
+        batch, deleted = [], 0
+        for name in self._cache.scan_iter(match=self._match_pattern(), count=self._scan_count):
+            batch.append(name)
+            if len(batch) >= self._scan_count:
+                deleted += self._cache.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += self._cache.unlink(*batch)
+
+        return deleted
+
+    def publish(self, channel, message):
+        """ 向频道发布消息(如TieredCache的失效消息),频道名不加命名空间前缀
+
+        :return: 收到消息的订阅者数量
+        """
+        return self._cache.publish(channel, message)
+
+    async def apublish(self, channel, message):
+        if self._async_cache is None:
+            return await self._run_in_executor(self.publish, channel, message)
+
+        return await self._async_cache.publish(channel, message)
+
+    async def aset(self, key, value, expire=None):
+        if self._async_cache is None:
+            return await self._run_in_executor(self.set, key, value, expire)
+
+        await self._async_cache.set(self._key(key), self._encode(value),
+                                    expire if expire is not None else self._config["dexp"])
+
+    async def aset_many(self, values, expire=None, keep_type=True):
+        if self._async_cache is None:
+            return await self._run_in_executor(self.set_many, values, expire, keep_type)
+
+        expire_sec = expire if expire is not None else self._config["dexp"]
+        items = list(values.items())
+        for i in range(0, len(items), self._chunk_size):
+            async with self._async_cache.pipeline(transaction=False) as pipe:
+                for key, value in items[i:i + self._chunk_size]:
+                    pipe.set(self._key(key), self._encode(value), ex=expire_sec)
+                await pipe.execute()
+
+        return []
+
+    async def aget(self, key):
+        if self._async_cache is None:
+            return await self._run_in_executor(self.get, key)
+
+        return self._decode(await self._async_cache.get(self._key(key)))
+
+    async def aget_many(self, keys):
+        if self._async_cache is None:
+            return await self._run_in_executor(self.get_many, keys)
+        if not keys:
+            return {}
+
+        values = await self._async_cache.mget([self._key(key) for key in keys])
+        return {key: self._decode(values[i]) for i, key in enumerate(keys)}
+
+    async def adelete(self, *keys):
+        if self._async_cache is None:
+            return await self._run_in_executor(self.delete, *keys)
+
+        if keys:
+            await self._async_cache.delete(*[self._key(key) for key in keys])
+
+        return True
+
+    def _key(self, key):
+        return self._prefix.encode() + key if isinstance(key, bytes) else self._prefix + str(key)
+
+    def _match_pattern(self):
+        # 转义glob特殊字符,避免命名空间中的*?[]被SCAN当作通配符
+        return re.sub(r'([*?\[\]\\])', r'\\\1', self._prefix) + '*'
+
+    def _encode(self, value):
+        return value if self._codec is None else self._codec.encode(value)
+
+    def _decode(self, value):
+        return value if self._codec is None or value is None else self._codec.decode(value)
 
-    def _push_key(self, keys: Union[str, list]):
-        with self._lock:
-            self._local_keys.extend(keys) if isinstance(keys, list) else self._local_keys.append(keys)
+    @staticmethod
+    async def _run_in_executor(func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, partial(func, *args))
@@ -0,0 +1,346 @@
+""" 基于共享内存的跨进程只读缓存类
+
+适用场景: 多个worker进程(gunicorn/uWSGI)共用的读多写少数据,如码表、static/models下的模型元数据
+实现要点:
+    1) 数据在master进程中一次性写入共享内存快照(开放寻址哈希表 + 数据区),各worker按名称挂载,内存只占一份
+    2) 值为bytes时直接返回共享内存上的只读memoryview(零拷贝);其它类型经codec反序列化后返回
+    3) 快照不可原地修改,通过publish()整体发布新版本: 控制段记录当前版本号,读取时发现版本变化即重新挂载
+    4) 写接口(set/set_many/replace/delete/flush_all)不做任何操作并返回失败,可作为easycache的后端:
+       未命中时照常调用被装饰函数,结果不会写入缓存
+用法(gunicorn.conf.py):
+    def when_ready(server):
+        server.shm_cache = SharedMemoryCache.create('app-lookup', load_lookup_tables())
+
+    def on_exit(server):
+        server.shm_cache.unlink()
+
+    # worker中(含uWSGI lazy-apps、gunicorn未preload的情况)
+    lookup = SharedMemoryCache('app-lookup')
+注意:
+    1) 共享内存段名称在同一主机上全局可见,多个服务实例需使用不同名称
+    2) 仅支持POSIX系统(Linux/macOS)
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Union
+
+from .base import BaseCache
+from ..codec import Codec, get_codec
+
+
+_MAGIC = b'ECSHM001'
+# 控制段: 魔数, 当前版本号
+_CONTROL = struct.Struct('<8sQ')
+# 快照头: 魔数, 版本号, 槽位数, 条目数, 创建时间
+_HEADER = struct.Struct('<8sQQQd')
+# 槽位: 键哈希, 条目偏移(0表示空槽)
+_SLOT = struct.Struct('<QQ')
+# 条目: 键长度, 值长度, 过期时间(0表示不过期), 值是否经过codec编码
+_ENTRY = struct.Struct('<IIdB')
+
+_RAW, _ENCODED = 0, 1
+
+
+def _encode_key(key) -> bytes:
+    """ 键需在各进程间得到相同的字节表示,故仅支持str/bytes/int
+    """
+    if isinstance(key, str):
+        return b's' + key.encode()
+    if isinstance(key, bytes):
+        return b'b' + key
+    if isinstance(key, int) and not isinstance(key, bool):
+        return b'i' + str(key).encode()
+    raise TypeError(f"SharedMemoryCache仅支持str/bytes/int类型的键: {type(key).__name__}")
+
+
+def _decode_key(data: bytes):
+    tag, body = data[:1], data[1:]
+    if tag == b's':
+        return body.decode()
+    if tag == b'b':
+        return body
+    return int(body)
+
+
+def _hash(data: bytes) -> int:
+    # 内置hash()对str/bytes按进程随机化,不能跨进程使用
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+class _ReadOnlySegment:
+    """ 以只读方式挂载已有的共享内存段
+
+    不使用SharedMemory挂载:
+        1) SharedMemory总以O_RDWR打开并映射为可写,不能保证worker不会改写快照
+        2) 3.13之前没有track=False,挂载也会登记到resource_tracker,
+           而fork出的worker与master共用同一个resource_tracker,worker退出或注销时会影响master创建的段
+    因此直接使用SharedMemory自身所依赖的_posixshmem.shm_open(CPython在所有POSIX平台上均提供),以O_RDONLY打开
+    """
+
+    def __init__(self, name):
+        import _posixshmem
+
+        fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+        try:
+            self.size = os.fstat(fd).st_size
+            self._mmap = mmap.mmap(fd, self.size, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        self.buf.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # 调用方仍持有该段上的memoryview,映射在其释放后由垃圾回收解除
+            pass
+
+
+class SharedMemoryCache(BaseCache):
+    """ 共享内存只读缓存类
+    """
+
+    def __init__(self, name, codec: Union[str, Codec] = 'pickle', **codec_kwargs):
+        """ 挂载已由create()创建的缓存
+
+        :param name: 共享内存段名称
+        :param codec: 非bytes值的编解码器,需与创建方一致
+        :param codec_kwargs: 透传给Codec的compression/threshold参数
+        """
+        super(SharedMemoryCache, self).__init__(None)
+
+        self.name = name
+        self._codec = get_codec(codec, **codec_kwargs)
+        self._owner = False
+        self._writer = None
+        self._control = _ReadOnlySegment(name)
+        self._snapshot = None
+        self._generation = 0
+        self._buf = None
+        self._mask = 0
+        self._count = 0
+        self._created_ts = 0.0
+        self._segments = {}
+
+    @classmethod
+    def create(cls, name, mapping, expire=None, codec: Union[str, Codec] = 'pickle', **codec_kwargs):
+        """ 创建缓存并发布第一个版本,应在fork前由master进程调用(gunicorn的when_ready钩子)
+
+        :param name: 共享内存段名称
+        :param mapping: 初始数据
+        :param expire: 过期时间(秒),None表示不过期
+        :param codec: 非bytes值的编解码器
+        :return:
+        """
+        writer = shared_memory.SharedMemory(name, create=True, size=_CONTROL.size)
+        _CONTROL.pack_into(writer.buf, 0, _MAGIC, 0)
+
+        cache = cls(name, codec, **codec_kwargs)
+        cache._owner = True
+        cache._writer = writer
+        cache.publish(mapping, expire)
+        return cache
+
+    @classmethod
+    def from_directory(cls, name, path, pattern='**/*', expire=None, **kwargs):
+        """ 以相对路径为键、文件内容(bytes)为值创建缓存,适用于static/models等静态文件
+
+        :param name: 共享内存段名称
+        :param path: 目录
+        :param pattern: glob模式
+        :param expire: 过期时间(秒)
+        :return:
+        """
+        from pathlib import Path
+
+        root = Path(path)
+        mapping = {file.relative_to(root).as_posix(): file.read_bytes()
+                   for file in sorted(root.glob(pattern)) if file.is_file()}
+        return cls.create(name, mapping, expire, **kwargs)
+
+    @property
+    def generation(self):
+        return _CONTROL.unpack_from(self._control.buf, 0)[1]
+
+    @property
+    def cache(self):
+        self._refresh()
+        if self._buf is None:
+            return {}
+
+        now = time.time()
+        result = {}
+        for slot in range(self._mask + 1):
+            key_hash, offset = _SLOT.unpack_from(self._buf, _HEADER.size + slot * _SLOT.size)
+            if offset:
+                key, value, expire_ts = self._read_entry(offset)
+                if not expire_ts or expire_ts >= now:
+                    result[_decode_key(key)] = value
+        return result
+
+    @property
+    def stats(self):
+        self._refresh()
+        return {'generation': self._generation, 'entries': self._count,
+                'bytes': self._snapshot.size if self._snapshot else 0, 'created_ts': self._created_ts}
+
+    def __len__(self):
+        self._refresh()
+        return self._count
+
+    def publish(self, mapping, expire=None):
+        """ 发布新版本: 写入新的快照段后切换控制段中的版本号,仅创建方可调用
+
+        保留上一个版本的快照段,以便刚读到旧版本号的进程仍能挂载,更早的版本随即unlink;
+        已挂载的进程在下次读取时切换到新版本(已挂载的映射在其关闭前仍然有效)
+        :param mapping: 全量数据
+        :param expire: 过期时间(秒),None表示不过期
+        """
+        assert self._owner, "仅创建方可发布新版本"
+
+        expire_ts = time.time() + expire if expire is not None else 0.0
+        entries = []
+        for key, value in mapping.items():
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                entries.append((_encode_key(key), bytes(value), _RAW))
+            else:
+                entries.append((_encode_key(key), self._codec.encode(value), _ENCODED))
+
+        # 槽位数为2的幂且不低于条目数的2倍,保证线性探测的平均探测长度较短
+        capacity = 1
+        while capacity < max(len(entries) * 2, 8):
+            capacity <<= 1
+        data_offset = _HEADER.size + capacity * _SLOT.size
+        size = data_offset + sum(_ENTRY.size + len(key) + len(value) for key, value, _ in entries)
+
+        generation = self.generation + 1
+        snapshot = shared_memory.SharedMemory(self._segment_name(generation), create=True, size=size)
+        buf = snapshot.buf
+        mask = capacity - 1
+        offset = data_offset
+        for key, value, flag in entries:
+            key_hash = _hash(key)
+            slot = key_hash & mask
+            while _SLOT.unpack_from(buf, _HEADER.size + slot * _SLOT.size)[1]:
+                slot = (slot + 1) & mask
+            _SLOT.pack_into(buf, _HEADER.size + slot * _SLOT.size, key_hash, offset)
+
+            _ENTRY.pack_into(buf, offset, len(key), len(value), expire_ts, flag)
+            offset += _ENTRY.size
+            buf[offset:offset + len(key)] = key
+            offset += len(key)
+            buf[offset:offset + len(value)] = value
+            offset += len(value)
+        _HEADER.pack_into(buf, 0, _MAGIC, generation, capacity, len(entries), time.time())
+        # 写入完成后即解除可写映射,创建方与其它进程一样通过只读映射读取
+        del buf
+        snapshot.close()
+
+        _CONTROL.pack_into(self._writer.buf, 0, _MAGIC, generation)
+        self._segments[generation] = snapshot
+        expired = self._segments.pop(generation - 2, None)
+        if expired is not None:
+            expired.unlink()
+
+    def get(self, key):
+        self._refresh()
+        if self._buf is None:
+            return None
+
+        key_bytes = _encode_key(key)
+        key_hash = _hash(key_bytes)
+        slot = key_hash & self._mask
+        while True:
+            slot_hash, offset = _SLOT.unpack_from(self._buf, _HEADER.size + slot * _SLOT.size)
+            if not offset:
+                return None
+            if slot_hash == key_hash:
+                stored_key, value, expire_ts = self._read_entry(offset)
+                if stored_key == key_bytes:
+                    return value if not expire_ts or expire_ts >= time.time() else None
+            slot = (slot + 1) & self._mask
+
+    def get_many(self, keys):
+        return {key: self.get(key) for key in keys}
+
+    """以下写接口不做任何操作并返回失败: 只读缓存只能通过publish()发布新版本"""
+    def set(self, key, value, expire=None):
+        return False
+
+    def set_many(self, values, expire=None, keep_type=True):
+        return list(values)
+
+    def replace(self, key, value, expire=None):
+        return False
+
+    def delete(self, *keys):
+        return False
+
+    def flush_all(self):
+        return False
+
+    def close(self):
+        """ 解除本进程的映射,此后返回的memoryview不可再使用
+        """
+        self._buf = None
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+        self._control.close()
+
+    def unlink(self):
+        """ 删除共享内存段,仅创建方调用(gunicorn的on_exit钩子)
+        """
+        assert self._owner, "仅创建方可删除共享内存段"
+        self.close()
+        for snapshot in self._segments.values():
+            snapshot.unlink()
+        self._segments.clear()
+        self._writer.close()
+        self._writer.unlink()
+
+    def _segment_name(self, generation):
+        return f"{self.name}.{generation}"
+
+    def _refresh(self):
+        generation = self.generation
+        if generation == self._generation:
+            return
+
+        while True:
+            try:
+                snapshot = _ReadOnlySegment(self._segment_name(generation))
+                break
+            except FileNotFoundError:
+                # 读取版本号后创建方又连续发布了多个版本,该版本的段已被删除,按最新的版本号重试
+                latest = self.generation
+                if latest == generation:
+                    raise
+                generation = latest
+        if self._snapshot is not None:
+            self._buf = None
+            self._snapshot.close()
+
+        magic, _, capacity, count, created_ts = _HEADER.unpack_from(snapshot.buf, 0)
+        assert magic == _MAGIC, f"共享内存段格式不匹配: {self.name}"
+        self._buf = snapshot.buf
+        self._snapshot = snapshot
+        self._mask = capacity - 1
+        self._count = count
+        self._created_ts = created_ts
+        self._generation = generation
+
+    def _read_entry(self, offset):
+        key_len, value_len, expire_ts, flag = _ENTRY.unpack_from(self._buf, offset)
+        offset += _ENTRY.size
+        key = bytes(self._buf[offset:offset + key_len])
+        value = self._buf[offset + key_len:offset + key_len + value_len]
+        if flag == _ENCODED:
+            value = self._codec.decode(value)
+        return key, value, expire_ts
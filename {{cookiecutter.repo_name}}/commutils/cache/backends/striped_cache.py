@@ -0,0 +1,99 @@
+""" 锁分段(lock striping)的线程安全进程内缓存类
+"""
+
+from .base import BaseCache
+from .bounded_cache import BoundedCache
+
+
+class StripedCache(BaseCache):
+    """ 分段缓存类
+
+    按键的哈希值将数据分散到N个分段,每个分段为独立加锁的BoundedCache,
+    不同分段上的读写互不竞争同一把锁,适用于uWSGI多线程/线程池等并发访问场景
+
+    注意: max_entries/max_bytes为全局上限,按分段数平均分配,因此实际淘汰以分段为单位进行
+    """
+
+    def __init__(self, dexp=3153600000, shards=16, max_entries=None, max_bytes=None, policy='lru', **kwargs):
+        """
+        :param dexp: 默认过期时间(秒)
+        :param shards: 分段数,会向上取整为2的幂以便用位运算定位分段
+        :param max_entries: 最大条目数,None表示不限制
+        :param max_bytes: 最大字节数,None表示不限制
+        :param policy: 各分段的淘汰策略,可选'lru'/'lfu'
+        :param kwargs: 透传给BoundedCache的其它参数,如sizeof/reap_batch
+        """
+        super(StripedCache, self).__init__(dexp)
+        assert shards > 0, "shards必须为正整数"
+
+        shards = 1 << (shards - 1).bit_length()
+        self._mask = shards - 1
+        self._shards = [
+            BoundedCache(dexp,
+                         max_entries=None if max_entries is None else -(-max_entries // shards),
+                         max_bytes=None if max_bytes is None else -(-max_bytes // shards),
+                         policy=policy, **kwargs)
+            for _ in range(shards)
+        ]
+
+    @property
+    def cache(self):
+        result = {}
+        for shard in self._shards:
+            result.update(shard.cache)
+        return result
+
+    @property
+    def stats(self):
+        total = {}
+        for shard in self._shards:
+            for name, value in shard.stats.items():
+                total[name] = total.get(name, 0) + value
+        total['shards'] = len(self._shards)
+        return total
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def shard_for(self, key) -> BoundedCache:
+        return self._shards[hash(key) & self._mask]
+
+    def set(self, key, value, expire=None):
+        return self._shards[hash(key) & self._mask].set(key, value, expire)
+
+    def set_many(self, values, expire=None, keep_type=True):
+        assert keep_type == True, "不支持keep_type=False"
+        return [key for key, value in values.items() if not self.set(key, value, expire)]
+
+    def get(self, key):
+        return self._shards[hash(key) & self._mask].get(key)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        else:
+            return {key: self.shard_for(key).get(key) for key in keys}
+
+    def replace(self, key, value, expire=None) -> bool:
+        return self._shards[hash(key) & self._mask].replace(key, value, expire)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.shard_for(key).delete(key)
+
+        return True
+
+    def flush_all(self):
+        for shard in self._shards:
+            shard.flush_all()
+
+        return True
+
+    def purge_expired(self):
+        return sum(shard.purge_expired() for shard in self._shards)
+
+    def update_cfg(self, **cfg_kwags):
+        # 装饰器通过update_cfg修改默认过期时间等配置,需同步到各分段
+        super(StripedCache, self).update_cfg(**cfg_kwags)
+        for shard in self._shards:
+            shard.update_cfg(**cfg_kwags)
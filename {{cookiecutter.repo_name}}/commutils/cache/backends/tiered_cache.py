@@ -0,0 +1,285 @@
+""" 两级缓存类: L1进程内有界缓存 + L2 Redis缓存
+
+读: 先查L1,未命中再查L2并回填L1
+写/删: 先写L2,再写L1,随后通过Redis发布/订阅广播失效消息,其它进程收到后删除各自L1中的副本
+
+注意:
+    1) 失效消息是尽力而为的(订阅断线期间的消息会丢失,重连后会清空L1),L1的过期时间l1_ttl是数据陈旧程度的上限
+    2) 监听线程在首次读写时惰性启动,fork后的子进程会各自启动,适配gunicorn/uWSGI的preload
+    3) 失效频道名包含L2的命名空间,同一Redis上不同命名空间的缓存互不干扰
+    4) L1中的键与L2一致地规范化(非bytes的键取str(),bytes按UTF-8解码),f(1)与f('1')在两级中均为同一个键
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+import warnings
+
+from .base import BaseCache
+from .bounded_cache import BoundedCache
+from .redis_cache import RedisCache
+
+
+class TieredCache(BaseCache):
+    """ 两级缓存类
+    """
+
+    def __init__(self, l2: RedisCache, l1: BaseCache = None, l1_ttl=60,
+                 channel='easycache:invalidate', listen=True):
+        """
+        :param l2: Redis缓存
+        :param l1: 进程内缓存,默认为容量10000的BoundedCache
+        :param l1_ttl: L1中副本的最长存活时间(秒)
+        :param channel: 失效消息的发布/订阅频道前缀,实际频道为"{channel}:{L2的命名空间}"
+        :param listen: 是否订阅失效消息,仅写不读的进程可关闭
+        """
+        super(TieredCache, self).__init__(l2.default_expire)
+
+        self._l1 = l1 if l1 is not None else BoundedCache(max_entries=10000)
+        self._l2 = l2
+        self._l1_ttl = l1_ttl
+        self._channel = f"{channel}:{l2.namespace}"
+        self._listen = listen
+        self._node_id = uuid.uuid4().hex
+        self._pid = os.getpid()
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return self._l2.cache
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @property
+    def stats(self):
+        total = self.l1_hits + self.l2_hits + self.misses
+        return {
+            'l1_hits': self.l1_hits,
+            'l2_hits': self.l2_hits,
+            'misses': self.misses,
+            'l1_hit_ratio': self.l1_hits / total if total else 0.0,
+            'l2_hit_ratio': self.l2_hits / total if total else 0.0,
+        }
+
+    def set(self, key, value, expire=None):
+        self._ensure_listener()
+        self._l2.set(key, value, expire)
+        l1_key = self._l1_key(key)
+        self._l1.set(l1_key, value, self._l1_expire(expire))
+        self._publish(keys=[l1_key])
+
+    def set_many(self, values, expire=None, keep_type=True):
+        self._ensure_listener()
+        failed = self._l2.set_many(values, expire, keep_type)
+        l1_values = {self._l1_key(key): value for key, value in values.items()}
+        self._l1.set_many(l1_values, self._l1_expire(expire))
+        self._publish(keys=list(l1_values))
+        return failed
+
+    def get(self, key):
+        self._ensure_listener()
+        l1_key = self._l1_key(key)
+        value = self._l1.get(l1_key)
+        if value is not None:
+            self.l1_hits += 1
+            return value
+
+        value = self._l2.get(key)
+        if value is not None:
+            self.l2_hits += 1
+            self._l1.set(l1_key, value, self._l1_expire())
+        else:
+            self.misses += 1
+        return value
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+
+        self._ensure_listener()
+        result, missing = self._get_many_l1(keys)
+        if missing:
+            self._fill_l1(result, self._l2.get_many(missing))
+        return result
+
+    def replace(self, key, value, expire=None):
+        self._ensure_listener()
+        self._l2.replace(key, value, expire)
+        l1_key = self._l1_key(key)
+        self._l1.set(l1_key, value, self._l1_expire(expire))
+        self._publish(keys=[l1_key])
+        return True
+
+    def delete(self, *keys):
+        self._ensure_listener()
+        self._l2.delete(*keys)
+        l1_keys = [self._l1_key(key) for key in keys]
+        self._l1.delete(*l1_keys)
+        self._publish(keys=l1_keys)
+        return True
+
+    def flush_all(self):
+        self._ensure_listener()
+        self._l2.flush_all()
+        self._l1.flush_all()
+        self._publish(flush=True)
+        return True
+
+    def update_cfg(self, **cfg_kwags):
+        super(TieredCache, self).update_cfg(**cfg_kwags)
+        self._l2.update_cfg(**cfg_kwags)
+
+    async def aset(self, key, value, expire=None):
+        self._ensure_listener()
+        await self._l2.aset(key, value, expire)
+        l1_key = self._l1_key(key)
+        self._l1.set(l1_key, value, self._l1_expire(expire))
+        await self._apublish(keys=[l1_key])
+
+    async def aset_many(self, values, expire=None, keep_type=True):
+        self._ensure_listener()
+        failed = await self._l2.aset_many(values, expire, keep_type)
+        l1_values = {self._l1_key(key): value for key, value in values.items()}
+        self._l1.set_many(l1_values, self._l1_expire(expire))
+        await self._apublish(keys=list(l1_values))
+        return failed
+
+    async def aget(self, key):
+        self._ensure_listener()
+        l1_key = self._l1_key(key)
+        value = self._l1.get(l1_key)
+        if value is not None:
+            self.l1_hits += 1
+            return value
+
+        value = await self._l2.aget(key)
+        if value is not None:
+            self.l2_hits += 1
+            self._l1.set(l1_key, value, self._l1_expire())
+        else:
+            self.misses += 1
+        return value
+
+    async def aget_many(self, keys):
+        if not keys:
+            return {}
+
+        self._ensure_listener()
+        result, missing = self._get_many_l1(keys)
+        if missing:
+            self._fill_l1(result, await self._l2.aget_many(missing))
+        return result
+
+    async def adelete(self, *keys):
+        self._ensure_listener()
+        await self._l2.adelete(*keys)
+        l1_keys = [self._l1_key(key) for key in keys]
+        self._l1.delete(*l1_keys)
+        await self._apublish(keys=l1_keys)
+        return True
+
+    @staticmethod
+    def _l1_key(key):
+        # 与RedisCache生成键名的方式一致,失效消息经JSON传递后仍能对应L1中的键
+        return key.decode('utf-8', 'surrogateescape') if isinstance(key, bytes) else str(key)
+
+    def _get_many_l1(self, keys):
+        """ 从L1批量读取,返回(按原始键的结果, L1中未命中的原始键)
+        """
+        l1_keys = {key: self._l1_key(key) for key in keys}
+        found = self._l1.get_many(list(l1_keys.values()))
+        result = {key: found.get(l1_key) for key, l1_key in l1_keys.items()}
+        missing = [key for key, value in result.items() if value is None]
+        self.l1_hits += len(result) - len(missing)
+        return result, missing
+
+    def _fill_l1(self, result, fetched):
+        for key, value in fetched.items():
+            if value is not None:
+                self.l2_hits += 1
+                self._l1.set(self._l1_key(key), value, self._l1_expire())
+            else:
+                self.misses += 1
+        result.update(fetched)
+
+    def _l1_expire(self, expire=None):
+        expire_sec = expire if expire is not None else self._l2.default_expire
+        return self._l1_ttl if expire_sec is None else min(expire_sec, self._l1_ttl)
+
+    def _message(self, flush=None, keys=None):
+        message = {'src': self._node_id}
+        if flush:
+            message['flush'] = True
+        else:
+            message['keys'] = keys
+        return json.dumps(message)
+
+    def _publish(self, flush=None, keys=None):
+        try:
+            self._l2.publish(self._channel, self._message(flush, keys))
+        except Exception as e:
+            # 广播失败不影响本进程的读写,其它进程的L1副本将在l1_ttl后过期
+            warnings.warn(f"Publish cache invalidation failed: {e}")
+
+    async def _apublish(self, flush=None, keys=None):
+        try:
+            await self._l2.apublish(self._channel, self._message(flush, keys))
+        except Exception as e:
+            warnings.warn(f"Publish cache invalidation failed: {e}")
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid and (not self._listen or self._listener_pid == pid):
+            return
+
+        with self._listener_lock:
+            if self._pid != pid:
+                # fork后的子进程继承了父进程的L1(内容可能已陈旧)和节点ID(会导致忽略彼此的消息),
+                # preload时父进程通常从未读写过缓存,因此按创建时的进程号判断而不是按是否启动过监听线程
+                self._l1.flush_all()
+                self._node_id = uuid.uuid4().hex
+                self._pid = pid
+            if not self._listen or self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            threading.Thread(target=self._listen_forever, name='tiered-cache-invalidation', daemon=True).start()
+
+    def _listen_forever(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self._l2.pool.conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                # 订阅建立前可能错过了失效消息
+                self._l1.flush_all()
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self._on_message(message['data'])
+            except Exception as e:
+                warnings.warn(f"Cache invalidation subscriber disconnected: {e}")
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _on_message(self, data):
+        message = json.loads(data)
+        if message.get('src') == self._node_id:
+            return
+
+        if message.get('flush'):
+            self._l1.flush_all()
+        else:
+            self._l1.delete(*message.get('keys', []))
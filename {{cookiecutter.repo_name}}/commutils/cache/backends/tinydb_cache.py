@@ -1,2 +0,0 @@
-""" Not support yet.
-"""
\ No newline at end of file
@@ -0,0 +1,453 @@
+""" 缓存后端性能基准测试
+
+直接运行的脚本,使用绝对路径导入(需在工程根目录下执行):
+    python -m commutils.cache.cache_benchmark                                   # 仅进程内与磁盘缓存
+    python -m commutils.cache.cache_benchmark --redis-url redis://127.0.0.1:6379/15
+    python -m commutils.cache.cache_benchmark --fakeredis --output bench.json   # 无redis-server时使用fakeredis
+结果以JSON输出,各部分:
+    ops         各操作的吞吐与p50/p99延迟(微秒)
+    memory      每个条目占用的内存(进程内缓存为tracemalloc统计,Redis为used_memory增量,DiskCache为文件大小增量)
+    contention  多线程混合读写吞吐
+    hit_ratio   Zipf分布下有界缓存的命中率
+    decorator   easycache装饰器在命中/未命中路径上相对直接调用的额外开销(纳秒)
+    codec       各编解码器的耗时与负载大小
+注意:
+    1) 同一机器、同一参数下的结果才可比较,meta中记录了运行环境
+    2) fakeredis在进程内模拟,不含网络往返,其结果仅反映客户端开销
+"""
+
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from commutils.cache import easycache
+from commutils.cache.backends import DictCache, BoundedCache, StripedCache, DiskCache
+from commutils.cache.codec import Codec
+
+SECTIONS = ('ops', 'memory', 'contention', 'hit_ratio', 'decorator', 'codec')
+
+
+def percentile(sorted_samples, pct):
+    """ 最近秩法计算百分位数
+
+    :param sorted_samples: 已排序的样本
+    :param pct: 百分位(0-100)
+    :return:
+    """
+    if not sorted_samples:
+        return 0
+    rank = max(int(round(pct / 100 * len(sorted_samples) + 0.5)) - 1, 0)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+
+def summarize(samples_ns):
+    """ 由单次操作耗时(纳秒)计算吞吐与延迟分位数
+    """
+    samples_ns = sorted(samples_ns)
+    total = sum(samples_ns)
+    return {
+        'ops_per_sec': round(len(samples_ns) / (total / 1e9)) if total else 0,
+        'p50_us': round(percentile(samples_ns, 50) / 1e3, 2),
+        'p99_us': round(percentile(samples_ns, 99) / 1e3, 2),
+    }
+
+
+def zipf_keys(n, key_space, s=1.0, seed=0):
+    """ 生成服从Zipf分布的键序列,排名越靠前的键出现越频繁
+
+    :param n: 序列长度
+    :param key_space: 键空间大小
+    :param s: 分布指数,越大越集中(线上热点数据通常在0.8-1.2之间)
+    :param seed: 随机种子
+    :return:
+    """
+    cum_weights = list(itertools.accumulate(1 / (rank ** s) for rank in range(1, key_space + 1)))
+    rnd = random.Random(seed)
+    # 打乱排名与键的对应关系,避免热点键集中在相邻的分片/哈希桶
+    ranked = list(range(key_space))
+    rnd.shuffle(ranked)
+    return [f"zipf:{ranked[i]}" for i in rnd.choices(range(key_space), cum_weights=cum_weights, k=n)]
+
+
+def make_backends(redis_url=None, use_fakeredis=False, tmp_dir=None, redis_codec='pickle'):
+    """ 参与测试的缓存后端工厂
+
+    :param redis_url: Redis地址,传入时测试RedisCache
+    :param use_fakeredis: 未传入redis_url时使用fakeredis测试RedisCache
+    :param tmp_dir: DiskCache的数据目录
+    :param redis_codec: RedisCache的编解码器,测试写入的值为字典,不能为None
+    :return: {名称: 无参工厂函数}
+    """
+    tmp_dir = tmp_dir or tempfile.mkdtemp(prefix='easycache-bench-')
+    counter = itertools.count()
+    backends = {
+        'DictCache': DictCache,
+        'BoundedCache': lambda: BoundedCache(max_entries=1000000),
+        'StripedCache': lambda: StripedCache(shards=16),
+        'DiskCache': lambda: DiskCache(os.path.join(tmp_dir, f"cache-{next(counter)}.db")),
+    }
+
+    if redis_url or use_fakeredis:
+        from commutils.cache.backends import RedisCache
+        from commutils.db.redis_conn import RedisPool
+
+        if redis_url:
+            pool = RedisPool.from_url(redis_url)
+        else:
+            import fakeredis
+            pool = RedisPool.from_client(fakeredis.FakeStrictRedis())
+        backends['RedisCache'] = lambda: RedisCache(pool, namespace='easycache-bench', codec=redis_codec)
+    return backends
+
+
+def bench_ops(cache, n=20000, value=None, batch=100):
+    """ 单线程下各操作的吞吐与延迟: set/get(命中)/get(未命中)/set_many/get_many(批量操作按每批计)
+
+    :param cache: 缓存实例
+    :param n: 每种单键操作的次数
+    :param value: 写入的值,默认为小字典
+    :param batch: 批量操作每批的键数量
+    :return: {操作名: 统计结果},统计结果含ops_per_sec/p50_us/p99_us
+    """
+    value = value if value is not None else {'id': 1, 'name': 'google', 'score': 9.5}
+    keys = [f"bench:{i}" for i in range(n)]
+    misses = [f"missing:{i}" for i in range(n)]
+    batches = [keys[i:i + batch] for i in range(0, n, batch)]
+    clock = time.perf_counter_ns
+    cache.flush_all()
+
+    def timed(func, args):
+        samples = []
+        for arg in args:
+            start_ns = clock()
+            func(arg)
+            samples.append(clock() - start_ns)
+        return summarize(samples)
+
+    result = {
+        'set': timed(lambda key: cache.set(key, value), keys),
+        'get_hit': timed(cache.get, keys),
+        'get_miss': timed(cache.get, misses),
+        f"set_many_{batch}": timed(lambda b: cache.set_many({key: value for key in b}), batches),
+        f"get_many_{batch}": timed(cache.get_many, batches),
+    }
+    cache.flush_all()
+    return result
+
+
+def bench_memory(cache, n=20000, value=None):
+    """ 每个条目占用的内存(字节)
+
+    :return: {'bytes_per_entry': 字节数, 'method': 统计方法}
+    """
+    value = value if value is not None else {'id': 1, 'name': 'google', 'score': 9.5}
+    cache.flush_all()
+
+    if isinstance(cache, DiskCache):
+        def probe():
+            return sum(os.path.getsize(path) for path in (cache.path, cache.path + '-wal') if os.path.exists(path))
+        method = 'file_size'
+    elif hasattr(cache, 'pool'):
+        try:
+            cache.pool.conn.info('memory')
+
+            def probe():
+                return cache.pool.conn.info('memory')['used_memory']
+            method = 'redis_used_memory'
+        except Exception:
+            # 不支持INFO时(如fakeredis)按键与编码后的值的字节数估计,不含Redis自身的开销
+            def probe():
+                names = [f"{cache.namespace}:{key}" for key in cache.iter_keys()]
+                return sum(len(name.encode()) + cache.pool.conn.strlen(name) for name in names)
+            method = 'redis_payload_bytes'
+    else:
+        probe = None
+        method = 'tracemalloc'
+
+    try:
+        if probe is None:
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+        else:
+            before = probe()
+
+        for i in range(n):
+            # 每个条目使用独立的值对象,避免共享引用导致低估
+            cache.set(f"mem:{i}", dict(value))
+
+        if probe is None:
+            gc.collect()
+            after = tracemalloc.get_traced_memory()[0]
+        else:
+            after = probe()
+    except Exception as e:
+        return {'bytes_per_entry': None, 'method': method, 'error': repr(e)}
+    finally:
+        if probe is None:
+            tracemalloc.stop()
+        cache.flush_all()
+
+    return {'bytes_per_entry': round((after - before) / n, 1), 'method': method}
+
+
+def bench_thread_scaling(cache, threads, ops_per_thread=50000, key_space=10000, read_ratio=0.8, delete_ratio=0.05):
+    """ 多线程混合读写吞吐测试
+
+    :param cache: 缓存实例
+    :param threads: 线程数
+    :param ops_per_thread: 每个线程执行的操作数
+    :param key_space: 键空间大小
+    :param read_ratio: 读操作比例
+    :param delete_ratio: 删除操作比例,其余为写操作
+    :return: {'threads': 线程数, 'ops_per_sec': 总吞吐, 'errors': 操作抛出的异常数}
+    """
+    cache.flush_all()
+    cache.set_many({i: i for i in range(key_space)})
+
+    errors = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        plan = [(rnd.random(), rnd.randrange(key_space)) for _ in range(ops_per_thread)]
+        failed = 0
+        barrier.wait()
+        for dice, key in plan:
+            try:
+                if dice < read_ratio:
+                    cache.get(key)
+                elif dice < read_ratio + delete_ratio:
+                    cache.delete(key)
+                else:
+                    cache.set(key, dice)
+            except Exception:
+                failed += 1
+        errors.append(failed)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start_time = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start_time
+    cache.flush_all()
+
+    return {'threads': threads, 'ops_per_sec': round(threads * ops_per_thread / elapsed), 'errors': sum(errors)}
+
+
+def bench_hit_ratio(cache, keys):
+    """ 读穿(read-through)模拟: 未命中时写入,返回命中率
+
+    :param cache: 有界缓存实例
+    :param keys: 访问序列
+    :return:
+    """
+    cache.flush_all()
+    hits = 0
+    for key in keys:
+        if cache.get(key) is not None:
+            hits += 1
+        else:
+            cache.set(key, 1)
+    cache.flush_all()
+    return round(hits / len(keys), 4)
+
+
+def bench_decorator(backend, n=20000):
+    """ easycache装饰器开销: 与直接调用原函数相比,每次调用增加的耗时(纳秒)
+
+    :param backend: 缓存实例
+    :param n: 调用次数
+    :return: {'plain_ns', 'hit_ns', 'hit_overhead_ns', 'miss_ns', 'miss_overhead_ns'}
+    """
+    def lookup(user_id, fields=None):
+        return {'id': user_id, 'fields': fields}
+
+    backend.flush_all()
+    cached = easycache(backend=backend, key_prefix='bench.lookup')(lookup)
+    clock = time.perf_counter_ns
+
+    def per_call(func, args):
+        start_ns = clock()
+        for arg in args:
+            func(arg, fields='name')
+        return (clock() - start_ns) / len(args)
+
+    plain = per_call(lookup, range(n))
+    miss = per_call(cached, range(n))
+    hit = per_call(cached, range(n))
+    backend.flush_all()
+    return {
+        'plain_ns': round(plain), 'hit_ns': round(hit), 'hit_overhead_ns': round(hit - plain),
+        'miss_ns': round(miss), 'miss_overhead_ns': round(miss - plain),
+    }
+
+
+def sample_payloads():
+    """ 编解码测试数据: 小对象、查询结果集(元组列表)、长文本
+    """
+    rnd = random.Random(0)
+    start = datetime.datetime(2024, 1, 1)
+    rows = [(i, f"name-{i}", rnd.random() * 1000, start + datetime.timedelta(minutes=i), i % 7 == 0)
+            for i in range(5000)]
+    return {
+        'small_dict': {'id': 1, 'name': 'google', 'tags': ['a', 'b'], 'score': 9.5},
+        'rows_5000': rows,
+        'text_64k': ' '.join(f"word{rnd.randrange(500)}" for _ in range(8000)),
+    }
+
+
+def bench_codec(codec: Codec, payload, rounds=50):
+    """ 单个编解码器的耗时与负载大小
+
+    :return: {'encode_us': 平均编码耗时(微秒), 'decode_us': 平均解码耗时(微秒), 'bytes': 编码后字节数}
+    """
+    start_time = time.perf_counter()
+    for _ in range(rounds):
+        data = codec.encode(payload)
+    encode_cost = (time.perf_counter() - start_time) / rounds
+
+    start_time = time.perf_counter()
+    for _ in range(rounds):
+        codec.decode(data)
+    decode_cost = (time.perf_counter() - start_time) / rounds
+
+    return {'encode_us': round(encode_cost * 1e6, 1), 'decode_us': round(decode_cost * 1e6, 1), 'bytes': len(data)}
+
+
+def run_codec_benchmark(serializers=('pickle', 'json', 'msgpack'), compressions=(None, 'zlib', 'zstd', 'lz4')):
+    results = []
+    for payload_name, payload in sample_payloads().items():
+        for serializer in serializers:
+            for compression in compressions:
+                try:
+                    codec = Codec(serializer, compression=compression)
+                except ImportError:
+                    # 未安装可选依赖的编解码器跳过
+                    continue
+                try:
+                    stats = bench_codec(codec, payload)
+                except TypeError as e:
+                    # 序列化方式不支持的类型,如msgpack不支持datetime
+                    stats = {'encode_us': None, 'decode_us': None, 'bytes': None, 'error': repr(e)}
+                results.append(dict(payload=payload_name, serializer=serializer, compression=compression, **stats))
+    return results
+
+
+def run_suite(backends, sections=SECTIONS, ops=20000, threads=(1, 2, 4, 8), key_space=10000, zipf_s=1.0,
+              capacity_ratio=0.1):
+    """ 运行基准测试套件
+
+    :param backends: make_backends()的返回值
+    :param sections: 需运行的部分
+    :param ops: 每项测试的操作数
+    :param threads: 多线程测试的线程数
+    :param key_space: 多线程与命中率测试的键空间大小
+    :param zipf_s: 命中率测试的Zipf分布指数
+    :param capacity_ratio: 命中率测试中缓存容量占键空间的比例
+    :return: 可JSON序列化的结果
+    """
+    meta = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ops': ops,
+        'threads': list(threads),
+        'key_space': key_space,
+        'zipf_s': zipf_s,
+        'backends': list(backends),
+    }
+    result = {'meta': meta}
+
+    def each_backend(func):
+        output = {}
+        for name, factory in backends.items():
+            output[name] = func(factory())
+            print(f"  {name} done", file=sys.stderr)
+        return output
+
+    if 'ops' in sections:
+        print("ops...", file=sys.stderr)
+        result['ops'] = each_backend(lambda cache: bench_ops(cache, ops))
+    if 'memory' in sections:
+        print("memory...", file=sys.stderr)
+        result['memory'] = each_backend(lambda cache: bench_memory(cache, ops))
+    if 'contention' in sections:
+        print("contention...", file=sys.stderr)
+        per_thread = max(ops // 4, 1000)
+        result['contention'] = each_backend(
+            lambda cache: [bench_thread_scaling(cache, t, per_thread, key_space) for t in threads])
+    if 'hit_ratio' in sections:
+        print("hit_ratio...", file=sys.stderr)
+        capacity = max(int(key_space * capacity_ratio), 1)
+        keys = zipf_keys(ops * 5, key_space, zipf_s)
+        bounded = {
+            'BoundedCache(lru)': lambda: BoundedCache(max_entries=capacity, policy='lru'),
+            'BoundedCache(lfu)': lambda: BoundedCache(max_entries=capacity, policy='lfu'),
+            'StripedCache(lru)': lambda: StripedCache(shards=16, max_entries=capacity),
+        }
+        result['hit_ratio'] = {
+            'capacity': capacity,
+            # 缓存容量不受限时的命中率上限: 每个键仅首次访问未命中
+            'upper_bound': round(1 - len(set(keys)) / len(keys), 4),
+            'results': {name: bench_hit_ratio(factory(), keys) for name, factory in bounded.items()},
+        }
+    if 'decorator' in sections:
+        print("decorator...", file=sys.stderr)
+        result['decorator'] = each_backend(lambda cache: bench_decorator(cache, ops))
+    if 'codec' in sections:
+        print("codec...", file=sys.stderr)
+        result['codec'] = run_codec_benchmark()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="easycache缓存后端基准测试")
+    parser.add_argument('--redis-url', help="测试RedisCache使用的Redis地址,建议使用独立的db")
+    parser.add_argument('--fakeredis', action='store_true', help="未指定--redis-url时使用fakeredis测试RedisCache")
+    parser.add_argument('--redis-codec', default='pickle', choices=['pickle', 'json', 'msgpack'],
+                        help="RedisCache的编解码器")
+    parser.add_argument('--backends', help="仅测试指定的后端,逗号分隔")
+    parser.add_argument('--sections', default=','.join(SECTIONS), help="需运行的部分,逗号分隔")
+    parser.add_argument('--ops', type=int, default=20000, help="每项测试的操作数")
+    parser.add_argument('--threads', default='1,2,4,8', help="多线程测试的线程数,逗号分隔")
+    parser.add_argument('--key-space', type=int, default=10000)
+    parser.add_argument('--zipf-s', type=float, default=1.0)
+    parser.add_argument('--output', help="结果输出文件,默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp(prefix='easycache-bench-')
+    try:
+        backends = make_backends(args.redis_url, args.fakeredis, tmp_dir, args.redis_codec)
+        if args.backends:
+            backends = {name: backends[name] for name in args.backends.split(',')}
+        result = run_suite(backends, args.sections.split(','), args.ops,
+                           [int(t) for t in args.threads.split(',')], args.key_space, args.zipf_s)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,167 @@
 """ 缓存装饰器工厂类
 
+防缓存击穿(cache stampede):
+    1) single_flight: 同一进程内同一个键只有一个调用者执行被装饰函数,其余调用者等待其结果
+    2) lease_pool: 跨进程时借助Redis短租约,只有获得租约的进程重新计算,其余进程轮询等待缓存写入
+    3) xfetch_beta: 概率性提前刷新(XFetch),越接近过期、计算越耗时的键越可能被提前重算
+
+过期后仍返回旧值(stale-while-revalidate):
+    stale_ttl: 缓存值在dexp(软过期)之后的stale_ttl秒内仍会被返回,同时在后台线程池中重新计算;
+               超过dexp + stale_ttl(硬过期)后缓存被后端删除,调用者需阻塞等待重新计算
+
+协程函数(async def)会自动使用异步缓存路径: 通过后端的aget/aset读写缓存,单飞基于asyncio.Future,后台刷新基于asyncio任务
+
+按标签批量失效(tags/expire_tags):
+    每个标签在后端中对应一个代数令牌(键为"tag:"加标签名),缓存值中记录写入时各标签的令牌;
+    读取时与缓存值一并取回当前令牌(一次get_many),任一令牌不一致即视为未命中;
+    使标签失效只需写入新令牌,开销与标签数量成正比,无需扫描键,旧缓存值由过期时间或后端淘汰回收
 """
 
+import asyncio
+import inspect
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+import warnings
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
 from .backends import BaseCache
+from .codec import get_codec
+from .keys import KeyBuilder, qualified_name
+from .metrics import get_metrics
 from ..common import ignore_errors
 
 
 cache_ignore_errors = True
 
+LEASE_KEY_PREFIX = 'lease:'
+
+TAG_KEY_PREFIX = 'tag:'
+
+# 后台刷新线程池的最大线程数,需在首次触发后台刷新前修改
+refresh_workers = 4
+
+# 缓存未命中标记,与被装饰函数可能返回的None区分
+_MISS = object()
+
+_refresh_executor = None
+_refresh_executor_lock = threading.Lock()
+
+
+def get_refresh_executor() -> ThreadPoolExecutor:
+    """ 获取后台刷新线程池(惰性创建,避免在fork前的主进程中创建线程)
+    """
+    global _refresh_executor
+    with _refresh_executor_lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='easycache-refresh')
+    return _refresh_executor
+
+
+def _new_token():
+    return uuid.uuid4().hex
+
+
+def _normalize_token(token):
+    # 未开启decode_responses的Redis连接返回bytes
+    return token.decode() if isinstance(token, bytes) else token
+
+
+def invalidate_tags(backend: BaseCache, tags, tag_ttl=2592000):
+    """ 使依赖指定标签的缓存全部失效: 为每个标签写入新的代数令牌
+
+    :param backend: 缓存后端,需与被装饰函数使用的后端一致
+    :param tags: 标签列表
+    :param tag_ttl: 标签令牌的过期时间(秒),令牌过期后依赖它的缓存同样视为失效
+    :return:
+    """
+    if tags:
+        backend.set_many({TAG_KEY_PREFIX + tag: _new_token() for tag in tags}, tag_ttl)
+
+
+async def ainvalidate_tags(backend: BaseCache, tags, tag_ttl=2592000):
+    if tags:
+        await backend.aset_many({TAG_KEY_PREFIX + tag: _new_token() for tag in tags}, tag_ttl)
+
+
+class CacheEntry(namedtuple('CacheEntry', ['value', 'expire_ts', 'delta', 'tags'], defaults=(None,))):
+    """ 附带元数据的缓存值
+
+    value: 被装饰函数的返回值
+    expire_ts: 逻辑过期时间戳,None表示永不过期
+    delta: 上一次计算耗时(秒),用于XFetch
+    tags: 写入时各标签键的令牌(标签键 -> 令牌),未使用标签时为None
+    """
+    __slots__ = ()
+
 
 class CacheDecoratorFactory:
     """ 缓存装饰器工厂类
 
     注意:会使用全局变量cache_ignore_errors
+        被装饰函数返回None时不会被缓存(无法与未命中区分),其它假值(0/""/[])正常缓存
+        启用xfetch_beta/stale_ttl/tags时缓存的是CacheEntry元组,要求缓存后端能够保存Python对象(如DictCache/BoundedCache),
+        或者为RedisCache/装饰器配置codec
     """
 
-    def __init__(self, backend, cache_key='', expire_key='', **kwargs):
+    def __init__(self, backend, cache_key='', expire_key='',
+                 single_flight=False, lease_pool=None, lease_ttl=10, lease_poll=0.05, xfetch_beta=0,
+                 stale_ttl=None, codec=None, key_prefix=None, ignore_args=(), typed=False, metrics=None,
+                 tags=None, expire_tags=None, tag_ttl=2592000, **kwargs):
+        """
+        :param backend: 缓存后端
+        :param cache_key: 缓存键(格式化字符串或可调用对象),与expire_key均未传入时根据函数参数自动生成
+        :param expire_key: 需删除的缓存键(格式化字符串或可调用对象)
+        :param single_flight: 是否开启进程内的单飞模式
+        :param lease_pool: RedisPool实例,传入时开启跨进程租约(隐含single_flight)
+        :param lease_ttl: 租约时长(秒),亦为未获得租约的进程等待缓存写入的最长时间
+        :param lease_poll: 未获得租约的进程轮询缓存的间隔(秒)
+        :param xfetch_beta: XFetch系数,0表示关闭,1为推荐值,越大越倾向于提前刷新
+        :param stale_ttl: 软过期后继续返回旧值并后台刷新的时长(秒),None表示关闭
+        :param codec: 写入后端前对值编码的编解码器,可选None/'pickle'/'json'/'msgpack'或Codec实例
+        :param key_prefix: 自动生成缓存键时的前缀,默认为"模块名.函数限定名"
+        :param ignore_args: 自动生成缓存键时忽略的参数名
+        :param typed: 自动生成缓存键时是否区分参数类型
+        :param metrics: 是否统计该函数的命中/未命中/加载耗时/热点键等指标,True时以缓存键前缀命名,也可传入字符串指定名称
+        :param tags: 缓存值依赖的标签: 格式化字符串列表(如['users', 'user:{0}'])或返回标签列表的可调用对象
+        :param expire_tags: 被装饰函数成功执行后需失效的标签,格式同tags,用于写操作
+        :param tag_ttl: 标签令牌的过期时间(秒),应不短于依赖它的缓存的过期时间
+        :param kwargs: 其余参数将更新至缓存后端配置,如dexp
+        """
         assert isinstance(backend, BaseCache)
 
         self._backend = backend
         self._backend.update_cfg(**kwargs)
 
+        self._single_flight = single_flight or lease_pool is not None
+        self._lease_pool = lease_pool
+        self._lease_ttl = lease_ttl
+        self._lease_poll = lease_poll
+        self._xfetch_beta = xfetch_beta
+        self._stale_ttl = stale_ttl
+        self._tags = tags
+        self._expire_tags = expire_tags
+        self._tag_ttl = tag_ttl
+        self._use_entry = bool(xfetch_beta or stale_ttl or tags)
+        self._codec = get_codec(codec)
+        self._flights = {}  # key -> Future
+        self._async_flights = {}  # key -> asyncio.Task
+        self._refreshing = set()
+        self._refresh_tasks = set()  # 持有后台刷新任务的引用,防止被垃圾回收
+        self._flights_lock = threading.Lock()
+        self._key_options = {'prefix': key_prefix, 'ignore_args': ignore_args, 'typed': typed}
+        self._metrics_option = metrics
+        self._metrics = None
+
+        # 未指定缓存键时在装饰时根据函数签名创建KeyBuilder
+        self.key = None
+        self._wrapped = self._caching_wrapper
+        self._caching = not expire_key and not expire_tags
+
         if cache_key:
             self.key = cache_key
             self._wrapped = self._caching_wrapper
@@ -30,32 +170,406 @@ class CacheDecoratorFactory:
             self.key = expire_key
             self._wrapped = self._expiry_wrapper
 
+        if expire_tags:
+            # 可与expire_key同时使用: 先删除指定的缓存键,执行成功后再使标签失效
+            expiry_wrapper = self._wrapped if expire_key else None
+            self._wrapped = lambda func: self._tag_expiry_wrapper(expiry_wrapper(func) if expiry_wrapper else func)
+
         global cache_ignore_errors
         cache_ignore_errors = kwargs.get('ignore_errors', False)
 
     def __call__(self, func):
+        # 配置错误(如ignore_args中的参数不存在)在装饰时直接抛出,不经过ignore_errors
+        if self._caching:
+            if self.key is None:
+                self.key = KeyBuilder(func, **self._key_options)
+            if self._metrics_option:
+                name = self._metrics_option if isinstance(self._metrics_option, str) else \
+                    getattr(self.key, 'prefix', qualified_name(func))
+                self._metrics = get_metrics(name, 'function')
         return self._wrapped(func)
 
     @ignore_errors(cache_ignore_errors)
     def _caching_wrapper(self, func):
+        if inspect.iscoroutinefunction(func):
+            return self._attach_helpers(self._async_caching_wrapper(func))
+
         @wraps(func)
         def cache_setter(*args, **kwargs):
-            key = self.key(*args, **kwargs) if callable(self.key) else self.key.format(*args, **kwargs)
-            result = self._backend.get(key)
+            key = self._make_key(args, kwargs)
+            start_time = time.perf_counter()
+            result, refresh = self._lookup(key, tag_keys=self._make_tag_keys(self._tags, args, kwargs))
+            if self._metrics is not None:
+                self._record_lookup(key, result, refresh, time.perf_counter() - start_time)
 
-            if not result:
-                result = func(*args, **kwargs)
-                self._backend.set(key, result)
+            if result is _MISS:
+                if self._single_flight:
+                    result = self._call_once(key, lambda: self._load(key, func, args, kwargs))
+                else:
+                    result = self._load(key, func, args, kwargs)
+            elif refresh:
+                self._refresh_in_background(key, func, args, kwargs)
 
             return result
-        return cache_setter
+        return self._attach_helpers(cache_setter)
+
+    def _async_caching_wrapper(self, func):
+        @wraps(func)
+        async def async_cache_setter(*args, **kwargs):
+            key = self._make_key(args, kwargs)
+            start_time = time.perf_counter()
+            result, refresh = await self._alookup(key, tag_keys=self._make_tag_keys(self._tags, args, kwargs))
+            if self._metrics is not None:
+                self._record_lookup(key, result, refresh, time.perf_counter() - start_time)
+
+            if result is _MISS:
+                if self._single_flight:
+                    result = await self._acall_once(key, lambda: self._aload(key, func, args, kwargs))
+                else:
+                    result = await self._aload(key, func, args, kwargs)
+            elif refresh:
+                self._arefresh_in_background(key, func, args, kwargs)
+
+            return result
+        return async_cache_setter
 
     @ignore_errors(cache_ignore_errors)
     def _expiry_wrapper(self, func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_cache_deleter(*args, **kwargs):
+                key = self._make_key(args, kwargs)
+                await self._backend.adelete(key)
+
+                return await func(*args, **kwargs)
+            return async_cache_deleter
+
         @wraps(func)
         def cache_deleter(*args, **kwargs):
-            key = self.key(*args, **kwargs) if callable(self.key) else self.key.format(*args, **kwargs)
+            key = self._make_key(args, kwargs)
             self._backend.delete(key)
 
             return func(*args, **kwargs)
         return cache_deleter
+
+    @ignore_errors(cache_ignore_errors)
+    def _tag_expiry_wrapper(self, func):
+        """ 被装饰函数成功执行后使expire_tags中的标签失效
+
+        在执行之后失效,避免执行期间其它调用者以旧数据回填缓存
+        """
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_tag_expirer(*args, **kwargs):
+                result = await func(*args, **kwargs)
+                await ainvalidate_tags(self._backend, self._make_tags(self._expire_tags, args, kwargs), self._tag_ttl)
+                return result
+            return async_tag_expirer
+
+        @wraps(func)
+        def tag_expirer(*args, **kwargs):
+            result = func(*args, **kwargs)
+            invalidate_tags(self._backend, self._make_tags(self._expire_tags, args, kwargs), self._tag_ttl)
+            return result
+        return tag_expirer
+
+    def _attach_helpers(self, wrapper):
+        """ 为包装函数附加辅助方法: cache_key(*args, **kwargs)返回对应的缓存键, invalidate(*args, **kwargs)删除对应的缓存,
+        invalidate_tags(*tags)使依赖这些标签的缓存失效
+        """
+        wrapper.cache_key = lambda *args, **kwargs: self._make_key(args, kwargs)
+        wrapper.invalidate = lambda *args, **kwargs: self._backend.delete(self._make_key(args, kwargs))
+        wrapper.invalidate_tags = lambda *tags: invalidate_tags(self._backend, tags, self._tag_ttl)
+        wrapper.metrics = self._metrics
+        return wrapper
+
+    def _make_key(self, args, kwargs):
+        return self.key(*args, **kwargs) if callable(self.key) else self.key.format(*args, **kwargs)
+
+    @staticmethod
+    def _make_tags(tags, args, kwargs):
+        if not tags:
+            return []
+        if callable(tags):
+            return list(tags(*args, **kwargs))
+        return [tag.format(*args, **kwargs) for tag in tags]
+
+    def _make_tag_keys(self, tags, args, kwargs):
+        return [TAG_KEY_PREFIX + tag for tag in self._make_tags(tags, args, kwargs)]
+
+    def _lookup(self, key, early_refresh=True, tag_keys=()):
+        """ 读取缓存
+
+        :param early_refresh: 是否按XFetch算法判定提前过期
+        :param tag_keys: 标签键,与缓存值在同一次get_many中读取以校验令牌
+        :return: (缓存值, 是否需要后台刷新), 未命中时缓存值为_MISS
+        """
+        if tag_keys:
+            found = self._backend.get_many([key, *tag_keys])
+            return self._unpack(found.get(key), early_refresh, {tag_key: found.get(tag_key) for tag_key in tag_keys})
+        return self._unpack(self._backend.get(key), early_refresh)
+
+    async def _alookup(self, key, early_refresh=True, tag_keys=()):
+        if tag_keys:
+            found = await self._backend.aget_many([key, *tag_keys])
+            return self._unpack(found.get(key), early_refresh, {tag_key: found.get(tag_key) for tag_key in tag_keys})
+        return self._unpack(await self._backend.aget(key), early_refresh)
+
+    def _unpack(self, raw, early_refresh, tokens=None):
+        if self._codec is not None and raw is not None:
+            raw = self._codec.decode(raw)
+
+        if not self._use_entry:
+            return (raw, False) if raw is not None else (_MISS, False)
+
+        if raw is None:
+            return _MISS, False
+
+        entry = CacheEntry(*raw)
+        if tokens is not None and not self._tags_valid(entry, tokens):
+            return _MISS, False
+
+        if entry.expire_ts is None:
+            return entry.value, False
+
+        now = time.time()
+        if self._stale_ttl and now >= entry.expire_ts:
+            # 软过期且未到硬过期: 返回旧值并后台刷新
+            return entry.value, True
+
+        if early_refresh and self._xfetch_beta and entry.delta:
+            # XFetch: now - delta * beta * ln(rand) >= expiry 时提前重算, rand取值(0, 1]
+            if now - entry.delta * self._xfetch_beta * math.log(1.0 - random.random()) >= entry.expire_ts:
+                return (entry.value, True) if self._stale_ttl else (_MISS, False)
+        return entry.value, False
+
+    @staticmethod
+    def _tags_valid(entry, tokens):
+        """ 写入时记录的令牌与当前令牌全部一致才有效,令牌缺失(从未写入或已过期)视为失效
+        """
+        if not entry.tags or set(entry.tags) != set(tokens):
+            return False
+        return all(token is not None and _normalize_token(token) == entry.tags[tag_key]
+                   for tag_key, token in tokens.items())
+
+    def _tag_tokens(self, tag_keys):
+        """ 读取标签的当前令牌,缺失的令牌在此创建
+
+        须在执行被装饰函数之前读取: 执行期间标签被失效时,本次写入的缓存值在下次读取时即不再有效
+        """
+        if not tag_keys:
+            return None
+        tokens = {tag_key: _normalize_token(token) for tag_key, token in self._backend.get_many(tag_keys).items()}
+        missing = {tag_key: _new_token() for tag_key, token in tokens.items() if token is None}
+        if missing:
+            self._backend.set_many(missing, self._tag_ttl)
+            tokens.update(missing)
+        return tokens
+
+    async def _atag_tokens(self, tag_keys):
+        if not tag_keys:
+            return None
+        found = await self._backend.aget_many(tag_keys)
+        tokens = {tag_key: _normalize_token(token) for tag_key, token in found.items()}
+        missing = {tag_key: _new_token() for tag_key, token in tokens.items() if token is None}
+        if missing:
+            await self._backend.aset_many(missing, self._tag_ttl)
+            tokens.update(missing)
+        return tokens
+
+    def _load(self, key, func, args, kwargs):
+        """ 执行被装饰函数并写入缓存,配置了lease_pool时先获取Redis租约
+        """
+        tag_keys = self._make_tag_keys(self._tags, args, kwargs)
+        lease = None
+        if self._lease_pool is not None:
+            from commutils.parallel.redis_lock import RedisLock
+
+            lease = RedisLock(self._lease_pool, LEASE_KEY_PREFIX + key, self._lease_ttl)
+            if not lease.acquire(blocking=False):
+                # 其它进程正在计算,等待其写入缓存;超时则自行计算
+                lease = None
+                result = self._wait_for(key, tag_keys)
+                if result is not _MISS:
+                    return result
+
+        try:
+            tokens = self._tag_tokens(tag_keys)
+            result, delta = self._execute(func, args, kwargs)
+            self._store(key, result, delta, tokens)
+            return result
+        finally:
+            if lease is not None:
+                lease.release()
+
+    async def _aload(self, key, func, args, kwargs):
+        """ _load的协程版本,Redis租约的加锁/解锁在默认线程池中执行以免阻塞事件循环
+        """
+        loop = asyncio.get_event_loop()
+        tag_keys = self._make_tag_keys(self._tags, args, kwargs)
+        lease = None
+        if self._lease_pool is not None:
+            from commutils.parallel.redis_lock import RedisLock
+
+            lease = RedisLock(self._lease_pool, LEASE_KEY_PREFIX + key, self._lease_ttl)
+            if not await loop.run_in_executor(None, lambda: lease.acquire(blocking=False)):
+                lease = None
+                result = await self._await_for(key, tag_keys)
+                if result is not _MISS:
+                    return result
+
+        try:
+            tokens = await self._atag_tokens(tag_keys)
+            result, delta = await self._aexecute(func, args, kwargs)
+            value, expire = self._pack(result, delta, tokens)
+            await self._backend.aset(key, value, expire)
+            return result
+        finally:
+            if lease is not None:
+                await loop.run_in_executor(None, lease.release)
+
+    def _store(self, key, result, delta, tokens=None):
+        self._backend.set(key, *self._pack(result, delta, tokens))
+
+    def _pack(self, result, delta, tokens=None):
+        """ 将被装饰函数的返回值打包为待写入后端的(值, 过期时间)
+        """
+        expire = None
+        if self._use_entry:
+            expire_sec = self._backend.default_expire
+            result = CacheEntry(result, None if expire_sec is None else time.time() + expire_sec, delta, tokens)
+            if self._stale_ttl and expire_sec is not None:
+                expire = expire_sec + self._stale_ttl
+
+        if self._codec is not None:
+            result = self._codec.encode(result)
+
+        if self._metrics is not None:
+            self._metrics.observe_size(len(result) if isinstance(result, (bytes, bytearray)) else sys.getsizeof(result))
+        return result, expire
+
+    def _record_lookup(self, key, result, refresh, seconds):
+        if result is _MISS:
+            counter = 'misses'
+        else:
+            counter = 'stale' if refresh and self._stale_ttl else 'hits'
+        self._metrics.record('lookup', seconds, counter, keys=(key,))
+
+    def _execute(self, func, args, kwargs):
+        """ 执行被装饰函数,返回(结果, 耗时)
+        """
+        start_time = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            if self._metrics is not None:
+                self._metrics.incr('load_errors')
+            raise
+
+        delta = time.time() - start_time
+        if self._metrics is not None:
+            self._metrics.record('load', delta, 'loads')
+        return result, delta
+
+    async def _aexecute(self, func, args, kwargs):
+        start_time = time.time()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            if self._metrics is not None:
+                self._metrics.incr('load_errors')
+            raise
+
+        delta = time.time() - start_time
+        if self._metrics is not None:
+            self._metrics.record('load', delta, 'loads')
+        return result, delta
+
+    def _refresh_in_background(self, key, func, args, kwargs):
+        """ 在后台线程池中重新计算并写入缓存,同一个键同一时刻只提交一个刷新任务
+        """
+        with self._flights_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load(key, func, args, kwargs)
+            except Exception as e:
+                warnings.warn(f"Background refresh of cache key {key!r} failed: {e}")
+            finally:
+                with self._flights_lock:
+                    self._refreshing.discard(key)
+
+        get_refresh_executor().submit(refresh)
+
+    def _arefresh_in_background(self, key, func, args, kwargs):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def refresh():
+            try:
+                await self._aload(key, func, args, kwargs)
+            except Exception as e:
+                warnings.warn(f"Background refresh of cache key {key!r} failed: {e}")
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.ensure_future(refresh())
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    def _wait_for(self, key, tag_keys=()):
+        deadline = time.time() + self._lease_ttl
+        while True:
+            # 提前刷新场景下旧值仍然有效,首次检查不等待
+            result, _ = self._lookup(key, early_refresh=False, tag_keys=tag_keys)
+            if result is not _MISS or time.time() >= deadline:
+                return result
+            time.sleep(self._lease_poll)
+
+    async def _await_for(self, key, tag_keys=()):
+        deadline = time.time() + self._lease_ttl
+        while True:
+            result, _ = await self._alookup(key, early_refresh=False, tag_keys=tag_keys)
+            if result is not _MISS or time.time() >= deadline:
+                return result
+            await asyncio.sleep(self._lease_poll)
+
+    def _call_once(self, key, load):
+        """ 进程内单飞: 同一个键同一时刻只执行一次load,其余调用者共享其结果或异常
+        """
+        with self._flights_lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = load()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+
+    async def _acall_once(self, key, load):
+        """ _call_once的协程版本,仅在同一个事件循环内生效
+
+        load在单独的任务中执行,各调用者(含发起者)只通过shield等待: 某个调用者被取消(如客户端断开)时,
+        load继续执行,其余调用者照常得到结果
+        """
+        task = self._async_flights.get(key)
+        if task is None:
+            task = self._async_flights[key] = asyncio.ensure_future(load())
+            task.add_done_callback(lambda done: self._async_flights.pop(key, None)
+                                   if self._async_flights.get(key) is done else None)
+        return await asyncio.shield(task)
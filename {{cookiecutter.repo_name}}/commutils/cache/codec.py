@@ -0,0 +1,282 @@
+""" 缓存值序列化(编解码)模块
+
+编码后的字节串带有2字节帧头: [序列化方式ID][压缩方式ID],解码时按帧头自动选择,因此切换codec不影响已写入的旧值
+可选序列化方式:
+    pickle: 标准库,类型完整保留,仅适用于可信数据
+    json: 标准库,跨语言可读;通过类型标记保留tuple/set/bytes/datetime等类型
+    msgpack: 需安装msgpack,体积与速度通常最优;通过扩展类型保留tuple/set
+可选压缩方式(仅对超过阈值的负载压缩):
+    zlib: 标准库
+    zstd: 需安装zstandard
+    lz4: 需安装lz4
+"""
+
+import datetime
+import json
+import pickle
+import zlib
+from typing import Any, Union
+
+
+class Serializer:
+    """ 序列化方式基类
+    """
+    codec_id = None
+
+    def dumps(self, obj) -> bytes:
+        raise NotImplementedError()
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError()
+
+
+class PickleSerializer(Serializer):
+    codec_id = 1
+
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+        self._protocol = protocol
+
+    def dumps(self, obj):
+        return pickle.dumps(obj, self._protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class JsonSerializer(Serializer):
+    """ JSON序列化
+
+    json模块会将tuple转为list,因此编码前递归地将不被JSON原生支持的类型转为{"__type__": 类型, "v": 值}
+    """
+    codec_id = 2
+
+    _TYPE_KEY = '__type__'
+
+    def dumps(self, obj):
+        return json.dumps(self._wrap(obj), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(bytes(data), object_hook=self._unwrap)
+
+    def _wrap(self, obj):
+        if obj is None or isinstance(obj, (str, int, float, bool)):
+            return obj
+        if isinstance(obj, list):
+            return [self._wrap(item) for item in obj]
+        if isinstance(obj, dict):
+            if all(isinstance(key, str) for key in obj) and self._TYPE_KEY not in obj:
+                return {key: self._wrap(value) for key, value in obj.items()}
+            return {self._TYPE_KEY: 'dict', 'v': [[self._wrap(k), self._wrap(v)] for k, v in obj.items()]}
+        if isinstance(obj, tuple):
+            return {self._TYPE_KEY: 'tuple', 'v': [self._wrap(item) for item in obj]}
+        if isinstance(obj, (set, frozenset)):
+            return {self._TYPE_KEY: type(obj).__name__, 'v': [self._wrap(item) for item in obj]}
+        if isinstance(obj, bytes):
+            return {self._TYPE_KEY: 'bytes', 'v': obj.hex()}
+        if isinstance(obj, datetime.datetime):
+            return {self._TYPE_KEY: 'datetime', 'v': obj.isoformat()}
+        if isinstance(obj, datetime.date):
+            return {self._TYPE_KEY: 'date', 'v': obj.isoformat()}
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def _unwrap(self, obj):
+        type_name = obj.get(self._TYPE_KEY)
+        if type_name is None:
+            return obj
+
+        value = obj['v']
+        if type_name == 'tuple':
+            return tuple(value)
+        if type_name == 'set':
+            return set(value)
+        if type_name == 'frozenset':
+            return frozenset(value)
+        if type_name == 'dict':
+            return dict(value)
+        if type_name == 'bytes':
+            return bytes.fromhex(value)
+        if type_name == 'datetime':
+            return datetime.datetime.fromisoformat(value)
+        if type_name == 'date':
+            return datetime.date.fromisoformat(value)
+        return obj
+
+
+class MsgpackSerializer(Serializer):
+    """ msgpack序列化,需安装msgpack
+    """
+    codec_id = 3
+
+    _EXT_TUPLE = 1
+    _EXT_SET = 2
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def dumps(self, obj):
+        return self._msgpack.packb(obj, use_bin_type=True, strict_types=True, default=self._default)
+
+    def loads(self, data):
+        return self._msgpack.unpackb(data, raw=False, strict_map_key=False, ext_hook=self._ext_hook)
+
+    def _default(self, obj):
+        if isinstance(obj, tuple):
+            return self._msgpack.ExtType(self._EXT_TUPLE, self.dumps(list(obj)))
+        if isinstance(obj, (set, frozenset)):
+            return self._msgpack.ExtType(self._EXT_SET, self.dumps(list(obj)))
+        raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+    def _ext_hook(self, code, data):
+        if code == self._EXT_TUPLE:
+            return tuple(self.loads(data))
+        if code == self._EXT_SET:
+            return set(self.loads(data))
+        return self._msgpack.ExtType(code, data)
+
+
+class Compressor:
+    """ 压缩方式基类
+    """
+    compression_id = None
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+
+class ZlibCompressor(Compressor):
+    compression_id = 1
+
+    def __init__(self, level=6):
+        self._level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self._level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    """ zstd压缩,需安装zstandard
+    """
+    compression_id = 2
+
+    def __init__(self, level=3):
+        import zstandard
+
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+
+class Lz4Compressor(Compressor):
+    """ lz4压缩,需安装lz4
+    """
+    compression_id = 3
+
+    def __init__(self):
+        import lz4.frame
+
+        self._lz4 = lz4.frame
+
+    def compress(self, data):
+        return self._lz4.compress(data)
+
+    def decompress(self, data):
+        return self._lz4.decompress(data)
+
+
+SERIALIZERS = {
+    'pickle': PickleSerializer,
+    'json': JsonSerializer,
+    'msgpack': MsgpackSerializer,
+}
+
+COMPRESSORS = {
+    'zlib': ZlibCompressor,
+    'zstd': ZstdCompressor,
+    'lz4': Lz4Compressor,
+}
+
+
+class Codec:
+    """ 缓存值编解码器: 序列化 + 可选压缩 + 帧头
+
+    解码时按帧头选择序列化/压缩方式,未用到的方式按需惰性创建
+    """
+
+    def __init__(self, serializer: Union[str, Serializer] = 'pickle',
+                 compression: Union[str, Compressor, None] = None, threshold=1024):
+        """
+        :param serializer: 序列化方式,可选'pickle'/'json'/'msgpack'或Serializer实例
+        :param compression: 压缩方式,可选None/'zlib'/'zstd'/'lz4'或Compressor实例
+        :param threshold: 序列化结果超过该字节数时才压缩
+        """
+        self.serializer = SERIALIZERS[serializer]() if isinstance(serializer, str) else serializer
+        self.compressor = COMPRESSORS[compression]() if isinstance(compression, str) else compression
+        self.threshold = threshold
+
+        self._serializers = {self.serializer.codec_id: self.serializer}
+        self._compressors = {self.compressor.compression_id: self.compressor} if self.compressor else {}
+
+    def encode(self, obj) -> bytes:
+        data = self.serializer.dumps(obj)
+        compression_id = 0
+        if self.compressor is not None and len(data) > self.threshold:
+            compressed = self.compressor.compress(data)
+            if len(compressed) < len(data):
+                data, compression_id = compressed, self.compressor.compression_id
+
+        return bytes((self.serializer.codec_id, compression_id)) + data
+
+    def decode(self, data: bytes) -> Any:
+        if data is None:
+            return None
+        if isinstance(data, str):
+            # Redis连接池开启decode_responses时读到的是str;仅未压缩的json编码结果为合法UTF-8,可无损还原
+            data = data.encode('utf-8')
+
+        codec_id, compression_id = data[0], data[1]
+        payload = memoryview(data)[2:]
+        if compression_id:
+            payload = self._get_compressor(compression_id).decompress(payload)
+
+        return self._get_serializer(codec_id).loads(payload)
+
+    def _get_serializer(self, codec_id):
+        if codec_id not in self._serializers:
+            self._serializers[codec_id] = _by_id(SERIALIZERS, 'codec_id', codec_id)()
+        return self._serializers[codec_id]
+
+    def _get_compressor(self, compression_id):
+        if compression_id not in self._compressors:
+            self._compressors[compression_id] = _by_id(COMPRESSORS, 'compression_id', compression_id)()
+        return self._compressors[compression_id]
+
+
+def _by_id(registry, attr, value):
+    for cls in registry.values():
+        if getattr(cls, attr) == value:
+            return cls
+    raise ValueError(f"Unknown {attr}: {value}")
+
+
+def get_codec(codec: Union[str, Codec, None], **kwargs):
+    """ 由名称或实例得到Codec实例
+
+    :param codec: None(不编码)、序列化方式名称或Codec实例
+    :param kwargs: 透传给Codec的compression/threshold参数
+    """
+    if codec is None or isinstance(codec, Codec):
+        return codec
+    return Codec(codec, **kwargs)
@@ -0,0 +1,125 @@
+""" 根据被装饰函数的参数自动生成缓存键
+
+生成规则: "{模块名}.{函数限定名}:{参数部分}"
+    1) 参数均为str/int/float/bool/None时,参数部分为各参数repr的拼接(快速路径,可读性好)
+    2) 含有其它类型(list/dict/set/tuple等)或拼接结果过长时,参数部分为规范化表示的blake2b摘要
+    3) f(1, 2)与f(1, b=2)生成相同的键;未显式传入的默认参数不参与生成
+    4) 仅限关键字参数与**kwargs表示为"名称=值"(名称不加引号),不会与值为字符串"名称=值"的位置参数相同
+注意: 规范化表示依赖对象的repr,repr中含内存地址的自定义对象无法命中缓存,应通过ignore_args忽略或实现__cache_key__方法
+"""
+
+import hashlib
+import inspect
+
+_PRIMITIVES = {str, int, float, bool, type(None)}
+
+
+def _canonical(obj) -> str:
+    """ 与容器元素顺序无关(dict/set)的稳定表示
+    """
+    cls = type(obj)
+    if cls in _PRIMITIVES:
+        return repr(obj)
+    if hasattr(obj, '__cache_key__'):
+        return f"{cls.__name__}<{obj.__cache_key__()}>"
+    if cls in (list, tuple):
+        return f"{cls.__name__}[{','.join(_canonical(item) for item in obj)}]"
+    if cls in (set, frozenset):
+        return f"{cls.__name__}[{','.join(sorted(_canonical(item) for item in obj))}]"
+    if cls is dict:
+        items = sorted(f"{_canonical(k)}:{_canonical(v)}" for k, v in obj.items())
+        return f"dict[{','.join(items)}]"
+    return f"{cls.__module__}.{cls.__qualname__}<{obj!r}>"
+
+
+def qualified_name(func) -> str:
+    """ 函数的"模块名.限定名",functools.partial等没有__qualname__的可调用对象使用其repr
+    """
+    qualname = getattr(func, '__qualname__', None)
+    if qualname is None:
+        return repr(func)
+    return f"{getattr(func, '__module__', None)}.{qualname}"
+
+
+class _Keyword(tuple):
+    """ 仅限关键字参数与**kwargs中的一项: (名称, 值)
+    """
+    __slots__ = ()
+
+
+class KeyBuilder:
+    """ 缓存键生成器,可作为CacheDecoratorFactory的cache_key使用
+    """
+
+    def __init__(self, func, prefix=None, ignore_args=(), typed=False, max_length=200):
+        """
+        :param func: 被装饰函数
+        :param prefix: 键前缀,默认为"模块名.函数限定名"
+        :param ignore_args: 不参与生成键的参数名,如self/cls/数据库连接
+        :param typed: 是否区分参数类型,为True时f(1)与f(1.0)生成不同的键
+        :param max_length: 参数部分超过该长度时使用摘要
+        """
+        self.prefix = prefix or qualified_name(func)
+        try:
+            self._signature = inspect.signature(func)
+        except (TypeError, ValueError):
+            # 无法获取签名的可调用对象(如内置类型int): 位置参数按原样,关键字参数按名称排序
+            self._signature = None
+        self._ignore = frozenset(ignore_args)
+        self._typed = typed
+        self._max_length = max_length
+
+        if self._signature is None:
+            assert not self._ignore, f"无法获取{self.prefix}的签名,不支持ignore_args"
+        else:
+            unknown = self._ignore.difference(self._signature.parameters)
+            assert not unknown, f"ignore_args中的参数不存在: {','.join(sorted(unknown))}"
+
+    def __call__(self, *args, **kwargs) -> str:
+        if kwargs or self._ignore:
+            parts = self._bind(args, kwargs)
+        else:
+            parts = args
+
+        if all(type(part[1] if type(part) is _Keyword else part) in _PRIMITIVES for part in parts):
+            body = ','.join(self._render(part, self._repr) for part in parts)
+            if len(body) <= self._max_length:
+                return f"{self.prefix}:{body}"
+        else:
+            body = ','.join(self._render(part, self._canonical) for part in parts)
+
+        return f"{self.prefix}:#{hashlib.blake2b(body.encode(), digest_size=16).hexdigest()}"
+
+    def _bind(self, args, kwargs):
+        """ 按函数签名将参数规范化为列表: 位置参数按定义顺序排列,仅限关键字参数与**kwargs按名称排序、以_Keyword表示
+        """
+        if self._signature is None:
+            return list(args) + [_Keyword(item) for item in sorted(kwargs.items())]
+
+        parts = []
+        for name, value in self._signature.bind(*args, **kwargs).arguments.items():
+            if name in self._ignore:
+                continue
+
+            kind = self._signature.parameters[name].kind
+            if kind is inspect.Parameter.VAR_POSITIONAL:
+                parts.extend(value)
+            elif kind is inspect.Parameter.VAR_KEYWORD:
+                parts.extend(_Keyword(item) for item in sorted(value.items()))
+            elif kind is inspect.Parameter.KEYWORD_ONLY:
+                parts.append(_Keyword((name, value)))
+            else:
+                parts.append(value)
+        return parts
+
+    @staticmethod
+    def _render(part, render):
+        if type(part) is _Keyword:
+            return f"{part[0]}={render(part[1])}"
+        return render(part)
+
+    def _repr(self, part):
+        return f"{type(part).__name__}:{part!r}" if self._typed else repr(part)
+
+    def _canonical(self, part):
+        return f"{type(part).__name__}:{_canonical(part)}" if self._typed else _canonical(part)
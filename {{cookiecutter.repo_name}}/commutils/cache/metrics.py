@@ -0,0 +1,235 @@
+""" 缓存指标: 按缓存后端与被装饰函数统计命中/未命中/写入/淘汰、操作延迟、负载大小与热点键
+
+启用方式:
+    1) 缓存后端: cache = RedisCache(pool).instrumented('user-cache'),返回InstrumentedCache包装对象
+    2) 被装饰函数: @easycache(metrics=True),以缓存键前缀(默认为"模块名.函数限定名")作为函数名,也可传入字符串指定
+导出: render_prometheus()返回所有已注册指标的Prometheus文本,可挂载到Web框架的/metrics路由
+    热点键默认只按排名导出访问量,不导出键本身(避免标签基数无限增长、用户数据进入监控系统),
+    需要时以hot_key_label='hash'导出键的摘要;键原文可通过snapshot()在进程内查看
+注意: 指标保存在进程内,gunicorn/uWSGI多worker部署时每个worker各自导出,由采集端按实例汇总
+"""
+
+import hashlib
+import threading
+
+from ..common.metrics import (DEFAULT_LATENCY_BUCKETS, DEFAULT_SIZE_BUCKETS, Histogram, MetricFamily, SpaceSaving,
+                              render_prometheus as _render)
+
+# 后端stats中可导出的字段: 字段名 -> (指标类型, 说明)
+_BACKEND_STATS = {
+    'evictions': ('counter', "Entries evicted by the backend to stay within its capacity"),
+    'expirations': ('counter', "Expired entries reclaimed by the backend"),
+    'entries': ('gauge', "Entries currently held by the backend"),
+    'bytes': ('gauge', "Bytes currently held by the backend"),
+}
+
+_COUNTERS = {
+    'backend': {
+        'hits': "Cache lookups that found a value",
+        'misses': "Cache lookups that found nothing",
+        'sets': "Entries written",
+        'deletes': "Entries deleted",
+        'errors': "Backend operations that raised",
+    },
+    'function': {
+        'hits': "Calls served from cache",
+        'stale': "Calls served a stale value while it was refreshed",
+        'misses': "Calls that had to run the function",
+        'loads': "Function executions whose result was cached",
+        'load_errors': "Function executions that raised",
+    },
+}
+
+_LABELS = {'backend': 'cache', 'function': 'function'}
+
+HOT_KEY_LABELS = (None, 'hash', 'raw')
+
+
+class CacheMetrics:
+    """ 单个缓存后端或被装饰函数的指标
+    """
+
+    def __init__(self, name, kind='backend', top_k=20, hot_key_sample=1, stats=None,
+                 latency_buckets=DEFAULT_LATENCY_BUCKETS, size_buckets=DEFAULT_SIZE_BUCKETS):
+        """
+        :param name: 名称,作为Prometheus标签值
+        :param kind: 'backend'或'function'
+        :param top_k: 导出的热点键数量,0表示不统计
+        :param hot_key_sample: 每N次访问统计一次热点键,访问量极大时可调大以降低开销
+        :param stats: 返回后端自身统计(如BoundedCache.stats中的evictions)的可调用对象
+        :param latency_buckets: 延迟直方图的桶(秒)
+        :param size_buckets: 负载大小直方图的桶(字节)
+        """
+        assert kind in _COUNTERS, f"不支持的指标类型: {kind}"
+
+        self.name = name
+        self.kind = kind
+        self.top_k = top_k
+        self.counters = dict.fromkeys(_COUNTERS[kind], 0)
+        self.latency = {}  # op -> Histogram
+        self.payload = Histogram(size_buckets)
+        # 跟踪数量多于导出数量,提高Top-K的准确度
+        self.hot_keys = SpaceSaving(top_k * 5) if top_k else None
+        self._hot_key_sample = hot_key_sample
+        self._ticks = 0
+        self._stats = stats
+        self._latency_buckets = latency_buckets
+        self._lock = threading.Lock()
+
+    def record(self, op, seconds, counter=None, count=1, keys=None):
+        """ 记录一次操作
+
+        :param op: 操作名,如get/set/lookup/load
+        :param seconds: 耗时
+        :param counter: 需累加的计数器
+        :param count: 累加值
+        :param keys: 本次访问的键,用于热点统计
+        """
+        histogram = self.latency.get(op)
+        if histogram is None:
+            histogram = self.latency.setdefault(op, Histogram(self._latency_buckets))
+        histogram.observe(seconds)
+
+        with self._lock:
+            if counter is not None:
+                self.counters[counter] += count
+            if keys and self.hot_keys is not None:
+                for key in keys:
+                    self._ticks += 1
+                    if self._ticks % self._hot_key_sample == 0:
+                        self.hot_keys.add(key)
+
+    def incr(self, counter, count=1):
+        with self._lock:
+            self.counters[counter] += count
+
+    def observe_size(self, nbytes):
+        self.payload.observe(nbytes)
+
+    def top_keys(self, k=None):
+        """ [(键, 估计访问次数)],采样时已按采样比例还原
+        """
+        if self.hot_keys is None:
+            return []
+        with self._lock:
+            top = self.hot_keys.top(k or self.top_k)
+        return [(key, count * self._hot_key_sample) for key, count, _ in top]
+
+    def backend_stats(self):
+        if self._stats is None:
+            return {}
+        try:
+            return self._stats() or {}
+        except Exception:
+            return {}
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters.get('stale', 0) + counters['misses']
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            **counters,
+            'hit_ratio': (lookups - counters['misses']) / lookups if lookups else 0.0,
+            'latency': {op: histogram.snapshot() for op, histogram in self.latency.items()},
+            'payload': self.payload.snapshot(),
+            'hot_keys': self.top_keys(),
+            'backend': self.backend_stats(),
+        }
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+            if self.hot_keys is not None:
+                self.hot_keys.clear()
+        for histogram in self.latency.values():
+            histogram.reset()
+        self.payload.reset()
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_metrics(name, kind='backend', **kwargs) -> CacheMetrics:
+    """ 获取已注册的指标,不存在时创建并注册,同名同类的缓存后端/被装饰函数共享一份指标
+
+    :param name: 名称
+    :param kind: 'backend'或'function'
+    :param kwargs: 创建时透传给CacheMetrics
+    :return:
+    """
+    with _registry_lock:
+        metrics = _registry.get((kind, name))
+        if metrics is None:
+            metrics = _registry[(kind, name)] = CacheMetrics(name, kind, **kwargs)
+        return metrics
+
+
+def unregister(name, kind='backend'):
+    with _registry_lock:
+        _registry.pop((kind, name), None)
+
+
+def all_metrics():
+    with _registry_lock:
+        return list(_registry.values())
+
+
+def snapshot():
+    """ 所有已注册指标的快照,便于日志输出或调试
+    """
+    return [metrics.snapshot() for metrics in all_metrics()]
+
+
+def _hot_key_label(key, mode):
+    text = key.decode('utf-8', 'replace') if isinstance(key, bytes) else str(key)
+    if mode == 'hash':
+        return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+    return text
+
+
+def render_prometheus(prefix='easycache', hot_key_label=None):
+    """ 以Prometheus文本格式导出所有已注册的指标
+
+    :param prefix: 指标名前缀
+    :param hot_key_label: 热点键的key标签: None(不导出,仅有rank标签), 'hash'(键的blake2b摘要),
+        'raw'(键原文,标签基数不受限且可能含用户数据,仅用于临时排查)
+    :return:
+    """
+    assert hot_key_label in HOT_KEY_LABELS, f"不支持的hot_key_label: {hot_key_label}"
+    families = []
+    for kind, label in _LABELS.items():
+        registered = [metrics for metrics in all_metrics() if metrics.kind == kind]
+        base = f"{prefix}_{kind}"
+
+        for counter, documentation in _COUNTERS[kind].items():
+            family = MetricFamily(f"{base}_{counter}_total", 'counter', documentation)
+            for metrics in registered:
+                family.add({label: metrics.name}, metrics.counters[counter])
+            families.append(family)
+
+        latency = MetricFamily(f"{base}_operation_seconds", 'histogram', "Latency of cache operations")
+        payload = MetricFamily(f"{base}_payload_bytes", 'histogram', "Size of values written to the cache")
+        hot_keys = MetricFamily(f"{base}_hot_key_requests", 'gauge',
+                                "Estimated accesses of the most frequently accessed keys (space-saving sketch)")
+        stats = {field: MetricFamily(f"{base}_{field}" + ('_total' if metric_type == 'counter' else ''),
+                                     metric_type, documentation)
+                 for field, (metric_type, documentation) in _BACKEND_STATS.items()}
+        for metrics in registered:
+            for op, histogram in list(metrics.latency.items()):
+                latency.add_histogram({label: metrics.name, 'op': op}, histogram)
+            if metrics.payload.count:
+                payload.add_histogram({label: metrics.name}, metrics.payload)
+            for rank, (key, count) in enumerate(metrics.top_keys(), 1):
+                labels = {label: metrics.name, 'rank': rank}
+                if hot_key_label is not None:
+                    labels['key'] = _hot_key_label(key, hot_key_label)
+                hot_keys.add(labels, count)
+            for field, value in metrics.backend_stats().items():
+                if field in stats and isinstance(value, (int, float)):
+                    stats[field].add({label: metrics.name}, value)
+        families.extend([latency, payload, hot_keys, *stats.values()])
+
+    return _render(families)
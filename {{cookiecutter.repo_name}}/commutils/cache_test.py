@@ -2,8 +2,8 @@
 
 """
 
+import asyncio
 import time
-import json
 
 # 直接运行的脚本,使用绝对路径导入
 from commutils.cache import easycache
@@ -41,7 +41,8 @@ def basic_test(cache):
 
 
 # 不传backend则使用字典缓存;缓存2秒(去掉dexp则会永久缓存)
-@easycache(backend=redis_cache, cache_key='cur_time', dexp=2)
+# codec='json'会保留tuple等类型;连接池开启了decode_responses,因此只能使用json且不能压缩
+@easycache(backend=redis_cache, cache_key='cur_time', dexp=2, codec='json')
 def cur_time():
     global last_time
 
@@ -52,8 +53,19 @@ def cur_time():
     if cur_time - last_time > 5:
         last_time = cur_time
 
-    # 注意:若使用redis缓存,特殊数据类型需转为json字符串,此处存储tuple再取出时为list类型
-    return json.dumps((cur_time,))
+    return cur_time,
+
+
+# 协程函数会自动使用异步缓存路径;single_flight使并发调用只执行一次
+@easycache(backend=DictCache(), cache_key='async_cur_time', single_flight=True, dexp=2)
+async def async_cur_time():
+    await asyncio.sleep(0.5)
+    return time.time()
+
+
+async def async_test():
+    results = await asyncio.gather(*[async_cur_time() for _ in range(5)])
+    print(f"Concurrent async calls share one result: {len(set(results)) == 1}")
 
 
 if __name__ == '__main__':
@@ -76,3 +88,6 @@ if __name__ == '__main__':
     print(f"Initial call in a new lifecycle: {cur_time()}")
     time.sleep(1)
     print(f"In caching lifecycle call: {cur_time()}")
+
+    # 异步装饰器测试
+    asyncio.run(async_test())
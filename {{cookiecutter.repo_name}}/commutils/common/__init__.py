@@ -0,0 +1 @@
+from .decorators import timer, retry, ignore_errors
@@ -0,0 +1,203 @@
+""" 轻量级指标工具: 直方图、Top-K热点统计与Prometheus文本格式输出
+
+不依赖prometheus_client,适合在库代码中常开;指标按进程统计,多worker部署时由采集端按实例汇总
+"""
+
+import bisect
+import math
+import threading
+
+# 延迟直方图的默认桶(秒): 10微秒至5秒
+DEFAULT_LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 负载大小直方图的默认桶(字节): 64B至4MB
+DEFAULT_SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """ 固定桶直方图(线程安全)
+
+    与Prometheus的histogram语义一致: 第i个桶统计 <= buckets[i] 的观测值,另有+Inf桶
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """ 各桶的累计计数,最后一项为+Inf桶(即总数)
+        """
+        with self._lock:
+            counts = list(self._counts)
+        total, result = 0, []
+        for count in counts:
+            total += count
+            result.append(total)
+        return result
+
+    def quantile(self, q):
+        """ 按桶内线性插值估算分位数,落在+Inf桶时返回最大的有限桶边界
+
+        :param q: 分位(0-1)
+        :return:
+        """
+        cumulative = self.cumulative()
+        total = cumulative[-1]
+        if not total:
+            return 0.0
+
+        rank = q * total
+        index = bisect.bisect_left(cumulative, rank)
+        if index >= len(self.buckets):
+            return self.buckets[-1]
+        lower = self.buckets[index - 1] if index > 0 else 0.0
+        below = cumulative[index - 1] if index > 0 else 0
+        in_bucket = cumulative[index] - below
+        return lower + (self.buckets[index] - lower) * ((rank - below) / in_bucket if in_bucket else 1.0)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self.sum = 0.0
+            self.count = 0
+
+
+class SpaceSaving:
+    """ Space-Saving算法的Top-K热点统计(非线程安全,由调用方加锁)
+
+    最多跟踪capacity个元素,新元素在已满时替换计数最小的元素并继承其计数;
+    计数按频率分桶维护(同LFUPolicy),每次更新O(1)。
+    估计计数不低于真实计数,且高出部分不超过error;真实频率高于 总数/capacity 的元素一定会被跟踪
+    """
+
+    def __init__(self, capacity=100):
+        assert capacity > 0, "capacity需大于0"
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}  # item -> 估计计数
+        self._errors = {}  # item -> 误差上限
+        self._buckets = {}  # count -> {item: None},字典用作有序集合
+        self._min_count = 0
+
+    def add(self, item):
+        self.total += 1
+        count = self._counts.get(item)
+        if count is not None:
+            self._move(item, count)
+            return
+
+        if len(self._counts) < self.capacity:
+            self._counts[item] = 1
+            self._errors[item] = 0
+            self._buckets.setdefault(1, {})[item] = None
+            self._min_count = 1
+            return
+
+        # 替换计数最小的元素中最早进入该桶的一个
+        bucket = self._buckets[self._min_count]
+        victim = next(iter(bucket))
+        del bucket[victim], self._counts[victim], self._errors[victim]
+        self._counts[item] = self._min_count
+        self._errors[item] = self._min_count
+        bucket[item] = None
+        self._move(item, self._min_count)
+
+    def top(self, k=None):
+        """ 按估计计数降序返回[(元素, 估计计数, 误差上限)]
+        """
+        items = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(item, count, self._errors[item]) for item, count in items]
+
+    def clear(self):
+        self.total = 0
+        self._counts.clear()
+        self._errors.clear()
+        self._buckets.clear()
+        self._min_count = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _move(self, item, count):
+        bucket = self._buckets[count]
+        del bucket[item]
+        if not bucket:
+            del self._buckets[count]
+            if self._min_count == count:
+                self._min_count = count + 1
+        self._counts[item] = count + 1
+        self._buckets.setdefault(count + 1, {})[item] = None
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if math.isnan(value):
+            return 'NaN'
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class MetricFamily:
+    """ Prometheus文本格式的一个指标族
+    """
+
+    def __init__(self, name, metric_type, documentation):
+        """
+        :param name: 指标名
+        :param metric_type: counter/gauge/histogram
+        :param documentation: HELP说明
+        """
+        self.name = name
+        self.type = metric_type
+        self.documentation = documentation
+        self.samples = []
+
+    def add(self, labels, value):
+        self.samples.append(f"{self.name}{format_labels(labels)} {_format_value(value)}")
+
+    def add_histogram(self, labels, histogram: Histogram):
+        cumulative = histogram.cumulative()
+        for bound, count in zip(histogram.buckets + (math.inf,), cumulative):
+            bucket_labels = dict(labels, le=_format_value(float(bound)))
+            self.samples.append(f"{self.name}_bucket{format_labels(bucket_labels)} {count}")
+        self.samples.append(f"{self.name}_sum{format_labels(labels)} {_format_value(histogram.sum)}")
+        self.samples.append(f"{self.name}_count{format_labels(labels)} {cumulative[-1]}")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        return '\n'.join(lines + self.samples)
+
+
+def render_prometheus(families):
+    """ 将多个指标族渲染为Prometheus文本格式(text/plain; version=0.0.4),省略没有样本的指标族
+    """
+    return '\n'.join(family.render() for family in families if family.samples) + '\n'
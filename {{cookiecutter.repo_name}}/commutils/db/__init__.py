@@ -1,4 +1,4 @@
-__all__ = ["RedisPool"]
+__all__ = ["RedisPool", "AsyncRedisPool"]
 
 
-from .redis_conn import RedisPool
+from .redis_conn import RedisPool, AsyncRedisPool
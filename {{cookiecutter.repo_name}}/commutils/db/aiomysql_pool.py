@@ -0,0 +1,344 @@
+""" asyncio版MySQL连接池,供FastAPI等异步框架使用,避免数据库I/O阻塞事件循环
+
+依赖: aiomysql (底层为pymysql,配置项与pymysqlpool.ConnectionPool一致)
+与pymysqlpool.ConnectionPool的行为保持一致:
+    1) 连接数不超过size,连接池耗尽时协程按先来后到排队等待,归还的连接(或已关闭连接的名额)直接交给等待最久的协程
+    2) 等待超过acquire_timeout时抛出GetConnectionFromPoolError
+    3) 超过con_lifetime的连接在借出/归还时关闭并重建,con_lifetime应小于MySQL的wait_timeout
+    4) 游标提供与pymysqlpool.Cursor相同的db_query/db_modify方法,连接池亦提供同名的便捷方法
+注意: 连接池绑定创建连接时所在的事件循环,gunicorn/uvicorn多worker部署时应在每个worker启动后(如FastAPI的lifespan中)创建
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import aiomysql
+import pymysql
+
+from commutils.common.metrics import Histogram
+from commutils.db.pymysqlpool import GetConnectionFromPoolError, ReturnConnectionToPoolError
+from commutils.parser.conf_parser import ConfigAgent
+
+# 发生这些异常后连接仍可复用(与pymysqlpool.Connection一致),其它异常时关闭连接
+REUSABLE_EXCEPTIONS = (pymysql.err.ProgrammingError, pymysql.err.IntegrityError, pymysql.err.NotSupportedError)
+
+# 已获得连接名额但需自行创建连接的标记
+_NEW_CONNECTION = object()
+
+
+class CursorMixin:
+    """ 与pymysqlpool.Cursor相同的便捷方法
+    """
+
+    async def db_query(self, query, args=()):
+        """ 执行查询并返回全部记录(始终为列表,与同步版本保持统一的数据结构)
+        """
+        await self.execute(query, args)
+        return await self.fetchall()
+
+    async def db_modify(self, query, args=(), exec_many=False):
+        """ 执行修改语句
+
+        :param exec_many: 是否使用executemany()批量执行
+        :return: {'rowcount': xxx, 'lastrowid': xxx}
+        """
+        if not exec_many:
+            await self.execute(query, args)
+        else:
+            await self.executemany(query, args)
+        return {'rowcount': self.rowcount, 'lastrowid': self.lastrowid}
+
+
+class Cursor(CursorMixin, aiomysql.Cursor):
+    pass
+
+
+class DictCursor(CursorMixin, aiomysql.DictCursor):
+    """ 以字典形式返回记录的游标
+    """
+
+
+class AsyncConnectionPool:
+    """ asyncio版MySQL连接池类
+
+    用法:
+        pool = AsyncConnectionPool.from_conf('example_db.conf', 'mysql-dev')
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                rows = await cursor.db_query("SELECT ...", (1,))
+        # 或直接使用连接池的便捷方法
+        rows = await pool.db_query("SELECT ...", (1,))
+        await pool.close()
+    """
+
+    def __init__(self, size=10, name=None, pre_create_num=0, con_lifetime=3600, acquire_timeout=3, pre_ping=False,
+                 **kwargs):
+        """
+        :param size: 最大连接数
+        :param name: 连接池名称,默认为host-port-user-database
+        :param pre_create_num: 调用open()时预先创建的连接数
+        :param con_lifetime: 连接的最长存活时间(秒),0或负数表示不限制
+        :param acquire_timeout: 获取连接的默认等待时间(秒)
+        :param pre_ping: 借出连接前是否先ping,会增加一次网络往返,连接可能被服务端断开时开启
+        :param kwargs: 透传给aiomysql.connect的参数,如host/port/user/password/db/autocommit/charset
+        """
+        if 'database' in kwargs:
+            # 兼容pymysql的参数名
+            kwargs['db'] = kwargs.pop('database')
+        kwargs.setdefault('cursorclass', Cursor)
+
+        self.size = size
+        self.name = name if name else '-'.join(
+            [str(kwargs.get('host', 'localhost')), str(kwargs.get('port', 3306)),
+             str(kwargs.get('user', '')), str(kwargs.get('db', ''))])
+        self._pre_create_num = min(pre_create_num, size)
+        self._con_lifetime = con_lifetime
+        self._acquire_timeout = acquire_timeout
+        self._pre_ping = pre_ping
+        self._kwargs = kwargs
+
+        self._idle = deque()  # 空闲连接,归还时放在右侧,借出时从右侧取(最近归还的连接)
+        self._waiters = deque()  # 等待连接的Future,最早的在左侧
+        self._total = 0  # 已创建与正在创建的连接数
+        self._in_use = set()
+        self._closed = False
+
+        self.wait_time = Histogram()
+        self.connect_time = Histogram()
+        self._counters = {'created': 0, 'closed': 0, 'handoffs': 0, 'timeouts': 0}
+
+    @classmethod
+    def from_conf(cls, filename, section, **pool_kwargs):
+        """ 从文件读取连接配置并返回连接池对象(连接在首次使用或调用open()时创建)
+
+        :param filename:
+        :param section:
+        :param pool_kwargs: 连接池参数,如size/con_lifetime/acquire_timeout
+        :return:
+        """
+        config_agent = ConfigAgent()
+        config_agent.read(filename)
+        kwargs = config_agent.get_dict(section)
+        kwargs.update(pool_kwargs)
+
+        return cls(**kwargs)
+
+    async def open(self):
+        """ 预先创建pre_create_num个连接
+        """
+        while self._total < self._pre_create_num:
+            self._total += 1
+            conn = await self._create_connection()
+            self._idle.append(conn)
+        return self
+
+    async def close(self):
+        """ 关闭空闲连接,使用中的连接在归还时关闭;仍在等待的协程将收到GetConnectionFromPoolError
+        """
+        self._closed = True
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(GetConnectionFromPoolError("pool({}) has been closed".format(self.name)))
+        while self._idle:
+            await self._close_connection(self._idle.pop())
+
+    async def get_connection(self, timeout=None):
+        """ 获取连接,用完后需调用release()归还;推荐使用acquire()
+
+        :param timeout: 连接池耗尽时的等待时间(秒),None表示使用acquire_timeout,0表示不等待
+        :return:
+        """
+        if self._closed:
+            raise GetConnectionFromPoolError("pool({}) has been closed".format(self.name))
+        timeout = self._acquire_timeout if timeout is None else timeout
+
+        start_time = time.perf_counter()
+        if self._idle:
+            conn = self._idle.pop()
+        elif self._total < self.size:
+            self._total += 1
+            conn = _NEW_CONNECTION
+        else:
+            conn = await self._wait(timeout)
+        self.wait_time.observe(time.perf_counter() - start_time)
+
+        if conn is not _NEW_CONNECTION:
+            if conn.closed or (self._con_lifetime > 0 and time.time() - conn._create_ts >= self._con_lifetime):
+                # 名额由新连接继续使用
+                await self._close_connection(conn, release_slot=False)
+                conn = _NEW_CONNECTION
+            elif self._pre_ping:
+                try:
+                    await conn.ping(reconnect=False)
+                except Exception:
+                    await self._close_connection(conn, release_slot=False)
+                    conn = _NEW_CONNECTION
+
+        if conn is _NEW_CONNECTION:
+            conn = await self._create_connection()
+        self._in_use.add(conn)
+        return conn
+
+    async def _wait(self, timeout):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # 连接已交给本协程但本协程被取消/超时: 转交给下一个等待者,避免连接泄漏
+                self._hand_over(waiter.result())
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._counters['timeouts'] += 1
+            raise GetConnectionFromPoolError(
+                "can't get connection from pool({}) within {} seconds, due to pool lack.".format(self.name, timeout))
+
+    async def release(self, conn, discard=False):
+        """ 归还连接
+
+        :param conn:
+        :param discard: 是否关闭该连接(如连接状态未知时)
+        :return:
+        """
+        if conn not in self._in_use:
+            raise ReturnConnectionToPoolError("this connection has already returned to the pool({})".format(self.name))
+        self._in_use.discard(conn)
+
+        if discard or self._closed or conn.closed or \
+                (self._con_lifetime > 0 and time.time() - conn._create_ts >= self._con_lifetime):
+            await self._close_connection(conn)
+        else:
+            self._hand_over(conn)
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        """ 借出连接的上下文管理器,退出时归还连接
+
+        发生可复用异常且未开启autocommit时先回滚,其它异常时关闭连接
+        """
+        conn = await self.get_connection(timeout)
+        try:
+            yield conn
+        except REUSABLE_EXCEPTIONS:
+            discard = False
+            if not conn.get_autocommit():
+                try:
+                    await conn.rollback()
+                except Exception:
+                    discard = True
+            await self.release(conn, discard)
+            raise
+        except BaseException:
+            await self.release(conn, discard=True)
+            raise
+        else:
+            await self.release(conn)
+
+    async def db_query(self, query, args=(), cursor_class=None):
+        """ 借出连接执行查询并返回全部记录
+
+        :param cursor_class: 游标类型,如DictCursor,默认使用连接配置的cursorclass
+        """
+        async with self.acquire() as conn:
+            async with conn.cursor(*((cursor_class,) if cursor_class else ())) as cursor:
+                return await cursor.db_query(query, args)
+
+    async def db_modify(self, query, args=(), exec_many=False):
+        """ 借出连接执行修改语句,未开启autocommit时自动提交
+
+        :return: {'rowcount': xxx, 'lastrowid': xxx}
+        """
+        async with self.acquire() as conn:
+            async with conn.cursor(Cursor) as cursor:
+                result = await cursor.db_modify(query, args, exec_many)
+            if not conn.get_autocommit():
+                await conn.commit()
+            return result
+
+    def _hand_over(self, conn_or_slot):
+        """ 将空闲连接(或连接名额)交给等待最久的协程,无等待者时放回连接池(或释放名额)
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(conn_or_slot)
+                self._counters['handoffs'] += 1
+                return
+        if conn_or_slot is _NEW_CONNECTION:
+            self._total -= 1
+        else:
+            self._idle.append(conn_or_slot)
+
+    async def _create_connection(self):
+        """ 为已占用的名额创建连接
+        """
+        start_time = time.perf_counter()
+        try:
+            conn = await aiomysql.connect(**self._kwargs)
+        except BaseException:
+            self._hand_over(_NEW_CONNECTION)
+            raise
+        self.connect_time.observe(time.perf_counter() - start_time)
+        conn._create_ts = time.time()
+        self._counters['created'] += 1
+        return conn
+
+    async def _close_connection(self, conn, release_slot=True):
+        try:
+            await conn.ensure_closed()
+        except Exception:
+            conn.close()
+        self._counters['closed'] += 1
+        if release_slot:
+            self._hand_over(_NEW_CONNECTION)
+
+    @property
+    def available_num(self):
+        """ 空闲连接数
+        """
+        return len(self._idle)
+
+    @property
+    def total_num(self):
+        """ 连接总数(使用中与空闲)
+        """
+        return self._total
+
+    @property
+    def stats(self):
+        """ 连接池的计数与等待/建连耗时(秒)统计
+        """
+        stats = dict(self._counters, total=self._total, available=len(self._idle), in_use=len(self._in_use),
+                     waiting=sum(1 for waiter in self._waiters if not waiter.done()))
+        stats['wait_time'] = self.wait_time.snapshot()
+        stats['connect_time'] = self.connect_time.snapshot()
+        return stats
+
+
+if __name__ == '__main__':
+    # 需要本地MySQL/MariaDB实例,连接配置见example_db.conf
+    async def main():
+        pool = await AsyncConnectionPool.from_conf('example_db.conf', 'mysql-dev', size=4, autocommit=True).open()
+        try:
+            print(await pool.db_query("SELECT VERSION()"))
+            await pool.db_modify("CREATE TABLE IF NOT EXISTS testdb.aiomysql_demo (id INT PRIMARY KEY, name VARCHAR(32))")
+            print(await pool.db_modify("REPLACE INTO testdb.aiomysql_demo (id, name) VALUES (%s, %s)",
+                                       [(1, 'n1'), (2, 'n2')], exec_many=True))
+            print(await pool.db_query("SELECT * FROM testdb.aiomysql_demo", cursor_class=DictCursor))
+
+            # 并发数超过连接池大小时排队等待
+            results = await asyncio.gather(*[pool.db_query("SELECT SLEEP(0.1), %s", (i,)) for i in range(12)])
+            print(len(results), pool.stats)
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+""" 批量写入工具: 多行INSERT/UPSERT语句构造、按行数与语句大小分块,以及LOAD DATA LOCAL INFILE/COPY的数据格式化
+
+供DBUtilsPool.bulk_insert/bulk_upsert/bulk_load使用,也可用于其它DB API 2.0连接:
+    chunks = iter_chunks(rows, chunk_rows=1000, max_bytes=DEFAULT_MAX_BYTES)
+    sql = build_insert('testdb.demo', ['id', 'name'], len(chunk), 'mysql', '%s', update_columns=['name'])
+    cursor.execute(sql, flatten(chunk))
+"""
+
+# 驱动模块名 -> SQL方言
+DIALECTS = {
+    'pymysql': 'mysql',
+    'MySQLdb': 'mysql',
+    'psycopg2': 'postgresql',
+    'sqlite3': 'sqlite',
+}
+
+# 单条语句的参数个数上限(SQLite 3.32之前默认为999),未列出的方言由驱动在客户端插值,不限制
+MAX_PARAMS = {'sqlite': 999}
+
+# 默认单条语句大小上限(字节): 略低于MySQL 5.7默认的max_allowed_packet(4MB)
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 - 64 * 1024
+
+_QUOTES = {'mysql': '`', 'postgresql': '"', 'sqlite': '"'}
+
+# LOAD DATA与COPY文本格式中需要转义的字符
+_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def get_dialect(driver_name):
+    """ 由驱动模块名获取SQL方言,未知驱动返回None
+    """
+    return DIALECTS.get(driver_name)
+
+
+def get_placeholder(paramstyle):
+    """ 由驱动的paramstyle获取位置参数占位符
+    """
+    if paramstyle in ('format', 'pyformat'):
+        return '%s'
+    if paramstyle == 'qmark':
+        return '?'
+    raise ValueError(f"不支持的paramstyle: {paramstyle}")
+
+
+def quote_identifier(name, dialect):
+    """ 为表名/列名加引号,"库.表"形式的名称逐段处理
+    """
+    quote = _QUOTES.get(dialect)
+    if quote is None:
+        return name
+    return '.'.join(quote + part.replace(quote, quote * 2) + quote for part in name.split('.'))
+
+
+def estimate_size(row):
+    """ 估算一行数据插值到SQL语句后的字节数(偏大)
+    """
+    size = 2
+    for value in row:
+        if isinstance(value, str):
+            size += len(value.encode('utf-8')) + 4
+        elif isinstance(value, (bytes, bytearray)):
+            size += len(value) * 2 + 4
+        else:
+            size += 24
+    return size
+
+
+def iter_chunks(rows, chunk_rows=1000, max_bytes=DEFAULT_MAX_BYTES, max_params=None):
+    """ 将行数据切分为块,每块不超过chunk_rows行、估算大小不超过max_bytes字节、参数个数不超过max_params
+
+    惰性读取rows,可传入生成器以流式写入
+    :param rows: 行数据(序列)的可迭代对象
+    :param chunk_rows: 每块最多行数
+    :param max_bytes: 每块最大字节数,None表示不限制
+    :param max_params: 每块最多参数个数,None表示不限制
+    :return: 行列表的生成器
+    """
+    chunk, size = [], 0
+    limit = chunk_rows
+    for row in rows:
+        if max_params and not chunk:
+            limit = max(min(chunk_rows, max_params // max(len(row), 1)), 1)
+        row_size = estimate_size(row) if max_bytes else 0
+        if chunk and (len(chunk) >= limit or (max_bytes and size + row_size > max_bytes)):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+def as_sequences(rows, columns):
+    """ 将字典形式的行按columns的顺序转换为元组,其它行原样返回
+    """
+    for row in rows:
+        yield tuple(row[column] for column in columns) if isinstance(row, dict) else row
+
+
+def flatten(chunk):
+    return [value for row in chunk for value in row]
+
+
+def build_insert(table, columns, nrows, dialect, placeholder='%s', update_columns=None, conflict_columns=None):
+    """ 构造多行INSERT语句,指定update_columns或conflict_columns时构造UPSERT语句
+
+    MySQL: INSERT ... VALUES (...),(...) ON DUPLICATE KEY UPDATE c = VALUES(c)
+    PostgreSQL/SQLite: INSERT ... VALUES (...),(...) ON CONFLICT (k) DO UPDATE SET c = EXCLUDED.c
+    :param table: 表名
+    :param columns: 列名
+    :param nrows: 行数
+    :param dialect: SQL方言
+    :param placeholder: 参数占位符
+    :param update_columns: 冲突时更新的列,None表示除conflict_columns外的所有列,空列表表示忽略冲突的行
+    :param conflict_columns: 判断冲突的列(主键或唯一索引),PostgreSQL/SQLite的UPSERT必须指定
+    :return:
+    """
+    row = '(' + ', '.join([placeholder] * len(columns)) + ')'
+    sql = (f"INSERT INTO {quote_identifier(table, dialect)} "
+           f"({', '.join(quote_identifier(column, dialect) for column in columns)}) VALUES " +
+           ', '.join([row] * nrows))
+
+    if update_columns is None and conflict_columns is None:
+        return sql
+    if update_columns is None:
+        update_columns = [column for column in columns if column not in conflict_columns]
+
+    if dialect == 'mysql':
+        if not update_columns:
+            # 无需更新时以列自身赋值(不改变任何值)实现忽略冲突,与INSERT IGNORE不同,不会忽略其它错误
+            column = quote_identifier(columns[0], dialect)
+            return sql + f" ON DUPLICATE KEY UPDATE {column} = {column}"
+        return sql + ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+            f"{quote_identifier(column, dialect)} = VALUES({quote_identifier(column, dialect)})"
+            for column in update_columns)
+
+    if dialect in ('postgresql', 'sqlite'):
+        assert conflict_columns, f"{dialect}的UPSERT需指定conflict_columns"
+        target = ', '.join(quote_identifier(column, dialect) for column in conflict_columns)
+        if not update_columns:
+            return sql + f" ON CONFLICT ({target}) DO NOTHING"
+        return sql + f" ON CONFLICT ({target}) DO UPDATE SET " + ', '.join(
+            f"{quote_identifier(column, dialect)} = EXCLUDED.{quote_identifier(column, dialect)}"
+            for column in update_columns)
+
+    raise NotImplementedError(f"不支持{dialect}的UPSERT")
+
+
+def build_load_data(table, columns, on_duplicate=None):
+    """ 构造MySQL的LOAD DATA LOCAL INFILE语句,文件路径为唯一的参数
+
+    数据格式见format_text_rows;需在连接参数中开启local_infile
+    :param on_duplicate: 主键冲突时的处理: None(报错), 'replace'或'ignore'
+    :return:
+    """
+    assert on_duplicate in (None, 'replace', 'ignore'), f"不支持的on_duplicate: {on_duplicate}"
+    modifier = f" {on_duplicate.upper()}" if on_duplicate else ''
+    return (f"LOAD DATA LOCAL INFILE %s{modifier} INTO TABLE {quote_identifier(table, 'mysql')} "
+            "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({', '.join(quote_identifier(column, 'mysql') for column in columns)})")
+
+
+def build_copy(table, columns):
+    """ 构造PostgreSQL的COPY ... FROM STDIN语句(text格式)
+    """
+    return (f"COPY {quote_identifier(table, 'postgresql')} "
+            f"({', '.join(quote_identifier(column, 'postgresql') for column in columns)}) FROM STDIN")
+
+
+def _text_value(value, dialect):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return ('t' if value else 'f') if dialect == 'postgresql' else ('1' if value else '0')
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        if dialect == 'postgresql':
+            # bytea的十六进制格式,反斜杠本身需转义
+            return '\\\\x' + bytes(value).hex()
+        # 以surrogateescape保留任意字节,编码时还原
+        return bytes(value).decode('utf-8', 'surrogateescape').translate(_TEXT_ESCAPES)
+    return str(value).translate(_TEXT_ESCAPES)
+
+
+def format_text_rows(rows, dialect):
+    """ 将行数据格式化为MySQL LOAD DATA/PostgreSQL COPY的文本格式: 制表符分隔、换行结尾、NULL为\\N、反斜杠转义
+
+    :return: UTF-8编码的bytes
+    """
+    lines = ['\t'.join([_text_value(value, dialect) for value in row]) for row in rows]
+    lines.append('')
+    return '\n'.join(lines).encode('utf-8', 'surrogateescape')
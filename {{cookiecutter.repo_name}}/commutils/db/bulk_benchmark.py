@@ -0,0 +1,149 @@
+""" 批量写入性能基准测试: 对比executemany(query_batch)、多行INSERT(不同块大小/并行度)、UPSERT与LOAD DATA/COPY的写入速度
+
+直接运行的脚本,使用绝对路径导入(需在工程根目录下执行):
+    python -m commutils.db.bulk_benchmark                                  # 使用临时SQLite数据库
+    python -m commutils.db.bulk_benchmark --driver pymysql --conf commutils/db/example_db.conf --section mysql-dev \
+        --table testdb.bulk_bench
+结果以JSON输出,每项为rows_per_sec(行/秒)与耗时;测试表会被清空后重复使用,请勿指定业务表
+注意:
+    1) MySQL的LOAD DATA需要服务端开启local_infile,且连接配置中设置local_infile = True
+    2) SQLite同一时刻只允许一个写入者,不测试并行写入;且为进程内数据库,没有网络往返,多行INSERT相对executemany没有优势
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from commutils.db.dbapi_conn import DBUtilsPool
+from commutils.db import bulk
+from commutils.parser.conf_parser import ConfigAgent
+
+COLUMNS = ['id', 'name', 'score', 'created', 'flag', 'payload']
+
+_DDL = {
+    'mysql': "CREATE TABLE IF NOT EXISTS {table} (id BIGINT PRIMARY KEY, name VARCHAR(64), score DOUBLE, "
+             "created DATETIME, flag TINYINT, payload VARCHAR(255))",
+    'postgresql': "CREATE TABLE IF NOT EXISTS {table} (id BIGINT PRIMARY KEY, name VARCHAR(64), "
+                  "score DOUBLE PRECISION, created TIMESTAMP, flag BOOLEAN, payload VARCHAR(255))",
+    'sqlite': "CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, name TEXT, score REAL, "
+              "created TEXT, flag INTEGER, payload TEXT)",
+}
+
+
+def make_rows(n, start=0):
+    """ 生成测试数据(生成器,不预先占用内存)
+    """
+    base = datetime.datetime(2024, 1, 1)
+    for i in range(start, start + n):
+        yield (i, f"name-{i}", i * 0.5, base + datetime.timedelta(seconds=i), i % 2 == 0, 'p' * (i % 64))
+
+
+def timed(label, rows, func, reset):
+    reset()
+    start_time = time.perf_counter()
+    affected = func()
+    elapsed = time.perf_counter() - start_time
+    print(f"{label}: {elapsed:.2f}s", file=sys.stderr)
+    # 部分驱动的executemany返回游标而非行数
+    return {'rows_per_sec': round(rows / elapsed), 'seconds': round(elapsed, 3),
+            'affected': affected if isinstance(affected, int) else None}
+
+
+def run_suite(pool, table, rows, chunk_sizes, worker_counts):
+    dialect = bulk.get_dialect(pool.driver.__name__)
+    quoted = bulk.quote_identifier(table, dialect)
+    placeholder = bulk.get_placeholder(pool.driver.paramstyle)
+
+    with pool.get_cursor() as (conn, cursor):
+        cursor.execute(_DDL.get(dialect, _DDL['sqlite']).format(table=quoted))
+        conn.commit()
+
+    def reset():
+        with pool.get_cursor() as (conn, cursor):
+            cursor.execute(f"DELETE FROM {quoted}" if dialect == 'sqlite' else f"TRUNCATE TABLE {quoted}")
+            conn.commit()
+
+    insert_sql = f"INSERT INTO {quoted} ({', '.join(COLUMNS)}) VALUES ({', '.join([placeholder] * len(COLUMNS))})"
+    results = {
+        'query_batch(executemany)': timed('executemany', rows, lambda: pool.query_batch(insert_sql, list(make_rows(rows))),
+                                          reset),
+    }
+    for chunk_rows in chunk_sizes:
+        results[f'bulk_insert(chunk_rows={chunk_rows})'] = timed(
+            f'bulk_insert chunk_rows={chunk_rows}', rows,
+            lambda: pool.bulk_insert(table, COLUMNS, make_rows(rows), chunk_rows=chunk_rows), reset)
+    if dialect != 'sqlite':
+        for workers in worker_counts:
+            results[f'bulk_insert(workers={workers})'] = timed(
+                f'bulk_insert workers={workers}', rows,
+                lambda: pool.bulk_insert(table, COLUMNS, make_rows(rows), chunk_rows=chunk_sizes[-1], workers=workers),
+                reset)
+
+    # UPSERT: 先写入一半数据,再写入全部数据,一半为更新
+    def upsert():
+        pool.bulk_insert(table, COLUMNS, make_rows(rows // 2), chunk_rows=chunk_sizes[-1])
+        return pool.bulk_upsert(table, COLUMNS, make_rows(rows), conflict_columns=['id'], chunk_rows=chunk_sizes[-1])
+    results['bulk_upsert(50% updates)'] = timed('bulk_upsert', rows, upsert, reset)
+
+    if dialect in ('mysql', 'postgresql'):
+        results['bulk_load'] = timed('bulk_load', rows, lambda: pool.bulk_load(table, COLUMNS, make_rows(rows)), reset)
+
+    reset()
+    return {
+        'meta': {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'driver': pool.driver.__name__,
+            'rows': rows,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量写入基准测试")
+    parser.add_argument('--driver', default='sqlite3', help="DB API 2.0驱动模块名,如pymysql/psycopg2/sqlite3")
+    parser.add_argument('--conf', help="数据库配置文件,未指定时使用临时SQLite数据库")
+    parser.add_argument('--section', default='mysql-dev')
+    parser.add_argument('--table', default='bulk_bench', help="测试表名,会被清空")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-rows', default='100,1000,5000', help="块大小,逗号分隔")
+    parser.add_argument('--workers', default='2,4', help="并行写入的线程数,逗号分隔")
+    parser.add_argument('--output', help="结果输出文件,默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    tmp_dir = None
+    if args.conf:
+        config_agent = ConfigAgent()
+        config_agent.read(args.conf)
+        pool = DBUtilsPool(args.driver, **config_agent.get_dict(args.section))
+    else:
+        assert args.driver == 'sqlite3', "未指定--conf时仅支持sqlite3"
+        tmp_dir = tempfile.mkdtemp(prefix='bulk-bench-')
+        pool = DBUtilsPool('sqlite3', database=os.path.join(tmp_dir, 'bench.db'), check_same_thread=False)
+
+    try:
+        result = run_suite(pool, args.table, args.rows, [int(n) for n in args.chunk_rows.split(',')],
+                           [int(n) for n in args.workers.split(',')])
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+""" 按列读取查询结果: 将流式查询的每批记录直接转换为带类型的NumPy数组或Arrow数组,供分析类查询使用
+
+供DBUtilsPool.fetch_columns/iter_columns使用,需安装numpy或pyarrow(按backend按需导入):
+    columns = pool.fetch_columns("SELECT dt, uv, amount FROM dws.daily_uv", backend='numpy')  # 列名 -> ndarray
+    table = pool.fetch_columns("SELECT ...", backend='arrow')  # pyarrow.Table, 可零拷贝转换为pandas/polars
+列的类型由cursor.description的type_code推断(pymysql/MySQLdb为FIELD_TYPE,psycopg2为类型OID),
+无法识别的类型(如sqlite3)按该列第一个非空值推断:
+    整数       int16/int32/int64,含NULL时NumPy中提升为float64(NULL为NaN),Arrow中保留整数类型与空值
+    浮点数     float32/float64
+    DECIMAL    decimal_mode='float'时为float64,'object'时NumPy中为Decimal对象,Arrow中为decimal128
+    日期时间   datetime64[us]/datetime64[D]/timedelta64[us](NULL为NaT),带时区的时间转换为UTC
+    字符串等   NumPy中为object数组,Arrow中为string/binary
+与get_many相比只有一批记录(batch_size行)以元组形式存在,其余数据均以紧凑的列数组保存
+"""
+
+import datetime
+import decimal
+import math
+
+BACKENDS = ('numpy', 'arrow')
+
+# pymysql.constants.FIELD_TYPE -> 列类型,BLOB类(含TEXT)按值推断
+MYSQL_TYPES = {
+    0: 'decimal', 246: 'decimal',
+    1: 'int16', 2: 'int32', 9: 'int32', 13: 'int16', 3: 'int64', 8: 'int64',  # 无符号整数使用更宽的类型
+    4: 'float32', 5: 'float64',
+    7: 'datetime', 12: 'datetime', 10: 'date', 14: 'date', 11: 'time',
+    15: 'str', 247: 'str', 248: 'str', 253: 'str', 254: 'str',
+    16: 'bytes', 255: 'bytes',
+}
+
+# PostgreSQL类型OID -> 列类型
+POSTGRESQL_TYPES = {
+    16: 'bool', 21: 'int16', 23: 'int32', 20: 'int64', 26: 'int64',
+    700: 'float32', 701: 'float64', 1700: 'decimal',
+    1114: 'datetime', 1184: 'datetime', 1082: 'date', 1083: 'time',
+    18: 'str', 19: 'str', 25: 'str', 1042: 'str', 1043: 'str',
+    17: 'bytes',
+}
+
+_TYPE_MAPS = {
+    'pymysql': MYSQL_TYPES,
+    'MySQLdb': MYSQL_TYPES,
+    'psycopg2': POSTGRESQL_TYPES,
+}
+
+_INT_KINDS = ('int16', 'int32', 'int64')
+_FLOAT_KINDS = ('float32', 'float64')
+_NUMPY_TEMPORAL = {'datetime': 'datetime64[us]', 'date': 'datetime64[D]', 'time': 'timedelta64[us]'}
+
+
+def infer_kinds(description, driver_name):
+    """ 由cursor.description推断各列的类型,无法识别的列为None(由值推断)
+
+    :param description: cursor.description
+    :param driver_name: 驱动模块名
+    :return: [(列名, 类型)]
+    """
+    type_map = _TYPE_MAPS.get(driver_name, {})
+    return [(column[0], type_map.get(column[1]) if isinstance(column[1], int) else None) for column in description]
+
+
+def kind_of(value):
+    """ 由Python值推断列类型
+    """
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int64'
+    if isinstance(value, float):
+        return 'float64'
+    if isinstance(value, decimal.Decimal):
+        return 'decimal'
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    if isinstance(value, datetime.date):
+        return 'date'
+    if isinstance(value, (datetime.timedelta, datetime.time)):
+        return 'time'
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return 'bytes'
+    return 'object'
+
+
+def _normalize_temporal(kind, values):
+    """ 带时区的时间转换为UTC,datetime.time(psycopg2的TIME)转换为timedelta
+    """
+    sample = next((value for value in values if value is not None), None)
+    if kind == 'datetime' and getattr(sample, 'tzinfo', None) is not None:
+        return [None if value is None else value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                for value in values]
+    if kind == 'time' and isinstance(sample, datetime.time):
+        return [None if value is None else datetime.timedelta(hours=value.hour, minutes=value.minute,
+                                                              seconds=value.second, microseconds=value.microsecond)
+                for value in values]
+    return values
+
+
+class _NumpyColumn:
+    """ 一列的NumPy数组块,类型不能容纳新的值(如整数列出现NULL)时提升已有的块
+    """
+
+    def __init__(self, np, kind, decimal_mode):
+        self._np = np
+        self.kind = kind
+        self._decimal_mode = decimal_mode
+        self.chunks = []
+
+    def dtype(self):
+        if self.kind in _INT_KINDS or self.kind in _FLOAT_KINDS or self.kind == 'bool':
+            return self.kind
+        if self.kind == 'decimal' and self._decimal_mode == 'float':
+            return 'float64'
+        return _NUMPY_TEMPORAL.get(self.kind, object)
+
+    def convert(self, values):
+        """ 将一批值转换为数组,必要时提升本列的类型
+        """
+        if self.kind is None:
+            sample = next((value for value in values if value is not None), None)
+            if sample is None:
+                # 该批全部为NULL,暂不确定类型
+                return self._objects(values)
+            self.kind = kind_of(sample)
+            if self.chunks and self.kind in _INT_KINDS:
+                self.kind = 'float64'
+            elif self.chunks and self.kind == 'bool':
+                self.kind = 'object'
+            self.chunks = [self._coerce(chunk, self.dtype()) for chunk in self.chunks]
+        try:
+            return self._convert(values)
+        except (TypeError, ValueError, OverflowError, decimal.InvalidOperation):
+            self._promote(values)
+            return self._convert(values)
+
+    def append(self, values):
+        # convert()可能替换self.chunks(提升已有的块),需先转换再追加
+        chunk = self.convert(values)
+        self.chunks.append(chunk)
+
+    def finish(self):
+        np = self._np
+        if not self.chunks:
+            return np.empty(0, dtype=self.dtype() if self.kind else object)
+        return self.chunks[0] if len(self.chunks) == 1 else np.concatenate(self.chunks)
+
+    def _convert(self, values):
+        np = self._np
+        dtype = self.dtype()
+        if dtype is object:
+            return self._objects(values)
+        if self.kind in _NUMPY_TEMPORAL:
+            return np.array(_normalize_temporal(self.kind, values), dtype=dtype)
+        if None in values:
+            if dtype not in _FLOAT_KINDS:
+                raise TypeError('NULL in non-float column')
+            values = [math.nan if value is None else value for value in values]
+        return np.fromiter(values, dtype=dtype, count=len(values))
+
+    def _promote(self, values):
+        # 整数列出现NULL时提升为float64,其它情况退回object
+        if self.kind in _INT_KINDS and None in values and not any(
+                isinstance(value, int) and not -2 ** 53 <= value <= 2 ** 53 for value in values):
+            self.kind = 'float64'
+        else:
+            self.kind = 'object'
+        self.chunks = [self._coerce(chunk, self.dtype()) for chunk in self.chunks]
+
+    def _coerce(self, chunk, dtype):
+        if dtype is not object and chunk.dtype == object:
+            # 此前全部为NULL的块
+            return self._convert(list(chunk))
+        return chunk.astype(dtype)
+
+    def _objects(self, values):
+        array = self._np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+
+class _ArrowColumn:
+    """ 一列的Arrow数组块,类型确定后(包括退回uint64/字符串)保持不变,只向能容纳所有块的类型扩大
+    """
+
+    def __init__(self, pa, kind, decimal_mode, precision=None, scale=None):
+        self._pa = pa
+        self.kind = kind
+        self._decimal_mode = decimal_mode
+        self._precision = precision
+        self._scale = scale
+        self.chunks = []
+        self.type = None
+
+    def arrow_type(self):
+        pa = self._pa
+        if self.kind in _INT_KINDS or self.kind in _FLOAT_KINDS or self.kind == 'bool':
+            return getattr(pa, self.kind)()
+        if self.kind == 'decimal':
+            if self._decimal_mode == 'float':
+                return pa.float64()
+            if isinstance(self._precision, int) and isinstance(self._scale, int) and 0 < self._precision <= 38:
+                return pa.decimal128(self._precision, self._scale)
+            return None
+        if self.kind == 'datetime':
+            return pa.timestamp('us')
+        if self.kind == 'date':
+            return pa.date32()
+        if self.kind == 'time':
+            return pa.duration('us')
+        if self.kind == 'str':
+            return pa.string()
+        if self.kind == 'bytes':
+            return pa.binary()
+        return None
+
+    def convert(self, values):
+        pa = self._pa
+        if self.kind in ('datetime', 'time'):
+            values = _normalize_temporal(self.kind, values)
+        elif self.kind == 'decimal' and self._decimal_mode == 'float':
+            values = [None if value is None else float(value) for value in values]
+        if self.type is not None and not pa.types.is_null(self.type):
+            # 已确定(或已退回/扩大)的类型保持不变,后续块优先按该类型转换
+            try:
+                if pa.types.is_string(self.type):
+                    return pa.array([None if value is None else str(value) for value in values], type=self.type)
+                return pa.array(values, type=self.type, from_pandas=False)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError, TypeError):
+                pass
+        try:
+            array = pa.array(values, type=self.arrow_type(), from_pandas=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError, TypeError):
+            array = self._fallback(values)
+        if self.type is None or pa.types.is_null(self.type):
+            # 此前的块全部为NULL
+            self.chunks = [chunk.cast(array.type) for chunk in self.chunks]
+            self.type = array.type
+        elif pa.types.is_null(array.type):
+            array = array.cast(self.type)
+        else:
+            array = self._widen(array)
+        return array
+
+    def _widen(self, array):
+        """ 新块不能按已有的类型转换: 已有的块能无损转换为新块的类型(如int64 -> uint64)时转换,否则全部转换为字符串
+        """
+        pa = self._pa
+        try:
+            chunks = [chunk.cast(array.type) for chunk in self.chunks]
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            chunks = None
+        if chunks is None or pa.types.is_string(array.type):
+            chunks = [self._strings(chunk) for chunk in self.chunks]
+            array = self._strings(array)
+        self.chunks = chunks
+        self.type = array.type
+        return array
+
+    def _strings(self, chunk):
+        # 与_fallback一致,按Python值的str()转换
+        if self._pa.types.is_string(chunk.type):
+            return chunk
+        return self._pa.array([None if value is None else str(value) for value in chunk.to_pylist()],
+                              type=self._pa.string())
+
+    def append(self, values):
+        # convert()可能替换self.chunks(提升已有的块),需先转换再追加
+        chunk = self.convert(values)
+        self.chunks.append(chunk)
+
+    def _fallback(self, values):
+        """ 值与声明的类型不符时: 整数尝试uint64(如BIGINT UNSIGNED),其次由值推断,仍失败时转换为字符串
+        """
+        pa = self._pa
+        candidates = [pa.uint64()] if self.kind in _INT_KINDS else []
+        for arrow_type in candidates + [None]:
+            try:
+                return pa.array(values, type=arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError, TypeError):
+                pass
+        # 如MySQL的零日期('0000-00-00')以字符串返回,与datetime混在同一列
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+    def finish(self):
+        return self._pa.chunked_array(self.chunks, type=self.type or self.arrow_type() or self._pa.null())
+
+
+class ColumnarBuilder:
+    """ 将多批记录累积为列数组(fetch_columns),或逐批转换(iter_columns)
+    """
+
+    def __init__(self, description, driver_name, backend='numpy', decimal_mode='float'):
+        """
+        :param description: cursor.description
+        :param driver_name: 驱动模块名,用于解析type_code
+        :param backend: 'numpy'或'arrow'
+        :param decimal_mode: DECIMAL列的类型: 'float'(float64)或'object'(NumPy中为Decimal对象,Arrow中为decimal128)
+        """
+        assert backend in BACKENDS, f"不支持的backend: {backend}"
+        assert decimal_mode in ('float', 'object'), f"不支持的decimal_mode: {decimal_mode}"
+        self.backend = backend
+        kinds = infer_kinds(description or (), driver_name)
+        self.names = [name for name, _ in kinds]
+        if backend == 'numpy':
+            import numpy
+
+            self._lib = numpy
+            self.columns = [_NumpyColumn(numpy, kind, decimal_mode) for _, kind in kinds]
+        else:
+            import pyarrow
+
+            self._lib = pyarrow
+            self.columns = [_ArrowColumn(pyarrow, kind, decimal_mode, column[4], column[5])
+                            for (_, kind), column in zip(kinds, description or ())]
+
+    def _transpose(self, rows):
+        if not rows:
+            return [() for _ in self.columns]
+        if isinstance(rows[0], dict):
+            return [tuple(row[name] for row in rows) for name in self.names]
+        return list(zip(*rows))
+
+    def append(self, rows):
+        """ 累积一批记录,finish()时合并
+        """
+        for column, values in zip(self.columns, self._transpose(rows)):
+            column.append(values)
+
+    def convert(self, rows):
+        """ 将一批记录转换为列数组(不累积),NumPy时为{列名: ndarray},Arrow时为RecordBatch
+        """
+        arrays = [column.convert(values) for column, values in zip(self.columns, self._transpose(rows))]
+        if self.backend == 'numpy':
+            return dict(zip(self.names, arrays))
+        return self._lib.RecordBatch.from_arrays(arrays, names=self.names)
+
+    def finish(self):
+        """ NumPy时返回{列名: ndarray},Arrow时返回Table
+        """
+        if self.backend == 'numpy':
+            return {name: column.finish() for name, column in zip(self.names, self.columns)}
+        return self._lib.table([column.finish() for column in self.columns], names=self.names)
@@ -11,13 +11,31 @@
 """
 
 import importlib
+import io
+import os
+import tempfile
+import uuid
+import warnings
 from abc import abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 
 from DBUtils.PooledDB import PooledDB
+from commutils.db import bulk, columnar
+from commutils.db.prepared import PreparedStatements
+from commutils.db.query_cache import QueryCache
 from commutils.parser.conf_parser import ConfigAgent
 
 
+def _execute(cursor, query, args):
+    """ 无参数时不传入args: sqlite3不接受None,而以()代替时psycopg2会对SQL中的%做格式化
+    """
+    if args is None:
+        cursor.execute(query)
+    else:
+        cursor.execute(query, args)
+
+
 class DBAPI2PoolBase:
     """ 符合DB API 2.0规范的连接池基类
 
@@ -28,12 +46,14 @@ class DBAPI2PoolBase:
         self.driver = importlib.import_module(db_module_str)  # creator in PooledDB constructor
 
     @classmethod
-    def from_conf(cls, db_module_str, filename, section):
+    def from_conf(cls, db_module_str, filename, section, **pool_kwargs):
+        """ 由配置文件创建,pool_kwargs为配置文件之外的连接池参数,如query_cache/prepare_cache_size
+        """
         config_agent = ConfigAgent()
         config_agent.read(filename)
         kwargs = config_agent.get_dict(section)
 
-        return cls(db_module_str, **kwargs)
+        return cls(db_module_str, **dict(kwargs, **pool_kwargs))
 
     @staticmethod
     def from_params(db_module_str, *args, **kwargs):
@@ -49,11 +69,21 @@ class DBUtilsPool(DBAPI2PoolBase):
     """ 封装了DBUtils的连接池类
 
     连接的autocommit属性由用户配置决定,
+    prepare_cache_size大于0时get_one/get_many使用服务端预处理语句,每个连接最多缓存prepare_cache_size条(见prepared模块),
+    传入query_cache时get_one/get_many可通过cache_ttl缓存查询结果,写操作后按表失效(见query_cache模块)
     """
 
-    def __init__(self, db_module_str, *args, **kwargs):
+    def __init__(self, db_module_str, *args, prepare_cache_size=0, query_cache: QueryCache = None, **kwargs):
         super().__init__(db_module_str, *args, **kwargs)
         self._conn_pool: PooledDB = None
+        self._query_cache = query_cache
+        self._prepared = None
+        if prepare_cache_size:
+            self._prepared = PreparedStatements(db_module_str, prepare_cache_size)
+            if not self._prepared.enabled:
+                warnings.warn(f"{db_module_str} does not support server-side prepared statements, "
+                              f"prepare_cache_size is ignored")
+                self._prepared = None
         self._connect(args, kwargs)
 
     def _connect(self, args, kwargs):
@@ -74,7 +104,33 @@ class DBUtilsPool(DBAPI2PoolBase):
         finally:
             conn.close()
 
-    def get_one(self, query, args):
+    @contextmanager
+    def _query_cursor(self, query, args):
+        """ 执行查询并返回可读取结果的游标,开启预处理语句缓存时经由缓存执行
+        """
+        with self.get_cursor() as (conn, cursor):
+            if self._prepared is None:
+                _execute(cursor, query, args)
+                yield cursor
+                return
+
+            cursor = self._prepared.execute(conn, cursor, query, args)
+            try:
+                yield cursor
+            finally:
+                self._prepared.finish(cursor)
+
+    @property
+    def prepared_stats(self):
+        """ 预处理语句缓存的命中/未命中/淘汰/重新预处理次数,未开启时为None
+        """
+        return self._prepared.stats if self._prepared is not None else None
+
+    @property
+    def query_cache(self):
+        return self._query_cache
+
+    def get_one(self, query, args, cache_ttl=None):
         """ 执行单次查询,返回单条记录
 
         注：仅适用于查询[select]场景
@@ -85,13 +141,20 @@ class DBUtilsPool(DBAPI2PoolBase):
         :param args: 查询参数
         :type args: tuple, list or dict
 
+        :param cache_ttl: 查询结果的缓存时间(秒),None表示不缓存;需在创建连接池时传入query_cache
+        :type cache_ttl: int
+
         :return: 单条查询记录
         """
-        with self.get_cursor() as (conn, cursor):
-            cursor.execute(query, args)
+        if self._query_cache is not None:
+            return self._query_cache.execute('one', query, args, cache_ttl, lambda: self._fetch_one(query, args))
+        return self._fetch_one(query, args)
+
+    def _fetch_one(self, query, args):
+        with self._query_cursor(query, args) as cursor:
             return cursor.fetchone()
 
-    def get_many(self, query, args, size=None):
+    def get_many(self, query, args, size=None, cache_ttl=None):
         """ 执行单次查询,返回多条记录
 
         注：仅适用于查询[select]场景
@@ -105,16 +168,160 @@ class DBUtilsPool(DBAPI2PoolBase):
         :param size: 最大返回记录数
         :type size: int
 
-        :return: 多条查询记录
+        :param cache_ttl: 查询结果的缓存时间(秒),None表示不缓存;需在创建连接池时传入query_cache
+        :type cache_ttl: int
+
+        :return: 多条查询记录,经query_cache缓存时为元组(QueryCache(rowset=True)时为RowSet)
         """
-        with self.get_cursor() as (conn, cursor):
-            cursor.execute(query, args)
+        if self._query_cache is not None:
+            return self._query_cache.execute(f'many:{size}', query, args, cache_ttl,
+                                             lambda: self._fetch_many(query, args, size))
+        return self._fetch_many(query, args, size)
 
+    def _fetch_many(self, query, args, size):
+        with self._query_cursor(query, args) as cursor:
             if size is not None:
                 return cursor.fetchmany(size)
             else:
                 return cursor.fetchall()
 
+    def iter_rows(self, query, args=None, fetch_size=1000):
+        """ 流式查询,逐条返回记录,适用于导出等结果集很大的场景
+
+        使用服务端游标(pymysql/MySQLdb为SSCursor,psycopg2为命名游标),每次从服务端读取fetch_size条,内存占用与结果集大小无关;
+        连接在生成器耗尽或被关闭(close()/提前break后被回收)时才归还连接池,期间该连接不能执行其它语句
+
+        :param query: 需要执行的查询语句
+        :type query: str
+
+        :param args: 查询参数
+        :type args: tuple, list or dict
+
+        :param fetch_size: 每次从服务端读取的记录数
+        :type fetch_size: int
+
+        :return: 记录的生成器
+        """
+        for rows in self._stream(query, args, fetch_size):
+            yield from rows
+
+    def iter_batches(self, query, args=None, batch_size=1000):
+        """ 流式查询,每次返回batch_size条记录组成的列表(最后一批可能不足),适用于分批写入文件或下游系统
+
+        说明同iter_rows
+
+        :param query: 需要执行的查询语句
+        :type query: str
+
+        :param args: 查询参数
+        :type args: tuple, list or dict
+
+        :param batch_size: 每批的记录数
+        :type batch_size: int
+
+        :return: 记录列表的生成器
+        """
+        for rows in self._stream(query, args, batch_size):
+            yield list(rows)
+
+    def fetch_columns(self, query, args=None, batch_size=10000, backend='numpy', decimal_mode='float'):
+        """ 按列读取查询结果,适用于结果集很大的分析类查询(如Doris)
+
+        流式读取(同iter_batches),每批记录直接转换为带类型的列数组,类型由cursor.description推断(见columnar模块)
+
+        :param query: 需要执行的查询语句
+        :type query: str
+
+        :param args: 查询参数
+        :type args: tuple, list or dict
+
+        :param batch_size: 每批从服务端读取的记录数
+        :type batch_size: int
+
+        :param backend: 'numpy'返回{列名: ndarray},'arrow'返回pyarrow.Table
+        :type backend: str
+
+        :param decimal_mode: DECIMAL列的类型: 'float'或'object'(NumPy中为Decimal对象,Arrow中为decimal128)
+        :type decimal_mode: str
+
+        :return: 列数组
+        """
+        builder = None
+
+        def describe(description):
+            nonlocal builder
+            builder = columnar.ColumnarBuilder(description, self.driver.__name__, backend, decimal_mode)
+
+        for rows in self._stream(query, args, batch_size, describe):
+            builder.append(rows)
+        return builder.finish()
+
+    def iter_columns(self, query, args=None, batch_size=10000, backend='numpy', decimal_mode='float'):
+        """ 按列流式读取,每批返回一组列数组: NumPy时为{列名: ndarray},Arrow时为pyarrow.RecordBatch
+
+        说明同fetch_columns;整数列在某一批中出现NULL时,NumPy中该批及之后各批的该列为float64
+
+        :return: 列数组的生成器
+        """
+        builder = None
+
+        def describe(description):
+            nonlocal builder
+            builder = columnar.ColumnarBuilder(description, self.driver.__name__, backend, decimal_mode)
+
+        for rows in self._stream(query, args, batch_size, describe):
+            yield builder.convert(rows)
+
+    def _stream(self, query, args, fetch_size, describe=None):
+        """ 流式读取,describe不为None时在第一次读取后以cursor.description调用(psycopg2的命名游标此时才有description)
+        """
+        conn = self._conn_pool.connection()
+        cursor = None
+        exhausted = False
+        try:
+            cursor = self._server_side_cursor(conn)
+            _execute(cursor, query, args)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if describe is not None:
+                    describe(cursor.description)
+                    describe = None
+                if not rows:
+                    exhausted = True
+                    return
+                yield rows
+        finally:
+            if cursor is not None and not exhausted and self.driver.__name__ in ('pymysql', 'MySQLdb'):
+                # 提前结束时SSCursor.close()会读完剩余的结果,直接断开底层连接,DBUtils在下次取出连接时重连(ping=1)
+                self._disconnect(conn)
+            elif cursor is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+            conn.close()
+
+    def _server_side_cursor(self, conn):
+        """ 创建服务端游标,驱动不支持时退回普通游标(结果集仍会由驱动一次性读取)
+        """
+        name = self.driver.__name__
+        if name in ('pymysql', 'MySQLdb'):
+            return conn.cursor(importlib.import_module(name + '.cursors').SSCursor)
+        if name == 'psycopg2':
+            # 命名游标需在事务中使用,autocommit模式下需声明WITH HOLD
+            return conn.cursor(name='stream_' + uuid.uuid4().hex, withhold=bool(getattr(conn, 'autocommit', False)))
+        return conn.cursor()
+
+    @staticmethod
+    def _disconnect(conn):
+        steady = getattr(conn, '_con', None)
+        close = getattr(steady, '_close', None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
     def query_batch(self, query, args):
         """ 批量执行多个相同结构的SQL语句,返回多条记录
 
@@ -129,10 +336,172 @@ class DBUtilsPool(DBAPI2PoolBase):
 
         :return: 受影响的行数 (若有)
         """
-        with self.get_cursor() as (conn, cursor):
-            affected = cursor.executemany(query, args)
-            conn.commit()
-            return affected
+        try:
+            with self.get_cursor() as (conn, cursor):
+                affected = cursor.executemany(query, args)
+                conn.commit()
+                return affected
+        finally:
+            if self._query_cache is not None:
+                self._query_cache.invalidate_query(query)
+
+    def bulk_insert(self, table, columns, rows, chunk_rows=1000, max_bytes=bulk.DEFAULT_MAX_BYTES, workers=1,
+                    atomic=False):
+        """ 批量插入: 将行数据按行数与语句大小分块,每块改写为一条多行INSERT ... VALUES (...),(...)语句
+
+        相比query_batch(executemany)每块只有一次网络往返,且不依赖驱动对语句形式的识别
+
+        :param table: 表名,可为"库.表"
+        :type table: str
+
+        :param columns: 列名
+        :type columns: list
+
+        :param rows: 行数据(元组/列表或以列名为键的字典)的可迭代对象,可为生成器
+        :type rows: iterable
+
+        :param chunk_rows: 每块最多行数
+        :type chunk_rows: int
+
+        :param max_bytes: 每条语句的估算大小上限(字节),应小于服务端的max_allowed_packet
+        :type max_bytes: int
+
+        :param workers: 并行写入的线程数,大于1时各块使用连接池中不同的连接并各自提交
+        :type workers: int
+
+        :param atomic: 是否在同一个事务中写入所有块(仅workers为1时可用),否则每块提交一次
+        :type atomic: bool
+
+        :return: 受影响的行数
+        """
+        return self._bulk_execute(table, columns, rows, chunk_rows, max_bytes, workers, atomic)
+
+    def bulk_upsert(self, table, columns, rows, update_columns=None, conflict_columns=None, chunk_rows=1000,
+                    max_bytes=bulk.DEFAULT_MAX_BYTES, workers=1, atomic=False):
+        """ 批量插入或更新: MySQL为INSERT ... ON DUPLICATE KEY UPDATE,PostgreSQL/SQLite为INSERT ... ON CONFLICT DO UPDATE
+
+        注: MySQL中被更新的行计为2行受影响
+
+        :param update_columns: 冲突时更新的列,None表示除conflict_columns外的所有列,空列表表示忽略冲突的行
+        :type update_columns: list
+
+        :param conflict_columns: 判断冲突的列(主键或唯一索引),PostgreSQL/SQLite必须指定
+        :type conflict_columns: list
+
+        其余参数同bulk_insert
+        """
+        if update_columns is None and conflict_columns is None:
+            update_columns = list(columns)
+        return self._bulk_execute(table, columns, rows, chunk_rows, max_bytes, workers, atomic,
+                                  update_columns, conflict_columns or ())
+
+    def bulk_load(self, table, columns, rows, chunk_rows=100000, workers=1, on_duplicate=None):
+        """ 大批量导入: MySQL使用LOAD DATA LOCAL INFILE(需在连接参数中设置local_infile=True),PostgreSQL使用COPY FROM STDIN
+
+        每块先格式化为文本(制表符分隔),MySQL写入临时文件后导入,PostgreSQL直接从内存流式导入;其它数据库退回bulk_insert
+
+        :param on_duplicate: 仅MySQL,主键冲突时的处理: None(报错), 'replace'或'ignore';其它数据库需为None,
+            需要忽略或更新冲突的行时使用bulk_upsert
+        :type on_duplicate: str
+
+        其余参数同bulk_insert
+        """
+        dialect = bulk.get_dialect(self.driver.__name__)
+        if dialect == 'mysql':
+            sql = bulk.build_load_data(table, columns, on_duplicate)
+
+            def write(cursor, chunk):
+                with tempfile.NamedTemporaryFile('wb', suffix='.tsv', delete=False) as f:
+                    f.write(bulk.format_text_rows(chunk, dialect))
+                try:
+                    cursor.execute(sql, (f.name,))
+                finally:
+                    os.remove(f.name)
+                return cursor.rowcount
+        elif dialect == 'postgresql':
+            assert on_duplicate is None, "COPY不支持on_duplicate"
+            sql = bulk.build_copy(table, columns)
+
+            def write(cursor, chunk):
+                cursor.copy_expert(sql, io.BytesIO(bulk.format_text_rows(chunk, dialect)))
+                return cursor.rowcount
+        else:
+            assert on_duplicate is None, "仅MySQL支持on_duplicate,其它数据库请使用bulk_upsert"
+            return self.bulk_insert(table, columns, rows, chunk_rows, workers=workers)
+
+        chunks = bulk.iter_chunks(bulk.as_sequences(rows, columns), chunk_rows, max_bytes=None)
+        try:
+            return self._run_chunks(chunks, write, workers, atomic=False)
+        finally:
+            self._invalidate_tables(table)
+
+    def _bulk_execute(self, table, columns, rows, chunk_rows, max_bytes, workers, atomic,
+                      update_columns=None, conflict_columns=None):
+        dialect = bulk.get_dialect(self.driver.__name__)
+        placeholder = bulk.get_placeholder(self.driver.paramstyle)
+        statements = {}  # 行数 -> SQL,除最后一块外各块行数通常相同
+
+        def write(cursor, chunk):
+            sql = statements.get(len(chunk))
+            if sql is None:
+                sql = statements[len(chunk)] = bulk.build_insert(table, columns, len(chunk), dialect, placeholder,
+                                                                 update_columns, conflict_columns)
+            cursor.execute(sql, bulk.flatten(chunk))
+            return cursor.rowcount
+
+        chunks = bulk.iter_chunks(bulk.as_sequences(rows, columns), chunk_rows, max_bytes, bulk.MAX_PARAMS.get(dialect))
+        try:
+            return self._run_chunks(chunks, write, workers, atomic)
+        finally:
+            # 失败时部分块可能已提交
+            self._invalidate_tables(table)
+
+    def _invalidate_tables(self, *tables):
+        if self._query_cache is not None:
+            self._query_cache.invalidate(*tables)
+
+    def _run_chunks(self, chunks, write, workers, atomic):
+        """ 依次或并行写入各块,返回受影响的行数之和
+
+        并行时最多有2 * workers个块在排队,避免生成器中的数据被一次性读入内存;
+        某一块失败时抛出异常,已提交的块不会回滚
+        """
+        assert not (atomic and workers > 1), "atomic仅在workers为1时可用"
+
+        if workers <= 1:
+            with self.get_cursor() as (conn, cursor):
+                affected = 0
+                try:
+                    for chunk in chunks:
+                        affected += max(write(cursor, chunk), 0)
+                        if not atomic:
+                            conn.commit()
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                return affected
+
+        def write_chunk(chunk):
+            with self.get_cursor() as (conn, cursor):
+                try:
+                    count = write(cursor, chunk)
+                    conn.commit()
+                    return max(count, 0)
+                except Exception:
+                    conn.rollback()
+                    raise
+
+        affected = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-write') as executor:
+            pending = set()
+            for chunk in chunks:
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    affected += sum(future.result() for future in done)
+                pending.add(executor.submit(write_chunk, chunk))
+            affected += sum(future.result() for future in pending)
+        return affected
 
 
 if __name__ == '__main__':
@@ -143,6 +512,23 @@ if __name__ == '__main__':
     print(mysql_pool.get_one("SELECT * FROM testdb.debezium_demo", ()))
     # 查询多条记录
     print(mysql_pool.get_many("SELECT * FROM testdb.debezium_demo", ()))
+    # 流式查询: 逐条/分批读取大结果集,连接在读完或生成器关闭后归还
+    for row in mysql_pool.iter_rows("SELECT * FROM testdb.debezium_demo", (), fetch_size=2):
+        print(row)
+    for batch in mysql_pool.iter_batches("SELECT * FROM testdb.debezium_demo", (), batch_size=2):
+        print(len(batch))
+    # 批量插入/更新: 多行VALUES语句,按行数与语句大小分块;大批量导入使用LOAD DATA LOCAL INFILE(需local_infile=True)
+    # print(mysql_pool2.bulk_upsert("testdb.debezium_demo", ["id", "name"], [(i, f"n{i}") for i in range(100)]))
+    # print(mysql_pool2.bulk_load("testdb.debezium_demo", ["id", "name"], ((i, f"n{i}") for i in range(10 ** 6)),
+    #                             on_duplicate='replace'))
+    # 按列读取分析查询结果(Doris): 每批记录直接转换为NumPy数组,不保留逐行的元组
+    # doris_pool = DBUtilsPool.from_conf('pymysql', 'example_db.conf', 'mysql-test')
+    # columns = doris_pool.fetch_columns("SELECT * FROM demo.analytics_events", batch_size=50000)
+    # table = doris_pool.fetch_columns("SELECT * FROM demo.analytics_events", backend='arrow')
+    # 查询结果缓存: 传入cache_ttl的查询经缓存读取,写入testdb.debezium_demo后自动失效
+    # from commutils.cache.backends import DictCache
+    # cached_pool = DBUtilsPool.from_conf('pymysql', 'example_db.conf', 'mysql-dev', query_cache=QueryCache(DictCache()))
+    # print(cached_pool.get_many("SELECT * FROM testdb.debezium_demo", (), cache_ttl=60))
     # 新增一条记录
     print(mysql_pool.get_one("INSERT INTO testdb.debezium_demo (id, name) VALUES (%s, %s)", ("8", "n8")))
     # 批量操作
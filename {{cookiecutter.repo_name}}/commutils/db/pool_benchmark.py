@@ -0,0 +1,244 @@
+""" pymysqlpool.ConnectionPool性能基准测试: 条件等待+FIFO交接的实现与重写前"递归重试+sleep"实现的对比
+
+直接运行的脚本,使用绝对路径导入(需在工程根目录下执行):
+    python -m commutils.db.pool_benchmark                                    # 模拟连接,仅测量连接池自身的调度
+    python -m commutils.db.pool_benchmark --conf commutils/db/example_db.conf --section mysql-dev
+结果以JSON输出,每个场景(并发线程数)下各实现的:
+    ops_per_sec         完成的借出-归还次数/秒
+    wait_p50/p99/max_ms 获取连接的等待时间
+    errors              获取连接失败(超时且已达maxsize)的次数
+    created             创建的连接数,超过size的部分即突发负载下额外创建的连接
+注意:
+    1) 模拟模式下持有连接期间sleep(hold)代替查询,建连耗时为connect_latency,不产生网络I/O
+    2) 真实数据库模式下每次借出执行"SELECT SLEEP(hold)",hold应远小于MySQL的wait_timeout
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+from commutils.db.pymysqlpool import ConnectionPool, GetConnectionFromPoolError
+from commutils.parser.conf_parser import ConfigAgent
+
+
+class LegacyConnectionPool(ConnectionPool):
+    """ 重写前的获取/归还逻辑: 连接池为空时递归重试并sleep(retry_interval),重试耗尽后直接扩容至maxsize
+
+    仅用于对比,沿用新实现的连接创建与统计
+    """
+
+    def get_connection(self, retry_num=3, retry_interval=0.1, pre_ping=False, timeout=None):
+        start_time = time.perf_counter()
+        conn, reserved = self._legacy_get(min(retry_num, 10), retry_interval)
+        self.wait_time.observe(time.perf_counter() - start_time)
+        if reserved:
+            return self._create_connection()
+        conn._returned = False
+        return conn
+
+    def _legacy_get(self, retry_num, retry_interval):
+        try:
+            return self._pool.pop(), False
+        except IndexError:
+            # 与原实现一致: 先判断后创建,并发时可能超出size
+            if self.total_num < self._size:
+                return self._legacy_reserve()
+            if retry_num > 0:
+                time.sleep(retry_interval)
+                return self._legacy_get(retry_num - 1, retry_interval)
+            if self.total_num < self.maxsize:
+                with self._lock:
+                    self._counters['overflows'] += 1
+                return self._legacy_reserve()
+            with self._lock:
+                self._counters['timeouts'] += 1
+            raise GetConnectionFromPoolError(
+                "can't get connection from pool({}), due to pool lack.".format(self.name))
+
+    def _legacy_reserve(self):
+        with self._lock:
+            self._total += 1
+        return None, True
+
+    def _put_connection(self, conn):
+        conn._returned = True
+        self._pool.appendleft(conn)
+
+
+class _NullCursor:
+    def close(self):
+        pass
+
+
+class SimulatedConnection:
+    """ 模拟连接: 建连耗时connect_latency,不产生网络I/O,用于单独测量连接池的调度开销
+    """
+    _pool = None
+
+    def __init__(self, connect_latency):
+        time.sleep(connect_latency)
+
+    def cursor(self):
+        return _NullCursor()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool._put_connection(self)
+
+    def ping(self, reconnect=True):
+        pass
+
+    def _force_close(self):
+        pass
+
+
+def make_pool(pool_class, size, maxsize, connect_latency=None, **conn_kwargs):
+    """ 创建连接池,connect_latency不为None时使用模拟连接
+
+    :param pool_class: ConnectionPool或LegacyConnectionPool
+    :param size:
+    :param maxsize:
+    :param connect_latency: 模拟的建连耗时(秒)
+    :param conn_kwargs: 真实数据库的连接参数
+    :return:
+    """
+    pool = pool_class(size, maxsize, con_lifetime=0, **conn_kwargs)
+    if connect_latency is not None:
+        pool._connect = lambda: SimulatedConnection(connect_latency)
+    return pool
+
+
+def run_workload(pool, threads, iterations, hold, simulated=True, retry_num=3, retry_interval=0.1):
+    """ 所有线程同时开始(突发负载),每个线程借出连接、持有hold秒后归还,重复iterations次
+
+    :return: 吞吐、等待时间分位数、失败次数与创建的连接数
+    """
+    barrier = threading.Barrier(threads)
+    waits, errors = [], [0]
+    lock = threading.Lock()
+
+    def worker():
+        local_waits, local_errors = [], 0
+        barrier.wait()
+        for _ in range(iterations):
+            start_time = time.perf_counter()
+            try:
+                conn = pool.get_connection(retry_num, retry_interval)
+            except GetConnectionFromPoolError:
+                local_errors += 1
+                continue
+            local_waits.append(time.perf_counter() - start_time)
+            try:
+                if simulated:
+                    time.sleep(hold)
+                else:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT SLEEP(%s)", (hold,))
+            finally:
+                conn.close()
+        with lock:
+            waits.extend(local_waits)
+            errors[0] += local_errors
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start_time = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    waits.sort()
+    stats = pool.stats
+    return {
+        'ops_per_sec': round(len(waits) / elapsed, 1),
+        'wait_p50_ms': round(_percentile(waits, 50) * 1e3, 3),
+        'wait_p99_ms': round(_percentile(waits, 99) * 1e3, 3),
+        'wait_max_ms': round(waits[-1] * 1e3, 3) if waits else 0,
+        'errors': errors[0],
+        'created': stats['created'],
+        'overflows': stats['overflows'],
+    }
+
+
+def _percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0
+    rank = max(int(round(pct / 100 * len(sorted_samples) + 0.5)) - 1, 0)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+
+def close_pool(pool):
+    while pool._pool:
+        conn = pool._pool.pop()
+        conn._pool = None
+        if not isinstance(conn, SimulatedConnection):
+            conn.close()
+
+
+def run_suite(thread_counts, size, maxsize, iterations, hold, connect_latency, conn_kwargs):
+    simulated = not conn_kwargs
+    result = {
+        'meta': {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'mode': 'simulated' if simulated else 'mysql',
+            'size': size,
+            'maxsize': maxsize,
+            'iterations': iterations,
+            'hold_ms': hold * 1e3,
+            'connect_latency_ms': connect_latency * 1e3 if simulated else None,
+        },
+        'scenarios': {},
+    }
+    for threads in thread_counts:
+        print(f"threads={threads}...", file=sys.stderr)
+        scenario = {}
+        for pool_class in (LegacyConnectionPool, ConnectionPool):
+            pool = make_pool(pool_class, size, maxsize, connect_latency if simulated else None, **conn_kwargs)
+            try:
+                scenario[pool_class.__name__] = run_workload(pool, threads, iterations, hold, simulated)
+            finally:
+                close_pool(pool)
+        result['scenarios'][f"threads={threads}"] = scenario
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pymysqlpool连接池基准测试")
+    parser.add_argument('--conf', help="数据库配置文件,未指定时使用模拟连接")
+    parser.add_argument('--section', default='mysql-dev')
+    parser.add_argument('--threads', default='4,16,64', help="并发线程数,逗号分隔")
+    parser.add_argument('--size', type=int, default=8)
+    parser.add_argument('--maxsize', type=int, default=16)
+    parser.add_argument('--iterations', type=int, default=50, help="每个线程借出连接的次数")
+    parser.add_argument('--hold', type=float, default=0.005, help="每次持有连接的时长(秒)")
+    parser.add_argument('--connect-latency', type=float, default=0.02, help="模拟的建连耗时(秒)")
+    parser.add_argument('--output', help="结果输出文件,默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    conn_kwargs = {}
+    if args.conf:
+        config_agent = ConfigAgent()
+        config_agent.read(args.conf)
+        conn_kwargs = config_agent.get_dict(args.section)
+
+    result = run_suite([int(t) for t in args.threads.split(',')], args.size, args.maxsize, args.iterations,
+                       args.hold, args.connect_latency, conn_kwargs)
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
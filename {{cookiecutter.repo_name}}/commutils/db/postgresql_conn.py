@@ -0,0 +1,410 @@
+""" PostgreSQL同步/asyncio连接池
+
+依赖: psycopg[binary]>=3.1 psycopg_pool>=3.2
+    PostgresPool        线程安全的同步连接池
+    AsyncPostgresPool   asyncio连接池,供FastAPI等异步框架使用
+两者的方法一一对应(异步版本为协程/异步生成器):
+    get_one/get_many/execute  单条语句,连接归还时提交(出错时回滚)
+    query_batch               同一语句执行多组参数(executemany,在pipeline模式下发送,不逐条等待结果)
+    pipeline                  在pipeline模式下执行多条不同的语句,一个事务,整批只等待一次网络往返
+    iter_rows/iter_batches    服务端游标(命名游标)流式读取,内存占用与结果集大小无关
+    copy_in/copy_out          COPY FROM STDIN批量导入/COPY TO STDOUT导出(csv/text/binary)
+配置: example_db.conf中的[postgresql-dev],连接参数同psycopg.connect(host/port/user/password/dbname),
+    连接池参数(min_size/max_size/timeout/max_lifetime/max_idle)可写在同一section中
+本地测试:
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=postgres postgres:16
+    修改[postgresql-dev]的password后运行 python -m commutils.db.postgresql_conn
+"""
+
+import asyncio
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+from commutils.parser.conf_parser import ConfigAgent
+
+# 配置文件中属于连接池的参数,其余参数传给psycopg.connect
+POOL_OPTIONS = ('min_size', 'max_size', 'timeout', 'max_lifetime', 'max_idle', 'max_waiting', 'reconnect_timeout',
+                'num_workers', 'check')
+
+COPY_FORMATS = ('csv', 'text', 'binary')
+
+
+def split_conf(kwargs):
+    """ 将配置拆分为(连接参数, 连接池参数),兼容pymysql风格的database参数名
+    """
+    conn_kwargs = dict(kwargs)
+    pool_kwargs = {option: conn_kwargs.pop(option) for option in POOL_OPTIONS if option in conn_kwargs}
+    if 'database' in conn_kwargs:
+        conn_kwargs['dbname'] = conn_kwargs.pop('database')
+    return conn_kwargs, pool_kwargs
+
+
+def table_identifier(table):
+    """ "库.表"/"模式.表"形式的表名 -> sql.Identifier
+    """
+    return sql.Identifier(*table.split('.'))
+
+
+def build_copy_in(table, columns, copy_format='text'):
+    """ 构造COPY ... FROM STDIN语句
+    """
+    assert copy_format in COPY_FORMATS, f"不支持的COPY格式: {copy_format}"
+    return sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT {})").format(
+        table_identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns)), sql.SQL(copy_format))
+
+
+def build_copy_out(query, copy_format='csv', header=True):
+    """ 构造COPY (query) TO STDOUT语句,query中的%s参数由psycopg在客户端绑定
+    """
+    assert copy_format in COPY_FORMATS, f"不支持的COPY格式: {copy_format}"
+    options = [sql.SQL("FORMAT {}").format(sql.SQL(copy_format))]
+    if header and copy_format == 'csv':
+        options.append(sql.SQL("HEADER"))
+    return sql.SQL("COPY ({}) TO STDOUT WITH ({})").format(sql.SQL(query), sql.SQL(', ').join(options))
+
+
+def _pool_name(name, conn_kwargs):
+    return name if name else '-'.join(
+        [str(conn_kwargs.get('host', 'localhost')), str(conn_kwargs.get('port', 5432)),
+         str(conn_kwargs.get('user', '')), str(conn_kwargs.get('dbname', ''))])
+
+
+def _cursor_name():
+    return 'stream_' + uuid.uuid4().hex
+
+
+class PostgresPool:
+    """ 线程安全的PostgreSQL同步连接池类
+
+    用法:
+        pool = PostgresPool.from_conf('example_db.conf', 'postgresql-dev')
+        rows = pool.get_many("SELECT * FROM demo WHERE id > %s", (10,))
+        with pool.get_cursor() as (conn, cursor):  # with块正常结束时提交,发生异常时回滚
+            cursor.execute("UPDATE demo SET name = %s WHERE id = %s", ("n1", 1))
+        pool.close()
+    """
+
+    def __init__(self, min_size=1, max_size=10, name=None, timeout=3, max_lifetime=3600, max_idle=600, check=True,
+                 **kwargs):
+        """
+        :param min_size: 保持的最少连接数
+        :param max_size: 最大连接数
+        :param name: 连接池名称,默认为host-port-user-dbname
+        :param timeout: 获取连接的默认等待时间(秒),超时抛出psycopg_pool.PoolTimeout
+        :param max_lifetime: 连接的最长存活时间(秒),到期后由后台线程替换
+        :param max_idle: 超过min_size的连接空闲多少秒后关闭
+        :param check: 借出连接前是否检查连接可用(一次空查询的网络往返),服务端可能主动断开连接时开启
+        :param kwargs: 透传给psycopg.connect的参数,如host/port/user/password/dbname/autocommit/application_name;
+                       其中的max_waiting/reconnect_timeout/num_workers传给psycopg_pool
+        """
+        conn_kwargs, pool_kwargs = split_conf(kwargs)
+        self.name = _pool_name(name, conn_kwargs)
+        self._pool = ConnectionPool(kwargs=conn_kwargs, min_size=min_size, max_size=max_size, name=self.name,
+                                    timeout=timeout, max_lifetime=max_lifetime, max_idle=max_idle,
+                                    check=ConnectionPool.check_connection if check else None, open=False,
+                                    **pool_kwargs)
+        self._pool.open(wait=False)
+
+    @classmethod
+    def from_conf(cls, filename, section, **pool_kwargs):
+        """ 从文件读取配置并返回连接池对象
+
+        :param filename:
+        :param section:
+        :param pool_kwargs: 覆盖配置文件的连接池参数,如max_size/timeout
+        :return:
+        """
+        config_agent = ConfigAgent()
+        config_agent.read(filename)
+        conn_kwargs, conf_pool_kwargs = split_conf(config_agent.get_dict(section))
+        conf_pool_kwargs.update(pool_kwargs)
+
+        return cls(**conf_pool_kwargs, **conn_kwargs)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """ 借出连接,with块结束时归还: 正常结束时提交事务,发生异常时回滚
+        """
+        with self._pool.connection(timeout) as conn:
+            yield conn
+
+    @contextmanager
+    def get_cursor(self):
+        with self._pool.connection() as conn:
+            with conn.cursor() as cursor:
+                yield conn, cursor
+
+    def get_one(self, query, args=None):
+        """ 执行查询,返回单条记录
+        """
+        with self.get_cursor() as (conn, cursor):
+            cursor.execute(query, args)
+            return cursor.fetchone()
+
+    def get_many(self, query, args=None, size=None):
+        """ 执行查询,返回多条记录,size为最大返回记录数
+        """
+        with self.get_cursor() as (conn, cursor):
+            cursor.execute(query, args)
+            return cursor.fetchmany(size) if size is not None else cursor.fetchall()
+
+    def execute(self, query, args=None):
+        """ 执行单条语句并提交,返回受影响的行数
+        """
+        with self.get_cursor() as (conn, cursor):
+            cursor.execute(query, args)
+            return cursor.rowcount
+
+    def query_batch(self, query, args):
+        """ 以多组参数执行同一语句并提交,返回受影响的行数
+
+        psycopg在libpq支持时以pipeline模式发送所有语句,整批只等待一次网络往返
+        """
+        with self.get_cursor() as (conn, cursor):
+            cursor.executemany(query, args)
+            return cursor.rowcount
+
+    def pipeline(self, statements):
+        """ 在pipeline模式下执行多条语句: 依次发送而不等待各自的结果,在同一个事务中提交
+
+        任一语句失败时整个事务回滚并抛出异常
+        :param statements: (query, args)的可迭代对象
+        :return: 各语句的结果: 有结果集的语句为记录列表,其它语句为受影响的行数
+        """
+        with self._pool.connection() as conn:
+            cursors = []
+            with conn.pipeline():
+                for query, args in statements:
+                    cursor = conn.cursor()
+                    cursor.execute(query, args)
+                    cursors.append(cursor)
+            # 退出pipeline块时已同步,各语句的结果均已收到
+            results = [cursor.fetchall() if cursor.description is not None else cursor.rowcount for cursor in cursors]
+            for cursor in cursors:
+                cursor.close()
+            return results
+
+    def iter_rows(self, query, args=None, fetch_size=1000):
+        """ 流式查询,逐条返回记录
+
+        使用服务端游标,每次读取fetch_size条;连接在生成器耗尽或被关闭时归还连接池
+        """
+        for rows in self._stream(query, args, fetch_size):
+            yield from rows
+
+    def iter_batches(self, query, args=None, batch_size=1000):
+        """ 流式查询,每次返回batch_size条记录组成的列表(最后一批可能不足)
+        """
+        yield from self._stream(query, args, batch_size)
+
+    def _stream(self, query, args, fetch_size):
+        with self._pool.connection() as conn:
+            # 服务端游标需在事务中使用,autocommit连接需声明WITH HOLD
+            with conn.cursor(name=_cursor_name(), withhold=conn.autocommit) as cursor:
+                cursor.itersize = fetch_size
+                cursor.execute(query, args)
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        return
+                    yield rows
+
+    def copy_in(self, table, columns, rows):
+        """ 以COPY FROM STDIN批量导入,rows可为生成器(边读边发送),在一个事务中提交
+
+        :param table: 表名,可为"模式.表"
+        :param columns: 列名
+        :param rows: 行数据(序列)的可迭代对象
+        :return: 导入的行数
+        """
+        with self.get_cursor() as (conn, cursor):
+            with cursor.copy(build_copy_in(table, columns)) as copy:
+                for row in rows:
+                    copy.write_row(row)
+            return cursor.rowcount
+
+    def copy_out(self, query, args=None, copy_format='csv', header=True):
+        """ 以COPY (query) TO STDOUT导出查询结果,返回数据块(bytes)的生成器,可直接写入文件
+
+            with open('demo.csv', 'wb') as f:
+                f.writelines(pool.copy_out("SELECT * FROM demo WHERE id > %s", (10,)))
+        :param copy_format: 'csv'/'text'/'binary'
+        :param header: csv格式是否输出表头
+        """
+        with self.get_cursor() as (conn, cursor):
+            with cursor.copy(build_copy_out(query, copy_format, header), args) as copy:
+                for data in copy:
+                    yield bytes(data)
+
+    @property
+    def stats(self):
+        """ 连接池统计(psycopg_pool的get_stats)
+        """
+        return self._pool.get_stats()
+
+    def close(self, timeout=5):
+        self._pool.close(timeout)
+
+
+class AsyncPostgresPool:
+    """ asyncio版PostgreSQL连接池类
+
+    用法:
+        pool = await AsyncPostgresPool.from_conf('example_db.conf', 'postgresql-dev').open()
+        rows = await pool.get_many("SELECT * FROM demo WHERE id > %s", (10,))
+        async for row in pool.iter_rows("SELECT * FROM demo"):
+            ...
+        await pool.close()
+    """
+
+    def __init__(self, min_size=1, max_size=10, name=None, timeout=3, max_lifetime=3600, max_idle=600, check=True,
+                 **kwargs):
+        """
+        参数同PostgresPool;连接池需在事件循环中调用open()后使用
+        """
+        conn_kwargs, pool_kwargs = split_conf(kwargs)
+        self.name = _pool_name(name, conn_kwargs)
+        self._pool = AsyncConnectionPool(kwargs=conn_kwargs, min_size=min_size, max_size=max_size, name=self.name,
+                                         timeout=timeout, max_lifetime=max_lifetime, max_idle=max_idle,
+                                         check=AsyncConnectionPool.check_connection if check else None, open=False,
+                                         **pool_kwargs)
+
+    @classmethod
+    def from_conf(cls, filename, section, **pool_kwargs):
+        """ 从文件读取配置并返回连接池对象(需调用open()后使用)
+        """
+        config_agent = ConfigAgent()
+        config_agent.read(filename)
+        conn_kwargs, conf_pool_kwargs = split_conf(config_agent.get_dict(section))
+        conf_pool_kwargs.update(pool_kwargs)
+
+        return cls(**conf_pool_kwargs, **conn_kwargs)
+
+    async def open(self, wait=False, timeout=30):
+        """ 打开连接池,wait为True时等待min_size个连接创建完成
+        """
+        await self._pool.open(wait=wait, timeout=timeout)
+        return self
+
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        async with self._pool.connection(timeout) as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def get_cursor(self):
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                yield conn, cursor
+
+    async def get_one(self, query, args=None):
+        async with self.get_cursor() as (conn, cursor):
+            await cursor.execute(query, args)
+            return await cursor.fetchone()
+
+    async def get_many(self, query, args=None, size=None):
+        async with self.get_cursor() as (conn, cursor):
+            await cursor.execute(query, args)
+            return await cursor.fetchmany(size) if size is not None else await cursor.fetchall()
+
+    async def execute(self, query, args=None):
+        async with self.get_cursor() as (conn, cursor):
+            await cursor.execute(query, args)
+            return cursor.rowcount
+
+    async def query_batch(self, query, args):
+        async with self.get_cursor() as (conn, cursor):
+            await cursor.executemany(query, args)
+            return cursor.rowcount
+
+    async def pipeline(self, statements):
+        async with self._pool.connection() as conn:
+            cursors = []
+            async with conn.pipeline():
+                for query, args in statements:
+                    cursor = conn.cursor()
+                    await cursor.execute(query, args)
+                    cursors.append(cursor)
+            results = [await cursor.fetchall() if cursor.description is not None else cursor.rowcount
+                       for cursor in cursors]
+            for cursor in cursors:
+                await cursor.close()
+            return results
+
+    async def iter_rows(self, query, args=None, fetch_size=1000):
+        async for rows in self._stream(query, args, fetch_size):
+            for row in rows:
+                yield row
+
+    async def iter_batches(self, query, args=None, batch_size=1000):
+        async for rows in self._stream(query, args, batch_size):
+            yield rows
+
+    async def _stream(self, query, args, fetch_size):
+        async with self._pool.connection() as conn:
+            async with conn.cursor(name=_cursor_name(), withhold=conn.autocommit) as cursor:
+                cursor.itersize = fetch_size
+                await cursor.execute(query, args)
+                while True:
+                    rows = await cursor.fetchmany(fetch_size)
+                    if not rows:
+                        return
+                    yield rows
+
+    async def copy_in(self, table, columns, rows):
+        """ 以COPY FROM STDIN批量导入,rows可为同步或异步可迭代对象
+        """
+        async with self.get_cursor() as (conn, cursor):
+            async with cursor.copy(build_copy_in(table, columns)) as copy:
+                if hasattr(rows, '__aiter__'):
+                    async for row in rows:
+                        await copy.write_row(row)
+                else:
+                    for row in rows:
+                        await copy.write_row(row)
+            return cursor.rowcount
+
+    async def copy_out(self, query, args=None, copy_format='csv', header=True):
+        async with self.get_cursor() as (conn, cursor):
+            async with cursor.copy(build_copy_out(query, copy_format, header), args) as copy:
+                async for data in copy:
+                    yield bytes(data)
+
+    @property
+    def stats(self):
+        return self._pool.get_stats()
+
+    async def close(self, timeout=5):
+        await self._pool.close(timeout)
+
+
+if __name__ == '__main__':
+    pg_pool = PostgresPool.from_conf('example_db.conf', 'postgresql-dev')
+
+    pg_pool.execute("CREATE TABLE IF NOT EXISTS debezium_demo (id INT PRIMARY KEY, name TEXT)")
+    # COPY批量导入/导出
+    print(pg_pool.copy_in("debezium_demo", ["id", "name"], ((i, f"n{i}") for i in range(10000))))
+    print(b''.join(pg_pool.copy_out("SELECT * FROM debezium_demo WHERE id < %s", (3,))).decode())
+    # 查询
+    print(pg_pool.get_one("SELECT count(*) FROM debezium_demo"))
+    # 流式查询
+    print(sum(len(batch) for batch in pg_pool.iter_batches("SELECT * FROM debezium_demo", batch_size=1000)))
+    # pipeline: 多条语句一次往返
+    print(pg_pool.pipeline([("UPDATE debezium_demo SET name = %s WHERE id = %s", ("m1", 1)),
+                            ("DELETE FROM debezium_demo WHERE id >= %s", (100,)),
+                            ("SELECT * FROM debezium_demo WHERE id = %s", (1,))]))
+    print(pg_pool.stats)
+    pg_pool.close()
+
+    async def main():
+        async_pool = await AsyncPostgresPool.from_conf('example_db.conf', 'postgresql-dev').open()
+        print(await async_pool.get_many("SELECT * FROM debezium_demo", size=3))
+        async for row in async_pool.iter_rows("SELECT * FROM debezium_demo", fetch_size=50):
+            pass
+        print(await async_pool.execute("DROP TABLE debezium_demo"))
+        await async_pool.close()
+
+    asyncio.run(main())
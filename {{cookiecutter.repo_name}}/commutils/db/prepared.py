@@ -0,0 +1,217 @@
+""" 预处理语句缓存: 在连接池的每个物理连接上缓存服务端预处理语句,避免热点查询被服务端重复解析
+
+按驱动选择实现:
+    psycopg2         SQL级PREPARE/EXECUTE(psycopg2不支持扩展查询协议),首次执行时PREPARE,之后每次仅一条EXECUTE
+    mysql.connector  prepared=True的游标(二进制协议COM_STMT_PREPARE/COM_STMT_EXECUTE),每条SQL缓存一个游标
+    psycopg          驱动自带: prepare_threshold=0使所有语句使用服务端预处理,prepared_max为LRU上限
+    oracledb         驱动自带: stmtcachesize为语句缓存上限
+    其它(pymysql/MySQLdb/sqlite3等)  按原方式执行: pymysql/MySQLdb仅支持文本协议,sqlite3自带语句缓存
+每个物理连接的缓存按SQL文本索引、LRU淘汰(淘汰时在服务端释放);DBUtils重建连接后缓存随之重建,
+psycopg2在服务端语句丢失时自动重新PREPARE。
+注意: 经PgBouncer事务级连接池访问PostgreSQL时,预处理语句不能跨事务使用,不应开启
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+# 驱动 -> 实现方式
+_STRATEGIES = {
+    'psycopg2': 'sql',
+    'mysql.connector': 'cursor',
+    'psycopg': 'native',
+    'oracledb': 'native',
+    'cx_Oracle': 'native',
+}
+
+# pyformat占位符: %s, %(name)s, 以及转义的%%
+_PLACEHOLDER = re.compile(r"%%|%\((\w+)\)s|%s")
+
+# PostgreSQL错误码: 预处理语句不存在
+_PG_INVALID_STATEMENT_NAME = '26000'
+
+
+def to_numbered(query):
+    """ 将pyformat占位符转换为PostgreSQL的$n占位符
+
+    :param query:
+    :return: (转换后的SQL, 参数个数, 命名参数的顺序;位置参数时为None)
+    """
+    order = {}
+    positional = [0]
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name is None:
+            positional[0] += 1
+            return f"${positional[0]}"
+        if name not in order:
+            order[name] = len(order) + 1
+        return f"${order[name]}"
+
+    text = _PLACEHOLDER.sub(replace, query)
+    assert not (positional[0] and order), "不支持同时使用%s与%(name)s占位符"
+    if order:
+        return text, len(order), list(order)
+    return text, positional[0], None
+
+
+class StatementCache:
+    """ 单个物理连接上的预处理语句缓存(LRU)
+    """
+
+    def __init__(self, raw, capacity):
+        self.raw = raw  # 缓存所属的驱动连接,DBUtils重建连接后不再相同
+        self.capacity = capacity
+        self.statements = OrderedDict()  # SQL -> 语句句柄
+        self.sequence = 0
+
+    def get(self, query):
+        handle = self.statements.get(query)
+        if handle is not None:
+            self.statements.move_to_end(query)
+        return handle
+
+    def put(self, query, handle):
+        """ 写入语句,返回被淘汰的句柄列表
+        """
+        self.statements[query] = handle
+        evicted = []
+        while len(self.statements) > self.capacity:
+            evicted.append(self.statements.popitem(last=False)[1])
+        return evicted
+
+    def clear(self):
+        self.statements.clear()
+
+
+class PreparedStatements:
+    """ 连接池级别的预处理语句层,由DBUtilsPool(prepare_cache_size=N)创建
+    """
+
+    def __init__(self, driver_name, capacity=64):
+        """
+        :param driver_name: 驱动模块名
+        :param capacity: 每个连接最多缓存的语句数
+        """
+        self.driver_name = driver_name
+        self.strategy = _STRATEGIES.get(driver_name)
+        self.capacity = capacity
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'reprepares': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.strategy is not None
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, strategy=self.strategy)
+
+    def execute(self, conn, cursor, query, args):
+        """ 在连接上执行语句,返回可读取结果的游标(mysql.connector时为缓存的预处理游标)
+
+        :param conn: 连接池返回的连接
+        :param cursor: 该连接的普通游标
+        :param query:
+        :param args:
+        :return:
+        """
+        if self.strategy is None or self.strategy == 'native':
+            if self.strategy == 'native':
+                self._cache_for(conn)
+            if args is None:
+                cursor.execute(query)
+            else:
+                cursor.execute(query, args)
+            return cursor
+        if self.strategy == 'sql':
+            return self._execute_sql(conn, cursor, query, args)
+        return self._execute_cursor(conn, cursor, query, args)
+
+    def finish(self, cursor):
+        """ 读完预处理游标上未读取的结果,否则该连接无法执行下一条语句
+        """
+        if self.strategy == 'cursor' and getattr(cursor, 'with_rows', False):
+            try:
+                cursor.fetchall()
+            except Exception:
+                pass
+
+    def _cache_for(self, conn):
+        # DBUtils: PooledDB连接 -> SteadyDB连接(在连接池中复用) -> 驱动连接(重连后会被替换)
+        steady = getattr(conn, '_con', conn)
+        raw = getattr(steady, '_con', steady)
+        cache = getattr(steady, '_statement_cache', None)
+        if cache is None or cache.raw is not raw:
+            # 新连接或连接已被重建,服务端的预处理语句随旧连接失效
+            cache = StatementCache(raw, self.capacity)
+            steady._statement_cache = cache
+            if self.driver_name == 'psycopg':
+                raw.prepare_threshold = 0
+                raw.prepared_max = self.capacity
+            elif self.strategy == 'native':
+                raw.stmtcachesize = self.capacity
+        return cache
+
+    def _count(self, counter, count=1):
+        with self._lock:
+            self._counters[counter] += count
+
+    def _execute_sql(self, conn, cursor, query, args, retry=True):
+        cache = self._cache_for(conn)
+        handle = cache.get(query)
+        if handle is None:
+            self._count('misses')
+            text, nparams, names = to_numbered(query)
+            cache.sequence += 1
+            name = f"commutils_stmt_{cache.sequence}"
+            cursor.execute(f"PREPARE {name} AS {text}")
+            execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * nparams)})" if nparams else f"EXECUTE {name}"
+            handle = (name, execute_sql, names)
+            evicted = cache.put(query, handle)
+            for evicted_name, _, _ in evicted:
+                cursor.execute(f"DEALLOCATE {evicted_name}")
+            self._count('evictions', len(evicted))
+        else:
+            self._count('hits')
+
+        name, execute_sql, names = handle
+        values = tuple(args[key] for key in names) if names is not None else tuple(args or ())
+        try:
+            cursor.execute(execute_sql, values)
+        except Exception as e:
+            if not retry or getattr(e, 'pgcode', None) != _PG_INVALID_STATEMENT_NAME:
+                raise
+            # 服务端语句已丢失(如执行了DISCARD ALL),回滚失败的事务后重新PREPARE
+            conn.rollback()
+            cache.clear()
+            self._count('reprepares')
+            return self._execute_sql(conn, cursor, query, args, retry=False)
+        return cursor
+
+    def _execute_cursor(self, conn, cursor, query, args):
+        if isinstance(args, dict):
+            # 预处理游标仅支持位置参数
+            cursor.execute(query, args)
+            return cursor
+
+        cache = self._cache_for(conn)
+        prepared = cache.get(query)
+        if prepared is None:
+            self._count('misses')
+            prepared = cache.raw.cursor(prepared=True)
+            evicted = cache.put(query, prepared)
+            for evicted_cursor in evicted:
+                try:
+                    evicted_cursor.close()
+                except Exception:
+                    pass
+            self._count('evictions', len(evicted))
+        else:
+            self._count('hits')
+        prepared.execute(query, args)
+        return prepared
@@ -8,9 +8,13 @@ import warnings
 import logging
 import functools
 import inspect
+import os
+import threading
 import time
 from collections import deque
 
+from commutils.common.metrics import Histogram
+
 __all__ = ['Connection', 'ConnectionPool', 'ConnectionPoolSingleton', 'logger']
 
 warnings.filterwarnings('error', category=pymysql.err.Warning)
@@ -59,13 +63,9 @@ class Connection(pymysql.connections.Connection):
                 '''reusable connection'''
                 self._pool._put_connection(self)
             else:
-                '''no reusable connection, close it and create a new one put to the pool'''
-                self._pool = None
-                try:
-                    self.close()
-                    logger.debug("Close non-reusable connection in pool(%s) caused by %s", self._pool.name, value)
-                except Exception:
-                    self._force_close()
+                '''no reusable connection, close it and release its slot in the pool'''
+                logger.debug("Close non-reusable connection in pool(%s) caused by %s", self._pool.name, value)
+                self._pool._close_connection(self)
         else:
             pymysql.connections.Connection.__exit__(self, exc, value, traceback)
 
@@ -175,39 +175,75 @@ class DictCursor(pymysql.cursors.DictCursorMixin, Cursor):
     """
 
 
+class _Waiter:
+    """A thread blocked in ConnectionPool.get_connection(), served in FIFO order"""
+    __slots__ = ('event', 'conn')
+
+    def __init__(self):
+        self.event = threading.Event()
+        # the connection handed over by the returning thread, or _NEW_CONNECTION if a free slot was handed over
+        self.conn = None
+
+
+# marks a reserved slot in the pool: the holder has to create the connection itself (outside the pool lock)
+_NEW_CONNECTION = object()
+
+
 class ConnectionPool:
     """
-    Return connection_pool object, which has method can get connection from a pool with timeout and retry feature;
+    Return connection_pool object, which has method can get connection from a pool with timeout feature;
     put a reusable connection back to the pool, etc; also we can create different instance of this class that represent
     different pool of different DB Server or different user
+
+    Threads that find the pool exhausted block on their own event instead of sleeping and retrying. A returned
+    connection (or the slot of a closed one) is handed directly to the longest waiter, so waiters are served in
+    FIFO order and a newly arriving thread can not take the connection away from them.
+    Connections are created and closed outside the pool lock.
+
+    With maintain_interval > 0 a background thread keeps the idle connections healthy (ping, lifetime, idle timeout,
+    pre-warm and shrink), so get_connection() is a local pop without network I/O and pre_ping is not needed.
+    Idle connections are then taken most-recently-returned first, leaving surplus connections idle to be reaped.
     """
 
-    def __init__(self, size=10, maxsize=100, name=None, pre_create_num=0, con_lifetime=3600, *args, **kwargs):
+    def __init__(self, size=10, maxsize=100, name=None, pre_create_num=0, con_lifetime=3600, *args,
+                 maintain_interval=0, ping_interval=60, idle_timeout=600, **kwargs):
         """
         size: int
             normal size of the pool
         maxsize: int
-            max size for scalability
+            max size for scalability, connections beyond size are only created for waiters that timed out
         name: str
             optional pool name (str)
             default: host-port-user-database
         pre_create_num: int
             create specified number connections at the init phase; otherwise will create connection when really need.
         con_lifetime: int
-            the max lifetime(seconds) of the connections, if it reach the specified seconds, when return to the pool:
-                1. if connction_number<=size, create a new connection and replace the overlifetime one in the pool;
-                   resolve the problem of mysql server side close due to 'wait_timeout'
-                2. If connction_number>size, close the connection and remove it from the pool.
-                   used for pool scalability.
+            the max lifetime(seconds) of the connections, if it reach the specified seconds, when return to the pool
+            the connection is closed and its slot is released (handed to a waiter, if any);
+            resolve the problem of mysql server side close due to 'wait_timeout', and used for pool scalability.
             in order for the arg to work as expect:
                 you should make sure that 'con_lifetime' is less than mysql's 'wait_timeout' variable.
             0 or negative means do not consider the lifetime
+        maintain_interval: float
+            seconds between two runs of the maintenance thread, 0 means no maintenance thread. Each run:
+                1. closes idle connections past con_lifetime
+                2. closes connections idle for a whole interval while the pool is above size (shrink from maxsize)
+                3. closes connections idle longer than idle_timeout while the pool is above pre_create_num
+                4. pings connections not used for ping_interval seconds, closes those that are broken
+                5. creates connections up to pre_create_num again (e.g. after failures or the server restarted)
+        ping_interval: float
+            ping idle connections not used or pinged within the specified seconds, 0 means do not ping
+        idle_timeout: float
+            close idle connections beyond pre_create_num after the specified seconds, 0 means never
         args & kwargs:
             same as pymysql.connections.Connection()
         """
         self._size = size
         self.maxsize = maxsize
-        self._pool = deque()
+        self._pool = deque()  # idle connections, put back on the left (most recently returned) and taken from the right
+        self._waiters = deque()  # threads waiting for a connection, oldest on the left
+        self._lock = threading.Lock()
+        self._total = 0  # number of all used and available connections, including slots being connected
         self._pre_create_num = pre_create_num if pre_create_num <= maxsize else maxsize
         self._con_lifetime = con_lifetime
         self._args = args
@@ -215,99 +251,261 @@ class ConnectionPool:
         self.name = name if name else '-'.join(
             [kwargs.get('host', 'localhost'), str(kwargs.get('port', 3306)),
              kwargs.get('user', ''), kwargs.get('database', '')])
-        self._created_num = deque()  # record the number of all used and available connections(use deque for thread-safe)
 
-        if pre_create_num > 0:
-            for _ in range(self._pre_create_num):
-                conn = self._create_connection()
-                self._pool.appendleft(conn)
-                conn._returned = True
-        else:
-            self._args = args
-            self._kwargs = kwargs
+        # seconds spent waiting for a free connection (or slot) in get_connection(), and spent connecting
+        self.wait_time = Histogram()
+        self.connect_time = Histogram()
+        self._counters = {'created': 0, 'closed': 0, 'handoffs': 0, 'timeouts': 0, 'overflows': 0, 'ping_failures': 0}
+
+        self._maintain_interval = maintain_interval
+        self._ping_interval = ping_interval
+        self._idle_timeout = idle_timeout
+        self._closed = threading.Event()
+        self._maintainer_pid = None
+
+        for _ in range(self._pre_create_num):
+            with self._lock:
+                self._total += 1
+            conn = self._create_connection()
+            conn._returned = True
+            self._pool.appendleft(conn)
 
-    def get_connection(self, retry_num=3, retry_interval=0.1, pre_ping=False):
+        if maintain_interval > 0:
+            self._start_maintainer()
+
+    def get_connection(self, retry_num=3, retry_interval=0.1, pre_ping=False, timeout=None):
         """
-        retry_num: int
-            how many times will retry to get a connection
-        retry_interval: float
-            timeout of get a connection from pool(0 means return or raise immediately)
+        retry_num & retry_interval:
+            kept for compatibility, without timeout the pool waits up to retry_num * retry_interval seconds
+            (retry_num is capped at 10)
         pre_ping: bool
             before return a connection, send a ping command to the Mysql server, if the connection is broken, reconnect it
+        timeout: float
+            seconds to wait for a connection once the pool reached `size` (0 means return or raise immediately);
+            on timeout a new connection is created if the pool is below `maxsize`, otherwise
+            GetConnectionFromPoolError is raised
         """
-        if retry_num > 10:
-            retry_num = 10  # retry_num hard limit
-        try:
-            conn = self._pool.pop()
-        except IndexError:
-            if self.total_num < self._size:
-                return self._create_connection()
-            if retry_num > 0:
-                retry_num -= 1
-                time.sleep(retry_interval)
-                logger.debug('Retry to get connection from pool(%s)', self.name)
-                return self.get_connection(retry_num, retry_interval, pre_ping)
+        if timeout is None:
+            timeout = min(retry_num, 10) * retry_interval
+        if self._maintain_interval > 0 and self._maintainer_pid != os.getpid():
+            # threads do not survive fork, restart the maintenance thread in the child process
+            self._start_maintainer()
+
+        start_time = time.perf_counter()
+        waiter = None
+        with self._lock:
+            if self._pool:
+                conn = self._pool.popleft() if self._maintain_interval > 0 else self._pool.pop()
+            elif self._total < self._size:
+                self._total += 1
+                conn = _NEW_CONNECTION
             else:
-                if self.total_num < self.maxsize:
-                    return self._create_connection()
-                else:
-                    raise GetConnectionFromPoolError(
-                        "can't get connection from pool({}), due to pool lack.".format(self.name))
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+
+        if waiter is not None:
+            conn = self._wait(waiter, timeout)
+        self.wait_time.observe(time.perf_counter() - start_time)
+
+        if conn is _NEW_CONNECTION:
+            return self._create_connection()
 
         # check con_lifetime
         conn._returned = False
         if self._con_lifetime > 0 and int(time.time()) - conn._create_ts >= self._con_lifetime:
-            conn._pool = None
-            try:
-                conn.close()
-            except:
-                conn._force_close()
-            self._created_num.pop()
             logger.debug("Close connection in pool(%s) due to lifetime reached", self.name)
-            # loss one, create one
+            # loss one, create one: the slot is reused by the new connection
+            self._close_connection(conn, release_slot=False)
             return self._create_connection()
-        else:
-            if pre_ping:
-                conn.ping(reconnect=True)
+
+        if pre_ping:
+            conn.ping(reconnect=True)
 
         logger.debug('Get connection from pool(%s)', self.name)
         return conn
 
+    def _wait(self, waiter, timeout):
+        if waiter.event.wait(timeout):
+            return waiter.conn
+
+        with self._lock:
+            if waiter.event.is_set():
+                # served between the timeout and acquiring the lock
+                return waiter.conn
+            self._waiters.remove(waiter)
+            self._counters['timeouts'] += 1
+            if self._total < self.maxsize:
+                self._total += 1
+                self._counters['overflows'] += 1
+                logger.debug('Pool(%s) is exhausted, create a connection beyond its size', self.name)
+                return _NEW_CONNECTION
+
+        raise GetConnectionFromPoolError(
+            "can't get connection from pool({}) within {} seconds, due to pool lack.".format(self.name, timeout))
+
     def _put_connection(self, conn):
         if not hasattr(conn, '_pool') or conn._pool is None:
             return
-        conn.cursor().close()
-        if not conn._returned:
-            # consider the connection lifetime with the purpose of reduce active connections number
-            if self._con_lifetime > 0 and int(time.time()) - conn._create_ts >= self._con_lifetime:
-                conn._pool = None
-                try:
-                    conn.close()
-                except:
-                    conn._force_close()
-                self._created_num.pop()
-                logger.debug("Close connection in pool(%s) due to lifetime reached", self.name)
-                if self.total_num >= self._size:
-                    conn._returned = True
-                    return
-                conn = self._create_connection()
-            conn._returned = True
-            self._pool.appendleft(conn)
-            logger.debug("Put connection back to pool(%s)", self.name)
-        else:
+        if conn._returned:
             raise ReturnConnectionToPoolError("this connection has already returned to the pool({})".format(self.name))
 
+        conn.cursor().close()
+        # consider the connection lifetime with the purpose of reduce active connections number
+        if self._con_lifetime > 0 and int(time.time()) - conn._create_ts >= self._con_lifetime:
+            logger.debug("Close connection in pool(%s) due to lifetime reached", self.name)
+            self._close_connection(conn)
+            return
+        if self._closed.is_set():
+            self._close_connection(conn)
+            return
+
+        conn._returned = True
+        # a connection that has just been used is known to be alive
+        conn._idle_ts = conn._ping_ts = time.time()
+        self._checkin(conn)
+        logger.debug("Put connection back to pool(%s)", self.name)
+
+    def _checkin(self, conn):
+        """hand an idle connection to the longest waiter, or put it back to the pool"""
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.conn = conn
+                self._counters['handoffs'] += 1
+                waiter.event.set()
+            else:
+                self._pool.appendleft(conn)
+
+    def _connect(self):
+        return Connection(*self._args, **self._kwargs)
+
     def _create_connection(self):
-        conn = Connection(*self._args, **self._kwargs)
+        """create a connection for a slot that has already been reserved"""
+        start_time = time.perf_counter()
+        try:
+            conn = self._connect()
+        except BaseException:
+            self._release_slot()
+            raise
+        self.connect_time.observe(time.perf_counter() - start_time)
+
         conn._pool = self
         # add attr create timestamp for connection
         conn._create_ts = int(time.time())
+        # add attrs used by the maintenance thread: since when the connection is idle, when it was known to be alive
+        conn._idle_ts = conn._ping_ts = time.time()
         # add attr indicate whether the connection has already return to pool, should not use any more
         conn._returned = False
-        self._created_num.append(1)
+        with self._lock:
+            self._counters['created'] += 1
         logger.debug('Create new connection in pool(%s)', self.name)
         return conn
 
+    def _close_connection(self, conn, release_slot=True):
+        """close a connection of this pool, its slot is handed to the longest waiter or released"""
+        conn._pool = None
+        try:
+            pymysql.connections.Connection.close(conn)
+        except Exception:
+            conn._force_close()
+        with self._lock:
+            self._counters['closed'] += 1
+        if release_slot:
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._lock:
+            if self._waiters:
+                # the waiter keeps the slot and creates the connection itself
+                waiter = self._waiters.popleft()
+                waiter.conn = _NEW_CONNECTION
+                waiter.event.set()
+            else:
+                self._total -= 1
+
+    def _start_maintainer(self):
+        with self._lock:
+            if self._maintainer_pid == os.getpid():
+                return
+            self._maintainer_pid = os.getpid()
+        thread = threading.Thread(target=self._maintain_loop, name='pymysqlpool-maintain-{}'.format(self.name),
+                                  daemon=True)
+        thread.start()
+
+    def _maintain_loop(self):
+        while not self._closed.wait(self._maintain_interval):
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception("Maintain pool(%s) failed", self.name)
+
+    def maintain(self):
+        """
+        One run of the maintenance thread, see maintain_interval.
+        Connections are taken out of the pool before being closed or pinged, so the lock is never held during I/O.
+        """
+        now = time.time()
+        closing, pinging, keep = [], [], deque()
+        with self._lock:
+            total = self._total
+            # from the longest idle connection to the most recently returned one
+            for conn in reversed(self._pool):
+                idle = now - conn._idle_ts
+                if self._con_lifetime > 0 and now - conn._create_ts >= self._con_lifetime:
+                    closing.append(conn)
+                    total -= 1
+                elif (total > self._size and idle >= self._maintain_interval) or \
+                        (total > self._pre_create_num and 0 < self._idle_timeout <= idle):
+                    closing.append(conn)
+                    total -= 1
+                elif 0 < self._ping_interval <= now - conn._ping_ts:
+                    pinging.append(conn)
+                else:
+                    keep.appendleft(conn)
+            self._pool = keep
+
+        for conn in closing:
+            logger.debug("Close idle connection in pool(%s) by maintenance", self.name)
+            self._close_connection(conn)
+
+        for conn in pinging:
+            try:
+                # the ping() method of the pooled Connection refuses returned connections
+                pymysql.connections.Connection.ping(conn, reconnect=False)
+            except Exception as e:
+                logger.debug("Close broken connection in pool(%s): %s", self.name, e)
+                with self._lock:
+                    self._counters['ping_failures'] += 1
+                self._close_connection(conn)
+                continue
+            conn._ping_ts = time.time()
+            self._checkin(conn)
+
+        self._prewarm()
+
+    def _prewarm(self):
+        """create connections until the pool has pre_create_num again"""
+        while not self._closed.is_set():
+            with self._lock:
+                if self._total >= self._pre_create_num:
+                    return
+                self._total += 1
+            try:
+                conn = self._create_connection()
+            except Exception as e:
+                logger.warning("Pre-create connection in pool(%s) failed, retry in next maintenance: %s", self.name, e)
+                return
+            conn._returned = True
+            self._checkin(conn)
+
+    def close(self):
+        """stop the maintenance thread and close the idle connections, connections in use are closed when returned"""
+        self._closed.set()
+        with self._lock:
+            idle, self._pool = list(self._pool), deque()
+        for conn in idle:
+            self._close_connection(conn)
+
     @property
     def available_num(self):
         """available connections number for now"""
@@ -316,7 +514,21 @@ class ConnectionPool:
     @property
     def total_num(self):
         """total connections number of all used and available"""
-        return len(self._created_num)
+        return self._total
+
+    @property
+    def waiting_num(self):
+        """threads waiting for a connection for now"""
+        return len(self._waiters)
+
+    @property
+    def stats(self):
+        """counters and wait/connect time summaries (seconds) of the pool"""
+        with self._lock:
+            stats = dict(self._counters, total=self._total, available=len(self._pool), waiting=len(self._waiters))
+        stats['wait_time'] = self.wait_time.snapshot()
+        stats['connect_time'] = self.connect_time.snapshot()
+        return stats
 
 
 class GetConnectionFromPoolError(Exception):
@@ -345,9 +557,23 @@ for name, fn in inspect.getmembers(Connection, inspect.isfunction):
 
 
 class ConnectionPoolSingleton(ConnectionPool):
+    """
+    every instantiation returns the same pool, which is initialized only once
+    (later calls neither reset the idle connections nor start another maintenance thread)
+    """
     _instance = None
+    _initialized = False
+    _init_lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = ConnectionPool.__new__(cls)
+        with cls._init_lock:
+            if cls._instance is None:
+                cls._instance = ConnectionPool.__new__(cls)
         return cls._instance
+
+    def __init__(self, *args, **kwargs):
+        with self._init_lock:
+            if self._initialized:
+                return
+            super(ConnectionPoolSingleton, self).__init__(*args, **kwargs)
+            type(self)._initialized = True
@@ -0,0 +1,278 @@
+""" 查询结果缓存: DBUtilsPool.get_one/get_many按"规范化SQL + 参数"缓存查询结果,写操作按表失效
+
+用法:
+    query_cache = QueryCache(RedisCache(redis_pool, codec='pickle'))
+    pool = DBUtilsPool.from_conf('pymysql', 'example_db.conf', 'mysql-dev', query_cache=query_cache)
+    pool.get_many("SELECT * FROM testdb.users WHERE age > %s", (18,), cache_ttl=60)  # 仅传入cache_ttl的查询被缓存
+失效: 复用cache.cdf的标签机制,每个缓存结果依赖其查询的各个表的标签及一个全局标签:
+    1) query_batch/bulk_insert/bulk_upsert/bulk_load,以及经get_one/get_many执行的写语句,执行后使所写表的标签失效
+    2) 无法解析出表名的写语句(如CALL)使全局标签失效,即所有查询缓存失效
+    3) 由其它系统写入时可调用invalidate(*tables)手动失效
+    标签令牌保存在缓存后端中,共享同一后端(如Redis)的多个进程之间同样生效
+结果的存储:
+    进程内后端(DictCache/BoundedCache/StripedCache)直接保存查询得到的行(元组),命中时原样返回,不复制
+    需序列化的后端(RedisCache/DiskCache等)中,columnar_min_rows行以上的结果按列保存,反序列化时只重建各列的列表;
+    命中与未命中时均返回元组(各行为元组),rowset=True时均返回RowSet,行在被访问时才构造(RowSet不能直接json序列化)
+注意:
+    1) 表名由SQL文本解析(FROM/JOIN/INSERT INTO/UPDATE/DELETE FROM等),视图、存储过程、触发器间接修改的表无法识别,需手动失效
+    2) 表名只取最后一段(不含库名),不同库的同名表共享标签,只会多失效而不会漏失效
+    3) 解析不出表名的读语句不缓存
+"""
+
+import hashlib
+import re
+import threading
+from collections.abc import Sequence
+
+from commutils.cache.backends import BoundedCache, DictCache, StripedCache
+from commutils.cache.cdf import TAG_KEY_PREFIX, _new_token, _normalize_token, invalidate_tags
+
+# 只读语句: 跳过开头的注释后以这些关键字开头,且不加锁/不写文件
+_READ_STATEMENT = re.compile(r"^(?:\s|/\*.*?\*/|--[^\n]*\n|#[^\n]*\n)*(SELECT|SHOW|DESC|DESCRIBE|EXPLAIN|WITH)\b",
+                             re.IGNORECASE | re.DOTALL)
+_LOCKING_READ = re.compile(r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b|"
+                           r"\bLOCK\s+IN\s+SHARE\s+MODE\b|\bINTO\s+(OUTFILE|DUMPFILE)\b", re.IGNORECASE)
+
+# 字符串常量与带引号的标识符,规范化SQL时原样保留
+_QUOTED = r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`"
+_NORMALIZE = re.compile(f"({_QUOTED})|\\s+", re.DOTALL)
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'", re.DOTALL)
+
+# WITH语句: 去掉字符串常量、带引号的标识符与注释后,CTE中不含写操作且主语句(括号外)为SELECT时才是只读语句
+_QUOTED_OR_COMMENT = re.compile(f"{_QUOTED}|/\\*.*?\\*/|--[^\\n]*|#[^\\n]*", re.DOTALL)
+_WRITE_KEYWORD = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+_INNERMOST_PARENS = re.compile(r"\([^()]*\)")
+_SELECT_KEYWORD = re.compile(r"\bSELECT\b", re.IGNORECASE)
+
+_NAME = r"(?:`[^`]+`|\"[^\"]+\"|[\w$]+)"
+_TABLE = f"{_NAME}(?:\\s*\\.\\s*{_NAME})*"
+_READ_TABLES = re.compile(
+    f"\\b(?:FROM|JOIN)\\s+({_TABLE}(?:\\s+(?:AS\\s+)?[\\w$]+)?(?:\\s*,\\s*{_TABLE}(?:\\s+(?:AS\\s+)?[\\w$]+)?)*)",
+    re.IGNORECASE)
+_WRITE_TABLES = re.compile(
+    r"\b(?:INSERT(?:\s+(?:IGNORE|LOW_PRIORITY|DELAYED|HIGH_PRIORITY))*\s+INTO|REPLACE(?:\s+\w+)*?\s+INTO|UPDATE|"
+    r"DELETE(?:\s+\w+)*?\s+FROM|TRUNCATE(?:\s+TABLE)?|INTO\s+TABLE|(?:ALTER|DROP|RENAME)\s+TABLE(?:\s+IF\s+EXISTS)?|"
+    f"COPY)\\s+({_TABLE})",
+    re.IGNORECASE)
+_FIRST_TABLE = re.compile(_TABLE)
+
+
+def is_read_query(query):
+    """ 判断SQL是否为只读语句(可缓存结果/可发往从库)
+    """
+    match = _READ_STATEMENT.match(query)
+    if match is None or _LOCKING_READ.search(query) is not None:
+        return False
+    if match.group(1).upper() == 'WITH':
+        return _is_read_cte(query)
+    return True
+
+
+def _is_read_cte(query):
+    # 如MySQL 8的WITH ... UPDATE,PostgreSQL的WITH d AS (DELETE ... RETURNING *) SELECT ...均为写语句
+    text = _QUOTED_OR_COMMENT.sub(' ', query)
+    if _WRITE_KEYWORD.search(text):
+        return False
+    while True:
+        text, count = _INNERMOST_PARENS.subn(' ', text)
+        if not count:
+            break
+    return _SELECT_KEYWORD.search(text) is not None
+
+
+def normalize_sql(query):
+    """ 规范化SQL: 合并字符串常量以外的连续空白,去掉首尾空白与结尾的分号
+    """
+    return _NORMALIZE.sub(lambda match: match.group(1) or ' ', query).strip().rstrip(';').rstrip()
+
+
+def _table_name(name):
+    # 只取最后一段并去掉引号: `testdb`.`users` -> users
+    return re.split(r"\s*\.\s*", name)[-1].strip('`"').lower()
+
+
+def read_tables(query):
+    """ 解析读语句所查询的表(FROM/JOIN之后的表名)
+    """
+    query = _STRING_LITERAL.sub("''", query)
+    tables = set()
+    for clause in _READ_TABLES.findall(query):
+        for item in clause.split(','):
+            match = _FIRST_TABLE.match(item.strip())
+            if match:
+                tables.add(_table_name(match.group(0)))
+    return sorted(tables)
+
+
+def written_tables(query):
+    """ 解析写语句所修改的表,无法解析时返回空列表
+    """
+    query = _STRING_LITERAL.sub("''", query)
+    return sorted({_table_name(name) for name in _WRITE_TABLES.findall(query)})
+
+
+class RowSet(Sequence):
+    """ 按列保存的多行结果的只读视图,行(元组)在被访问时才构造
+    """
+    __slots__ = ('_columns', '_length')
+
+    def __init__(self, columns, length):
+        self._columns = columns
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(*(column[index] for column in self._columns)))
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('RowSet index out of range')
+        return tuple(column[index] for column in self._columns)
+
+    def __iter__(self):
+        return zip(*self._columns)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, RowSet)) or len(self) != len(other):
+            return False
+        return all(row == other_row for row, other_row in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"RowSet({self._length} rows, {len(self._columns)} columns)"
+
+    @property
+    def columns(self):
+        """ 各列的值列表
+        """
+        return self._columns
+
+
+class QueryCache:
+    """ 查询结果缓存类,由DBUtilsPool(query_cache=...)使用,多个连接池(如读写分离的各后端)可共用同一实例
+    """
+
+    def __init__(self, backend, namespace='query', tag_ttl=2592000, columnar=None, columnar_min_rows=100,
+                 rowset=False):
+        """
+        :param backend: 缓存后端,多进程部署时使用RedisCache等共享后端才能在进程间失效
+        :param namespace: 缓存键与标签的前缀
+        :param tag_ttl: 表标签令牌的过期时间(秒),应大于所有查询的cache_ttl
+        :param columnar: 是否按列保存多行结果,None表示进程内后端不按列保存、其它后端按列保存
+        :param columnar_min_rows: 按列保存的最少行数
+        :param rowset: 按列保存的结果是否以RowSet返回(命中与未命中时一致),否则返回元组
+        """
+        self._backend = backend
+        self.namespace = namespace
+        self._tag_ttl = tag_ttl
+        if columnar is None:
+            columnar = not isinstance(backend, (DictCache, BoundedCache, StripedCache))
+        self._columnar = columnar
+        self._columnar_min_rows = columnar_min_rows
+        self._rowset = rowset
+        self._global_tag = f"{namespace}:*"
+        self._counters = {'hits': 0, 'misses': 0, 'uncacheable': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def _count(self, counter, count=1):
+        with self._lock:
+            self._counters[counter] += count
+
+    def make_key(self, kind, query, args):
+        """ 缓存键: 命名空间 + 取数方式(one/many:size) + 规范化SQL与参数的摘要
+        """
+        if isinstance(args, dict):
+            args = sorted(args.items())
+        elif args is not None:
+            args = tuple(args)
+        body = f"{normalize_sql(query)}\x00{args!r}"
+        return f"{self.namespace}:{kind}:{hashlib.blake2b(body.encode(), digest_size=16).hexdigest()}"
+
+    def _table_tags(self, tables):
+        return [f"{self.namespace}:table:{table}" for table in tables]
+
+    def execute(self, kind, query, args, ttl, load):
+        """ 执行一次get_one/get_many: 读语句且ttl不为空时经缓存读取,写语句执行后使所写表的缓存失效
+
+        :param kind: 取数方式,参与生成缓存键,如'one'/'many:None'
+        :param query:
+        :param args:
+        :param ttl: 缓存时间(秒),None或0表示不缓存
+        :param load: 执行查询的函数
+        :return:
+        """
+        if not is_read_query(query):
+            try:
+                return load()
+            finally:
+                self.invalidate_query(query)
+        if not ttl:
+            return load()
+
+        tables = read_tables(query)
+        if not tables:
+            self._count('uncacheable')
+            return load()
+
+        key = self.make_key(kind, query, args)
+        tag_keys = [TAG_KEY_PREFIX + tag for tag in [self._global_tag] + self._table_tags(tables)]
+        found = self._backend.get_many([key, *tag_keys])
+        tokens = {tag_key: _normalize_token(found.get(tag_key)) for tag_key in tag_keys}
+        raw = found.get(key)
+        if raw is not None and raw[0] == tokens:
+            self._count('hits')
+            return self._unpack(raw[1])
+
+        self._count('misses')
+        # 令牌须在查询之前读取: 查询期间表被写入时,本次写入的缓存在下次读取时即不再有效
+        missing = {tag_key: _new_token() for tag_key, token in tokens.items() if token is None}
+        if missing:
+            self._backend.set_many(missing, self._tag_ttl)
+            tokens.update(missing)
+        value = load()
+        payload = self._pack(value)
+        self._backend.set(key, (tokens, payload), ttl)
+        if payload[0] == 'columns':
+            return self._unpack(payload) if self._rowset else tuple(value)
+        return payload[1]
+
+    def _pack(self, value):
+        if isinstance(value, list):
+            # fetchall可能返回列表,保存为元组,进程内后端命中时返回的对象不会被调用者修改
+            value = tuple(value)
+        if (self._columnar and isinstance(value, tuple) and value and len(value) >= self._columnar_min_rows
+                and isinstance(value[0], (tuple, list))):
+            return 'columns', len(value), [list(column) for column in zip(*value)]
+        return 'rows', value
+
+    def _unpack(self, payload):
+        if payload[0] == 'columns':
+            if self._rowset:
+                return RowSet(payload[2], payload[1])
+            return tuple(zip(*payload[2]))
+        return payload[1]
+
+    def invalidate(self, *tables):
+        """ 使查询了指定表的缓存失效,未传入表名时使所有查询缓存失效
+        """
+        tags = self._table_tags(sorted({_table_name(table) for table in tables})) if tables else [self._global_tag]
+        invalidate_tags(self._backend, tags, self._tag_ttl)
+        self._count('invalidations')
+
+    def invalidate_query(self, query):
+        """ 写语句执行后调用: 使其所写的表的缓存失效,无法解析表名时使所有查询缓存失效
+        """
+        self.invalidate(*written_tables(query))
@@ -3,13 +3,32 @@
 依赖：redis-3.5.3 redis-py-cluster-2.1.3 (latest version, 2024起不再维护)
 """
 
+import binascii
 import redis
 from rediscluster import RedisCluster, ClusterBlockingConnectionPool
 
-from typing import Union
+from typing import Any, Iterable, Iterator, List, Tuple, Union
 from commutils.parser.conf_parser import ConfigAgent
 
 
+REDIS_CLUSTER_SLOTS = 16384
+
+
+def key_slot(key: Union[str, bytes]) -> int:
+    """ 计算键在Redis集群中的哈希槽: CRC16(XMODEM) % 16384,支持"{hashtag}"
+
+    :param key:
+    :return:
+    """
+    key = key.encode() if isinstance(key, str) else key
+    start = key.find(b'{')
+    if start > -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return binascii.crc_hqx(key, 0) % REDIS_CLUSTER_SLOTS
+
+
 class RedisPool:
     """ Redis连接池类
 
@@ -62,6 +81,20 @@ class RedisPool:
 
         return cls(url, False, **kwargs)
 
+    @classmethod
+    def from_client(cls, client, is_cluster=False):
+        """ 包装已创建的客户端对象(如测试中使用的fakeredis.FakeStrictRedis)
+
+        :param client:
+        :param is_cluster:
+        :return:
+        """
+        pool = cls.__new__(cls)
+        pool.is_cluster = is_cluster
+        pool._conn_pool = getattr(client, 'connection_pool', None)
+        pool.conn = client
+        return pool
+
     def _connect_url(self, url, **kwargs):
         """ 通过指定URL连接
 
@@ -122,10 +155,123 @@ class RedisPool:
     def delete(self, *names):
         return self.conn.delete(*names)
 
+    def publish(self, channel, message):
+        return self.conn.publish(channel, message)
+
+    def unlink(self, *names):
+        """ 非阻塞删除(Redis>=4.0),键对应的内存由Redis后台线程释放
+
+        集群模式下多个键可能分布在不同slot,按slot分组后逐批删除
+        """
+        if not self.is_cluster:
+            return self.conn.unlink(*names)
+
+        return sum(result for _, result in self.execute_batches(names, lambda target, batch: target.unlink(*batch)))
+
+    def iter_key_batches(self, keys: Iterable, size: int = None) -> Iterator[List]:
+        """ 将键切分为批次,用于MGET/DEL等多键命令
+
+        集群模式下同一批次内的键位于同一个slot,以避免CROSSSLOT错误
+        :param keys:
+        :param size: 每批最多的键数量,None表示不限制
+        :return:
+        """
+        if self.is_cluster:
+            groups = {}
+            for key in keys:
+                groups.setdefault(key_slot(key), []).append(key)
+            groups = groups.values()
+        else:
+            groups = [keys if isinstance(keys, list) else list(keys)]
+
+        for group in groups:
+            if size is None:
+                yield group
+            else:
+                for i in range(0, len(group), size):
+                    yield group[i:i + size]
+
+    def execute_batches(self, keys: Iterable, command, size: int = None) -> List[Tuple[List, Any]]:
+        """ 将键分批(见iter_key_batches)执行多键命令(MGET/MSET/DEL/UNLINK等)
+
+        单机模式下各批次在同一个非事务pipeline中发送;集群模式下redis-py-cluster的pipeline不支持MGET/MSET,
+        DEL/UNLINK也只接受一个键,因此逐批直接调用(同一批次的键位于同一个slot)
+        :param keys:
+        :param command: command(target, batch),target为pipeline或连接
+        :param size: 每批最多的键数量,None表示不限制
+        :return: [(批次, 命令结果)]
+        """
+        batches = list(self.iter_key_batches(keys, size))
+        if self.is_cluster:
+            return [(batch, command(self.conn, batch)) for batch in batches]
+
+        with self.conn.pipeline(transaction=False) as pipe:
+            for batch in batches:
+                command(pipe, batch)
+            return list(zip(batches, pipe.execute()))
+
+    def scan_iter(self, match=None, count=None):
+        return self.conn.scan_iter(match=match, count=count)
+
     def pipeline(self, transaction=True, shard_hint=None):
         return self.conn.pipeline(transaction, shard_hint)
 
 
+class AsyncRedisPool:
+    """ asyncio版Redis连接池类,供FastAPI等异步框架使用,避免Redis I/O阻塞事件循环
+
+    依赖: redis>=4.2 (redis.asyncio); 注意与redis-py-cluster(要求redis<4)存在版本冲突,且不支持集群
+    """
+    def __init__(self, url: str = None, **kwargs):
+        from redis import asyncio as aioredis
+
+        if url:
+            self._conn_pool = aioredis.ConnectionPool.from_url(url, **kwargs)
+        else:
+            self._conn_pool = aioredis.ConnectionPool(**kwargs)
+        self.conn = aioredis.StrictRedis(connection_pool=self._conn_pool)
+
+    @classmethod
+    def from_conf(cls, filename, section):
+        config_agent = ConfigAgent()
+        config_agent.read(filename)
+        kwargs = config_agent.get_dict(section)
+        assert len(str(kwargs.get("host", "")).split(',')) <= 1, "AsyncRedisPool不支持集群配置"
+
+        return cls(None, **kwargs)
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        assert url is not None, "URL参数不能为空"
+
+        return cls(url, **kwargs)
+
+    """以下提供常用操作方法封装。也可以直接使用实例的conn属性来调用"""
+    async def set(self, name, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
+        return await self.conn.set(name, value, ex=ex, px=px, nx=nx, xx=xx, keepttl=keepttl)
+
+    async def mset(self, mapping):
+        return await self.conn.mset(mapping)
+
+    async def get(self, name):
+        return await self.conn.get(name)
+
+    async def mget(self, keys, *args):
+        return await self.conn.mget(keys, *args)
+
+    async def delete(self, *names):
+        return await self.conn.delete(*names)
+
+    async def publish(self, channel, message):
+        return await self.conn.publish(channel, message)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return self.conn.pipeline(transaction, shard_hint)
+
+    async def close(self):
+        await self._conn_pool.disconnect()
+
+
 if __name__ == '__main__':
     import time
 
@@ -0,0 +1,450 @@
+""" 读写分离连接池: 写操作与事务发往主库,读操作在多个从库间负载均衡
+
+由多个DBUtilsPool组成(每个后端一个),对外提供与DBUtilsPool相同的查询方法:
+    get_one/get_many/iter_rows/iter_batches  按SQL判断,只读语句(SELECT/SHOW/EXPLAIN等,不含FOR UPDATE)发往从库,其它发往主库
+    query_batch/bulk_insert/bulk_upsert/bulk_load/get_cursor  发往主库
+    transaction()  在主库连接上执行事务,正常结束时提交、异常时回滚
+    use_primary()  当前线程在with块内的所有读操作也发往主库(读自己刚写入的数据)
+从库选择: round_robin(轮询)或least_outstanding(当前执行中的请求数最少);所有从库不可用时读操作发往主库
+从库摘除:
+    1) 被动: 连续max_failures次连接错误(驱动的OperationalError/InterfaceError)后摘除eject_seconds秒,期满后重新尝试
+    2) 主动: check_interval大于0时后台线程定期检查从库,查询失败或复制延迟超过max_lag秒时摘除,恢复后重新加入
+复制延迟的查询: MySQL为SHOW REPLICA STATUS的Seconds_Behind_Source(8.0.22之前的版本不支持该语句时退回
+SHOW SLAVE STATUS的Seconds_Behind_Master,8.4起已移除SHOW SLAVE STATUS),PostgreSQL为最后回放事务的时间差;
+也可通过lag_query指定返回延迟秒数的SQL,lag_query = none时仅检查连通性(如Doris的多个FE之间没有复制延迟)
+
+配置(example_db.conf):
+    [mysql-cluster]
+    primary = mysql-dev
+    replicas = mysql-replica1, mysql-replica2
+    balance = least_outstanding
+    max_lag = 5
+    check_interval = 5
+主库与各从库的连接参数分别位于primary/replicas指定的section
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from commutils.common.metrics import Histogram
+from commutils.db import bulk
+from commutils.db.dbapi_conn import DBUtilsPool
+from commutils.db.query_cache import is_read_query
+from commutils.parser.conf_parser import ConfigAgent
+
+logger = logging.getLogger(__name__)
+
+BALANCE_STRATEGIES = ('round_robin', 'least_outstanding')
+
+# 各方言默认的复制延迟查询
+_LAG_QUERIES = {
+    'mysql': "SHOW REPLICA STATUS",
+    'postgresql': "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                  "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END",
+}
+# MySQL 8.0.22之前(及MariaDB 10.5之前)的复制状态语句,8.4起已移除
+_MYSQL_LEGACY_LAG_QUERY = "SHOW SLAVE STATUS"
+# SHOW REPLICA STATUS(MySQL 8.0.22+)/SHOW SLAVE STATUS中的延迟列
+_MYSQL_LAG_COLUMNS = ('Seconds_Behind_Source', 'Seconds_Behind_Master')
+# MySQL错误码: SQL语法错误
+_MYSQL_PARSE_ERROR = 1064
+
+# 配置文件中路由相关的选项,其余选项不被接受
+_ROUTING_OPTIONS = ('primary', 'replicas', 'balance', 'max_lag', 'check_interval', 'max_failures', 'eject_seconds',
+                    'sticky_seconds', 'lag_query')
+
+
+class Backend:
+    """ 路由池中的一个后端(主库或从库)及其状态与统计
+    """
+
+    def __init__(self, name, pool, role):
+        self.name = name
+        self.pool = pool
+        self.role = role
+        self.healthy = True  # 后台检查的结果
+        self.ejected_until = 0  # 被动摘除的截止时间
+        self.failures = 0  # 连续的连接错误次数
+        self.outstanding = 0  # 执行中的请求数
+        self.lag = None  # 最近一次检查得到的复制延迟(秒)
+        self.lag_query = None  # 该后端实际使用的延迟查询,MySQL不支持SHOW REPLICA STATUS时为SHOW SLAVE STATUS
+        self.latency = Histogram()
+        self.counters = {'queries': 0, 'errors': 0, 'ejections': 0}
+
+    def available(self, now):
+        return self.healthy and self.ejected_until <= now
+
+    def snapshot(self, now):
+        return dict(self.counters, role=self.role, available=self.available(now), healthy=self.healthy,
+                    outstanding=self.outstanding, lag=self.lag, latency=self.latency.snapshot())
+
+
+class RoutingPool:
+    """ 读写分离连接池类
+    """
+
+    def __init__(self, primary, replicas=None, balance='round_robin', max_lag=None, check_interval=0, max_failures=3,
+                 eject_seconds=30, sticky_seconds=0, lag_query=None):
+        """
+        :param primary: 主库的连接池
+        :type primary: DBUtilsPool
+
+        :param replicas: 从库的连接池,名称 -> 连接池;为空时所有操作发往主库
+        :type replicas: dict
+
+        :param balance: 从库选择策略: round_robin或least_outstanding
+        :type balance: str
+
+        :param max_lag: 从库允许的最大复制延迟(秒),None表示不检查延迟,仅检查连通性
+        :type max_lag: float
+
+        :param check_interval: 后台检查从库的间隔(秒),0表示不启动后台检查
+        :type check_interval: float
+
+        :param max_failures: 连续发生多少次连接错误后摘除从库
+        :type max_failures: int
+
+        :param eject_seconds: 被动摘除的时长(秒)
+        :type eject_seconds: float
+
+        :param sticky_seconds: 当前线程写入主库后,多少秒内的读操作仍发往主库,用于规避复制延迟
+        :type sticky_seconds: float
+
+        :param lag_query: 复制延迟的查询语句(返回延迟秒数),None表示按方言使用默认查询,'none'表示仅检查连通性
+        :type lag_query: str
+        """
+        assert balance in BALANCE_STRATEGIES, f"不支持的负载均衡策略: {balance}"
+        self.primary = Backend('primary', primary, 'primary')
+        self.replicas = [Backend(name, pool, 'replica') for name, pool in (replicas or {}).items()]
+        self.balance = balance
+        self.max_lag = max_lag
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.sticky_seconds = sticky_seconds
+        if lag_query is None:
+            lag_query = _LAG_QUERIES.get(bulk.get_dialect(primary.driver.__name__))
+        self.lag_query = None if lag_query in (None, 'none') else lag_query
+
+        self._lock = threading.Lock()
+        self._next = 0  # 轮询计数
+        self._local = threading.local()  # 当前线程的primary_depth(use_primary嵌套层数)与sticky_until
+        self._check_interval = check_interval
+        self._closed = threading.Event()
+        self._checker_pid = None
+        if check_interval > 0 and self.replicas:
+            self._start_checker()
+
+    @classmethod
+    def from_conf(cls, db_module_str, filename, section, **pool_kwargs):
+        """ 由配置文件创建,section中的primary/replicas为主库与从库连接参数所在的section
+
+        :param db_module_str: 驱动模块名
+        :param filename: 配置文件
+        :param section: 路由配置所在的section
+        :param pool_kwargs: 传给各个DBUtilsPool的参数,如prepare_cache_size
+        :return:
+        """
+        config_agent = ConfigAgent()
+        config_agent.read(filename)
+        options = config_agent.get_dict(section)
+        unknown = set(options) - set(_ROUTING_OPTIONS)
+        assert not unknown, f"未知的路由配置: {', '.join(sorted(unknown))}"
+
+        def make_pool(name):
+            return DBUtilsPool(db_module_str, **dict(config_agent.get_dict(name), **pool_kwargs))
+
+        replica_names = [name.strip() for name in str(options.pop('replicas', '')).split(',') if name.strip()]
+        kwargs = {key: float(options[key]) for key in ('max_lag', 'check_interval', 'eject_seconds', 'sticky_seconds')
+                  if key in options}
+        for key in ('balance', 'max_failures', 'lag_query'):
+            if key in options:
+                kwargs[key] = options[key]
+        return cls(make_pool(options['primary']), {name: make_pool(name) for name in replica_names}, **kwargs)
+
+    @contextmanager
+    def use_primary(self):
+        """ with块内当前线程的读操作也发往主库
+        """
+        self._local.primary_depth = getattr(self._local, 'primary_depth', 0) + 1
+        try:
+            yield self
+        finally:
+            self._local.primary_depth -= 1
+
+    def _pinned(self):
+        return getattr(self._local, 'primary_depth', 0) > 0 or getattr(self._local, 'sticky_until', 0) > time.time()
+
+    def _wrote(self):
+        if self.sticky_seconds > 0:
+            self._local.sticky_until = time.time() + self.sticky_seconds
+
+    def _choose_replica(self, exclude=()):
+        """ 选择一个可用的从库并计入执行中的请求数,没有可用的从库时返回None
+        """
+        if self._check_interval > 0 and self._checker_pid != os.getpid():
+            # fork后后台线程不会被继承
+            self._start_checker()
+        now = time.time()
+        with self._lock:
+            candidates = [backend for backend in self.replicas
+                          if backend.available(now) and backend not in exclude]
+            if not candidates:
+                return None
+            self._next += 1
+            start = self._next % len(candidates)
+            if self.balance == 'round_robin':
+                backend = candidates[start]
+            else:
+                # 从轮询位置开始找,执行中的请求数相同时依次使用不同的从库
+                backend = min(candidates[start:] + candidates[:start], key=lambda b: b.outstanding)
+            backend.outstanding += 1
+            return backend
+
+    def _acquire(self, read):
+        if read and self.replicas and not self._pinned():
+            backend = self._choose_replica()
+            if backend is not None:
+                return backend
+        with self._lock:
+            self.primary.outstanding += 1
+        return self.primary
+
+    def _release(self, backend, start_time, error=None):
+        elapsed = time.perf_counter() - start_time
+        backend.latency.observe(elapsed)
+        connection_error = error is not None and self._is_connection_error(backend, error)
+        with self._lock:
+            backend.outstanding -= 1
+            backend.counters['queries'] += 1
+            if error is None:
+                backend.failures = 0
+                return
+            backend.counters['errors'] += 1
+            if not connection_error:
+                return
+            backend.failures += 1
+            if backend.role == 'replica' and backend.failures >= self.max_failures:
+                backend.failures = 0
+                backend.ejected_until = time.time() + self.eject_seconds
+                backend.counters['ejections'] += 1
+                logger.warning("Eject replica %s for %ss after %s connection errors: %s",
+                               backend.name, self.eject_seconds, self.max_failures, error)
+
+    @staticmethod
+    def _is_connection_error(backend, error):
+        driver = backend.pool.driver
+        if not isinstance(error, tuple(getattr(driver, name) for name in ('OperationalError', 'InterfaceError')
+                                       if hasattr(driver, name))):
+            return False
+        if bulk.get_dialect(driver.__name__) == 'mysql':
+            # 服务端错误(如锁等待超时)也可能是OperationalError,客户端错误码(2000-2999)才是连接错误
+            code = error.args[0] if error.args else None
+            return not isinstance(code, int) or 2000 <= code < 3000
+        return True
+
+    def _execute(self, read, func):
+        """ 在选出的后端上执行func(pool),只读操作因连接错误失败时换一个后端重试一次
+        """
+        backend = self._acquire(read)
+        start_time = time.perf_counter()
+        try:
+            result = func(backend.pool)
+        except Exception as e:
+            self._release(backend, start_time, e)
+            if backend.role != 'replica' or not self._is_connection_error(backend, e):
+                raise
+            retry = self._choose_replica(exclude=(backend,))
+            if retry is None:
+                with self._lock:
+                    self.primary.outstanding += 1
+                retry = self.primary
+            logger.info("Retry read on %s after error on replica %s: %s", retry.name, backend.name, e)
+            return self._execute_on(retry, func)
+        self._release(backend, start_time)
+        if not read:
+            self._wrote()
+        return result
+
+    def _execute_on(self, backend, func):
+        start_time = time.perf_counter()
+        try:
+            result = func(backend.pool)
+        except Exception as e:
+            self._release(backend, start_time, e)
+            raise
+        self._release(backend, start_time)
+        return result
+
+    def _stream(self, read, func):
+        """ 流式查询在生成器的整个生命周期内占用后端,中途失败时不重试
+        """
+        backend = self._acquire(read)
+        start_time = time.perf_counter()
+        try:
+            yield from func(backend.pool)
+        except Exception as e:
+            self._release(backend, start_time, e)
+            raise
+        except GeneratorExit:
+            self._release(backend, start_time)
+            raise
+        self._release(backend, start_time)
+        if not read:
+            self._wrote()
+
+    @contextmanager
+    def get_cursor(self, readonly=False):
+        """ 返回(连接, 游标),readonly为True时使用从库
+        """
+        backend = self._acquire(readonly)
+        start_time = time.perf_counter()
+        try:
+            with backend.pool.get_cursor() as (conn, cursor):
+                yield conn, cursor
+        except Exception as e:
+            self._release(backend, start_time, e)
+            raise
+        self._release(backend, start_time)
+        if not readonly:
+            self._wrote()
+
+    @contextmanager
+    def transaction(self):
+        """ 在主库连接上执行事务: 正常结束时提交,发生异常时回滚
+
+        事务内的读操作应使用返回的游标,通过get_one等方法发起的查询使用的是其它连接
+        """
+        with self.get_cursor() as (conn, cursor):
+            try:
+                yield conn, cursor
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def get_one(self, query, args, cache_ttl=None):
+        return self._execute(is_read_query(query), lambda pool: pool.get_one(query, args, cache_ttl))
+
+    def get_many(self, query, args, size=None, cache_ttl=None):
+        return self._execute(is_read_query(query), lambda pool: pool.get_many(query, args, size, cache_ttl))
+
+    def iter_rows(self, query, args=None, fetch_size=1000):
+        return self._stream(is_read_query(query), lambda pool: pool.iter_rows(query, args, fetch_size))
+
+    def iter_batches(self, query, args=None, batch_size=1000):
+        return self._stream(is_read_query(query), lambda pool: pool.iter_batches(query, args, batch_size))
+
+    def query_batch(self, query, args):
+        return self._execute(False, lambda pool: pool.query_batch(query, args))
+
+    def bulk_insert(self, table, columns, rows, **kwargs):
+        return self._execute(False, lambda pool: pool.bulk_insert(table, columns, rows, **kwargs))
+
+    def bulk_upsert(self, table, columns, rows, **kwargs):
+        return self._execute(False, lambda pool: pool.bulk_upsert(table, columns, rows, **kwargs))
+
+    def bulk_load(self, table, columns, rows, **kwargs):
+        return self._execute(False, lambda pool: pool.bulk_load(table, columns, rows, **kwargs))
+
+    def _start_checker(self):
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+        thread = threading.Thread(target=self._check_loop, name='routing-pool-check', daemon=True)
+        thread.start()
+
+    def _check_loop(self):
+        while not self._closed.wait(self._check_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Check replicas failed")
+
+    def check(self):
+        """ 检查所有从库的连通性与复制延迟,摘除异常的从库并恢复已正常的从库(后台线程每check_interval秒执行一次)
+        """
+        for backend in self.replicas:
+            try:
+                lag = self._replica_lag(backend)
+                healthy = self.max_lag is None or (lag is not None and lag <= self.max_lag)
+                reason = f"replication lag {lag}s"
+            except Exception as e:
+                lag, healthy, reason = None, False, str(e)
+
+            with self._lock:
+                backend.lag = lag
+                if backend.healthy != healthy:
+                    if healthy:
+                        logger.warning("Replica %s is back in rotation", backend.name)
+                    else:
+                        backend.counters['ejections'] += 1
+                        logger.warning("Eject replica %s: %s", backend.name, reason)
+                backend.healthy = healthy
+
+    def _replica_lag(self, backend):
+        """ 查询从库的复制延迟(秒),复制已停止时返回None;未配置延迟查询时仅检查连通性,返回None
+        """
+        query = backend.lag_query or self.lag_query
+        with backend.pool.get_cursor() as (conn, cursor):
+            try:
+                cursor.execute(query or "SELECT 1")
+            except Exception as e:
+                if query != _LAG_QUERIES['mysql'] or not e.args or e.args[0] != _MYSQL_PARSE_ERROR:
+                    raise
+                query = backend.lag_query = _MYSQL_LEGACY_LAG_QUERY
+                cursor.execute(query)
+            row = cursor.fetchone()
+            if query is None or row is None:
+                return None
+            if isinstance(row, dict):
+                # 连接参数中配置了cursorclass=DictCursor等返回字典的游标
+                columns, row = list(row), list(row.values())
+            else:
+                columns = [description[0] for description in cursor.description]
+            if query in (_LAG_QUERIES['mysql'], _MYSQL_LEGACY_LAG_QUERY):
+                column = next(name for name in _MYSQL_LAG_COLUMNS if name in columns)
+                value = row[columns.index(column)]
+            else:
+                value = row[0]
+        return float(value) if value is not None else None
+
+    @property
+    def stats(self):
+        """ 各后端的请求数、错误数、摘除次数、执行中的请求数、复制延迟与耗时分布(秒)
+        """
+        now = time.time()
+        with self._lock:
+            return {backend.name: backend.snapshot(now) for backend in [self.primary] + self.replicas}
+
+    def close(self):
+        """ 停止后台检查线程,各后端连接池由创建者负责关闭
+        """
+        self._closed.set()
+
+
+if __name__ == '__main__':
+    # 加锁读(含PostgreSQL的FOR NO KEY UPDATE/FOR KEY SHARE)与修改数据的CTE不是只读语句,发往主库
+    assert is_read_query("WITH recent AS (SELECT * FROM orders) SELECT * FROM recent")
+    assert not is_read_query("SELECT * FROM orders WHERE id = %s FOR NO KEY UPDATE")
+    assert not is_read_query("SELECT * FROM orders WHERE id = %s FOR KEY SHARE")
+    assert not is_read_query("WITH moved AS (DELETE FROM orders RETURNING *) SELECT * FROM moved")
+
+    pool = RoutingPool.from_conf('pymysql', 'example_db.conf', 'mysql-cluster')
+
+    # 只读查询发往从库
+    print(pool.get_many("SELECT * FROM testdb.debezium_demo", ()))
+    # 写操作与事务发往主库
+    print(pool.get_one("INSERT INTO testdb.debezium_demo (id, name) VALUES (%s, %s)", ("9", "n9")))
+    with pool.transaction() as (conn, cursor):
+        cursor.execute("SELECT * FROM testdb.debezium_demo WHERE id = %s FOR UPDATE", ("9",))
+        cursor.execute("UPDATE testdb.debezium_demo SET name = %s WHERE id = %s", ("m9", "9"))
+    # 读自己刚写入的数据
+    with pool.use_primary():
+        print(pool.get_one("SELECT * FROM testdb.debezium_demo WHERE id = %s", ("9",)))
+    pool.check()
+    print(pool.stats)
+    pool.close()
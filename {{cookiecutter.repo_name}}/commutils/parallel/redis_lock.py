@@ -0,0 +1,88 @@
+""" 基于Redis的分布式锁(租约)
+
+加锁: SET key token NX EX ttl, 持有者进程崩溃时锁会在ttl秒后自动释放
+解锁: 通过Lua脚本比对token后再删除,避免误删租约过期后被其它进程获得的锁
+"""
+
+import time
+import uuid
+
+from commutils.db.redis_conn import RedisPool
+
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """ Redis分布式锁类
+
+    注: 锁不可重入,且不会自动续期,ttl应大于临界区的最长执行时间
+    """
+
+    def __init__(self, pool: RedisPool, name, ttl=10, sleep=0.05):
+        """
+        :param pool: Redis连接池
+        :param name: 锁对应的键名
+        :param ttl: 租约时长(秒)
+        :param sleep: 阻塞加锁时的轮询间隔(秒)
+        """
+        self._pool = pool
+        self.name = name
+        self.ttl = ttl
+        self.sleep = sleep
+        self._token = None
+
+    def acquire(self, blocking=True, timeout=None) -> bool:
+        """ 加锁
+
+        :param blocking: 是否阻塞等待
+        :param timeout: 阻塞等待的最长时间(秒),None表示一直等待
+        :return: 是否加锁成功
+        """
+        token = uuid.uuid4().hex
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self._pool.set(self.name, token, ex=self.ttl, nx=True):
+                self._token = token
+                return True
+            if not blocking or (deadline is not None and time.time() >= deadline):
+                return False
+            time.sleep(self.sleep)
+
+    def release(self) -> bool:
+        """ 解锁
+
+        :return: 是否由本实例删除了锁(租约已过期时返回False)
+        """
+        if self._token is None:
+            return False
+
+        token, self._token = self._token, None
+        return bool(self._pool.conn.eval(_RELEASE_SCRIPT, 1, self.name, token))
+
+    @property
+    def locked(self) -> bool:
+        return self._token is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+if __name__ == '__main__':
+    redis_pool = RedisPool.from_url("redis://localhost:6379/1", decode_responses=True)
+
+    lock = RedisLock(redis_pool, 'LOCK:DEMO', ttl=2)
+    print("first acquire: ", lock.acquire(blocking=False))
+    print("second acquire: ", RedisLock(redis_pool, 'LOCK:DEMO').acquire(blocking=False))
+    print("release: ", lock.release())
+    with RedisLock(redis_pool, 'LOCK:DEMO') as lock:
+        print("locked in context: ", lock.locked)
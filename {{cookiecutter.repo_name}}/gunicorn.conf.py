@@ -198,6 +198,18 @@ def pre_exec(server):
 
 def when_ready(server):
     server.log.info("Server is ready. Spawning workers")
+    # Read-mostly data shared by all workers is built here, once, before any
+    # worker is forked; workers attach to it by name. See
+    # commutils.cache.backends.SharedMemoryCache.
+    # from commutils.cache.backends import SharedMemoryCache
+    # server.shm_cache = SharedMemoryCache.from_directory('app-models', 'static/models')
+
+
+def on_exit(server):
+    # Shared memory segments outlive the processes that created them.
+    shm_cache = getattr(server, 'shm_cache', None)
+    if shm_cache is not None:
+        shm_cache.unlink()
 
 
 def worker_int(worker):